@@ -0,0 +1,304 @@
+"""
+Analityka kosztów floty na zakończonych zgłoszeniach.
+
+Dane są ładowane raz do kolumn (NumPy, jeśli jest zainstalowane, albo
+array z biblioteki standardowej), a statystyki liczone przebiegami po
+całych kolumnach — w NumPy bez pętli Pythona po wierszach (daty i braki
+zamienia na liczby SQLite, grupy koduje np.unique). Wynik jest trzymany w pamięci do następnej zmiany
+zbioru danych (db.row_version(path, "dataset", 0) — set_service_result,
+edycja auta, archiwizacja).
+
+Kwoty są w groszach (int): sumy grup i trend są dokładne, średnie,
+odchylenia i koszt na km to wartości przybliżone (float, też w groszach).
+"""
+import math
+import threading
+from array import array
+
+import db
+
+try:
+    import numpy as np
+except ImportError:  # NumPy jest opcjonalne
+    np = None
+
+OUTLIER_Z = 3.0
+GROUPS = ("car", "model", "company", "fuel")
+
+CACHE_FILES = 16
+
+_cache = {}   # plik -> (wersja, wynik); wątki raportów — pod _cache_lock
+_cache_lock = threading.Lock()
+_evictions = 0
+
+
+INT_COLUMNS = 7      # pierwsze kolumny db.DONE_COLUMNS to liczby, reszta — teksty
+
+
+class Columns:
+    """Kolumnowy zestaw zakończonych zgłoszeń, posortowany po (auto, data)."""
+
+    def __init__(self, rows):
+        self.n = len(rows)
+        if np is not None:
+            self._from_numpy(rows)
+        else:
+            self._from_array(rows)
+
+    def _from_numpy(self, rows):
+        # jedna konwersja list -> tablica w C, dalej tylko operacje na kolumnach
+        data = np.array(rows, dtype=object).reshape(self.n, len(db.DONE_COLUMNS))
+        ints = data[:, :INT_COLUMNS].astype(np.int64)
+        order = np.lexsort((ints[:, 0], ints[:, 5], ints[:, 1]))
+        ints = ints[order]
+        self.svc_id = ints[:, 0].copy()
+        self.cost = ints[:, 3].copy()
+        # -1 = brak przebiegu
+        self.mileage = ints[:, 2].copy()
+        self.car_mileage = ints[:, 4].copy()
+
+        self.labels, self.codes = {}, {}
+        car_ids, self.codes["car"] = np.unique(ints[:, 1], return_inverse=True)
+        self.labels["car"] = ["-" if c < 0 else c for c in car_ids.tolist()]
+        for i, group in enumerate(("model", "company", "fuel")):
+            # stała szerokość (U) sortuje się w C, bez porównań obiektów Pythona
+            values = data[order, INT_COLUMNS + i].astype(str)
+            labels, self.codes[group] = np.unique(values, return_inverse=True)
+            self.labels[group] = labels.tolist()
+
+        months, self.month_codes = np.unique(ints[:, 6], return_inverse=True)
+        self.months = [_month_label(m) for m in months.tolist()]
+
+    def _from_array(self, rows):
+        rows = sorted(rows, key=lambda r: (r[1], r[5], r[0]))
+        self.svc_id = array("q", (r[0] for r in rows))
+        self.cost = array("q", (r[3] for r in rows))
+        self.mileage = array("q", (r[2] for r in rows))
+        self.car_mileage = array("q", (r[4] for r in rows))
+
+        self.labels, self.codes = {}, {}
+        for i, group in enumerate(("car", "model", "company", "fuel")):
+            column = 1 if group == "car" else INT_COLUMNS + i - 1
+            self.labels[group], self.codes[group] = _encode(r[column] for r in rows)
+        self.labels["car"] = ["-" if c == -1 else c for c in self.labels["car"]]
+
+        self.months, self.month_codes = _encode(r[6] for r in rows)
+        self.months = [_month_label(m) for m in self.months]
+
+
+def _month_label(month):
+    """202503 -> '2025-03'; 0 (brak daty) -> ''."""
+    return f"{month // 100:04d}-{month % 100:02d}" if month else ""
+
+
+def _encode(values):
+    labels, index, codes = [], {}, array("q")
+    for value in values:
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(labels)
+            labels.append(value)
+        codes.append(code)
+    return labels, codes
+
+
+def _group_sum(codes, values, size):
+    if np is not None:
+        return np.bincount(codes, weights=values, minlength=size)
+    out = [0] * size
+    for code, value in zip(codes, values):
+        out[code] += value
+    return out
+
+
+def _km_deltas(cols):
+    """
+    Przyrost przebiegu względem poprzedniego serwisu tego samego auta
+    (0 dla pierwszego serwisu, braków i spadków) oraz maska spadków.
+    """
+    car = cols.codes["car"]
+    if np is not None:
+        same_car = np.zeros(cols.n, dtype=bool)
+        same_car[1:] = car[1:] == car[:-1]
+        prev = np.empty(cols.n, dtype=np.int64)
+        prev[:1] = -1
+        prev[1:] = cols.mileage[:-1]
+        valid = same_car & (prev >= 0) & (cols.mileage >= 0)
+        delta = np.where(valid, cols.mileage - prev, 0)
+        regress = valid & (delta < 0)
+        return np.maximum(delta, 0).astype(np.float64), regress
+
+    delta = array("d", bytes(8 * cols.n))
+    regress = [False] * cols.n
+    for i in range(1, cols.n):
+        if car[i] == car[i - 1] and cols.mileage[i] >= 0 and cols.mileage[i - 1] >= 0:
+            d = cols.mileage[i] - cols.mileage[i - 1]
+            if d < 0:
+                regress[i] = True
+            else:
+                delta[i] = d
+    return delta, regress
+
+
+def _moments(cols, codes, size):
+    """(liczba, suma, średnia, odchylenie) na grupę — tablice NumPy."""
+    count = np.bincount(codes, minlength=size).astype(np.float64)
+    total = np.bincount(codes, weights=cols.cost, minlength=size)
+    total_sq = np.bincount(codes, weights=np.square(cols.cost, dtype=np.float64), minlength=size)
+    safe = np.maximum(count, 1)
+    mean = np.where(count > 0, total / safe, 0.0)
+    var = np.where(count > 0, np.maximum(total_sq / safe - mean * mean, 0.0), 0.0)
+    return count, total, mean, np.sqrt(var)
+
+
+def _group_stats(cols, km):
+    stats = {}
+    for group in GROUPS:
+        codes, labels = cols.codes[group], cols.labels[group]
+        size = len(labels)
+        kms = _group_sum(codes, km, size)
+
+        if np is not None:
+            count, total, mean, std = _moments(cols, codes, size)
+            per_km = np.divide(total, kms, out=np.zeros(size), where=kms > 0)
+            columns = zip(labels, count.astype(np.int64).tolist(),
+                          np.rint(total).astype(np.int64).tolist(), mean.tolist(), std.tolist(),
+                          kms.tolist(), np.where(kms > 0, per_km, np.nan).tolist())
+        else:
+            count = _group_sum(codes, [1] * cols.n, size)
+            total = _group_sum(codes, cols.cost, size)
+            total_sq = _group_sum(codes, [c * c for c in cols.cost], size)
+            columns = []
+            for i, label in enumerate(labels):
+                mean = total[i] / count[i] if count[i] else 0.0
+                var = max(total_sq[i] / count[i] - mean * mean, 0.0) if count[i] else 0.0
+                columns.append((label, count[i], total[i], mean, math.sqrt(var), kms[i],
+                                total[i] / kms[i] if kms[i] else None))
+
+        rows = []
+        for label, services, group_total, mean, std, group_km, per_km in columns:
+            rows.append({
+                "label": label,
+                "services": services,
+                # bincount sumuje w float64 — dokładnie do 2**53 groszy
+                "total": group_total,
+                "mean": mean,
+                "std": std,
+                "km": group_km,
+                "cost_per_km": None if per_km is None or per_km != per_km else per_km,
+            })
+        stats[group] = rows
+    return stats
+
+
+def _outliers(cols, stats):
+    """Zgłoszenia droższe niż średnia + OUTLIER_Z odchyleń dla modelu auta."""
+    labels = cols.labels["model"]
+    codes = cols.codes["model"]
+    if np is not None:
+        count, _, mean, std = _moments(cols, codes, len(labels))
+        usable = (count >= 3) & (std > 0)
+        z = np.zeros(cols.n)
+        rows = usable[codes]
+        z[rows] = (cols.cost[rows] - mean[codes][rows]) / std[codes][rows]
+        idx = np.flatnonzero(z > OUTLIER_Z)
+        idx = idx[np.argsort(-z[idx], kind="stable")]
+        return [
+            {"svc_id": svc_id, "model": labels[code], "cost": cost, "z": score}
+            for svc_id, code, cost, score in zip(
+                cols.svc_id[idx].tolist(), codes[idx].tolist(), cols.cost[idx].tolist(), z[idx].tolist()
+            )
+        ]
+
+    by_model = stats["model"]
+    found = []
+    for i in range(cols.n):
+        group = by_model[codes[i]]
+        if group["services"] >= 3 and group["std"] > 0:
+            z = (cols.cost[i] - group["mean"]) / group["std"]
+            if z > OUTLIER_Z:
+                found.append({"svc_id": cols.svc_id[i], "model": group["label"],
+                              "cost": cols.cost[i], "z": z})
+    found.sort(key=lambda o: -o["z"])
+    return found
+
+
+def _regressions(cols, regress):
+    """Spadek przebiegu: względem poprzedniego serwisu lub poniżej cars.mileage."""
+    labels = cols.labels["car"]
+    if np is not None:
+        below_car = (cols.mileage >= 0) & (cols.mileage < cols.car_mileage)
+        idx = np.flatnonzero(regress | below_car)
+        return [
+            {
+                "svc_id": svc_id,
+                "car_id": labels[code],
+                "final_mileage": mileage,
+                "car_mileage": car_mileage,
+                "reason": "below_car" if below else "previous_service",
+            }
+            for svc_id, code, mileage, car_mileage, below in zip(
+                cols.svc_id[idx].tolist(), cols.codes["car"][idx].tolist(), cols.mileage[idx].tolist(),
+                cols.car_mileage[idx].tolist(), below_car[idx].tolist(),
+            )
+        ]
+
+    found = []
+    for i in range(cols.n):
+        below_car = 0 <= cols.mileage[i] < cols.car_mileage[i]
+        if regress[i] or below_car:
+            found.append({
+                "svc_id": cols.svc_id[i],
+                "car_id": labels[cols.codes["car"][i]],
+                "final_mileage": cols.mileage[i],
+                "car_mileage": cols.car_mileage[i],
+                "reason": "below_car" if below_car else "previous_service",
+            })
+    return found
+
+
+def _trend(cols):
+    totals = _group_sum(cols.month_codes, cols.cost, len(cols.months))
+    if np is not None:
+        totals = np.rint(totals).astype(np.int64).tolist()
+    return sorted((month, total) for month, total in zip(cols.months, totals) if month)
+
+
+def compute(path, conn=None):
+    rows = db.done_services_table(path, conn=conn)
+    cols = Columns(rows)
+    km, regress = _km_deltas(cols)
+    stats = _group_stats(cols, km)
+    return {
+        "services": cols.n,
+        "backend": "numpy" if np is not None else "array",
+        "groups": stats,
+        "trend": _trend(cols),
+        "outliers": _outliers(cols, stats),
+        "regressions": _regressions(cols, regress),
+    }
+
+
+def fleet_analytics(path, conn=None):
+    """Wynik z cache, jeśli zbiór danych się nie zmienił."""
+    key = db._cache_key(path)
+    version = db.row_version(path, "dataset", 0)
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    global _evictions
+    result = compute(path, conn=conn)
+    with _cache_lock:
+        _cache.pop(key, None)
+        _cache[key] = (version, result)
+        while len(_cache) > CACHE_FILES:
+            del _cache[next(iter(_cache))]
+            _evictions += 1
+    return result
+
+
+def cache_stats():
+    with _cache_lock:
+        return {"analytics": {"size": len(_cache), "bound": CACHE_FILES, "evictions": _evictions}}
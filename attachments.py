@@ -0,0 +1,206 @@
+"""
+Załączniki zgłoszeń (zdjęcia uszkodzeń, faktury PDF). Pliki są pobierane
+z Telegrama w tle z ograniczoną współbieżnością i zapisywane na dysku wg
+sha256 treści — ten sam plik wysłany kilka razy zajmuje jedno miejsce.
+W bazie trzymamy wyłącznie metadane (db.add_attachment).
+
+Miniatury: z Pillow dla obrazów, a gdy Pillow nie ma albo obrazu nie da
+się odczytać (uszkodzony, zbyt duży) — miniatura dostarczona przez
+Telegram (zdjęcia, PDF z podglądem). Błąd miniatury nigdy nie blokuje
+zapisu samego załącznika.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+
+import db
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow opcjonalny
+    Image = None
+
+logger = logging.getLogger("fleet_bot.attachments")
+
+THUMB_SIZES = (160, 640)
+MAX_BYTES = 20 * 1024 * 1024    # limit pobierania przez Bot API
+ALLOWED_MIME = ("image/", "application/pdf")
+CHUNK = 1 << 16
+MAX_PENDING = 200               # pobrań w toku i w kolejce
+
+
+def describe(message):
+    """Metadane pliku z wiadomości (zdjęcie / dokument) albo None."""
+    if message.photo:
+        photo = message.photo[-1]
+        thumb = message.photo[0] if len(message.photo) > 1 else None
+        return {
+            "kind": "photo",
+            "file_id": photo.file_id,
+            "file_unique_id": photo.file_unique_id,
+            "mime": "image/jpeg",
+            "name": f"{photo.file_unique_id}.jpg",
+            "size": photo.file_size,
+            "thumb": thumb,
+        }
+    doc = message.document
+    if doc is None:
+        return None
+    return {
+        "kind": "document",
+        "file_id": doc.file_id,
+        "file_unique_id": doc.file_unique_id,
+        "mime": doc.mime_type or "application/octet-stream",
+        "name": doc.file_name,
+        "size": doc.file_size,
+        "thumb": doc.thumbnail,
+    }
+
+
+def validate(item):
+    """Komunikat błędu dla użytkownika albo None, jeśli plik jest akceptowalny."""
+    if not item["mime"].startswith(ALLOWED_MIME):
+        return "Obsługiwane są tylko zdjęcia i pliki PDF."
+    if item["size"] and item["size"] > MAX_BYTES:
+        return f"Plik jest za duży (limit {MAX_BYTES // (1024 * 1024)} MB)."
+    return None
+
+
+class AttachmentStore:
+    def __init__(self, root, concurrency=4, max_pending=MAX_PENDING):
+        self.root = root
+        self.max_pending = max_pending
+        self._sem = asyncio.Semaphore(concurrency)
+        self._pending = {}    # (plik bazy, svc_id) -> {task, ...}
+        self.stored = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def thumb_path(self, sha256, size):
+        return os.path.join(self.root, "thumbs", sha256[:2], f"{sha256}_{size}.jpg")
+
+    def submit(self, bot, path, svc_id, item, uploaded_by):
+        """
+        Pobiera i zapisuje załącznik w tle; zwraca task (wynik: id albo None)
+        albo None, gdy w kolejce jest już max_pending pobrań.
+        """
+        if self.pending() >= self.max_pending:
+            self.rejected += 1
+            return None
+        key = (path, svc_id)
+        task = asyncio.create_task(self._fetch(bot, path, svc_id, item, uploaded_by))
+        self._pending.setdefault(key, set()).add(task)
+        task.add_done_callback(lambda t: self._done(key, t))
+        return task
+
+    def pending(self):
+        return sum(len(tasks) for tasks in self._pending.values())
+
+    def stats(self):
+        return {"attachments.pending": {"size": self.pending(), "bound": self.max_pending, "evictions": self.rejected}}
+
+    def _done(self, key, task):
+        tasks = self._pending.get(key)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._pending[key]
+
+    async def wait(self, path, svc_id, timeout=60):
+        """Czeka na pobrania danego zgłoszenia (np. przed jego zamknięciem)."""
+        tasks = list(self._pending.get((path, svc_id), ()))
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    async def _fetch(self, bot, path, svc_id, item, uploaded_by):
+        tmp = None
+        try:
+            async with self._sem:
+                known = await asyncio.to_thread(
+                    db.find_attachment_by_unique_id, path, item["file_unique_id"]
+                )
+                if known is not None and os.path.exists(self.object_path(known["sha256"])):
+                    sha256, size = known["sha256"], known["size"]
+                    thumbs = [int(t) for t in known["thumbs"].split(",") if t]
+                    self.deduplicated += 1
+                else:
+                    tmp = os.path.join(self.root, "tmp", f"{uuid.uuid4().hex}.part")
+                    os.makedirs(os.path.dirname(tmp), exist_ok=True)
+                    await bot.download(item["file_id"], destination=tmp)
+                    sha256, size = await asyncio.to_thread(self._commit, tmp)
+                    tmp = None
+                    thumbs = await asyncio.to_thread(self._thumbnails, sha256, item["mime"])
+                    if not thumbs and item["thumb"] is not None:
+                        try:
+                            thumbs = await self._telegram_thumb(bot, sha256, item["thumb"])
+                        except Exception as e:
+                            logger.warning("miniatura Telegrama dla %s: %s", sha256, e)
+
+            return await asyncio.to_thread(
+                db.add_attachment, path, svc_id, sha256, item["kind"], item["mime"],
+                item["name"], size, thumbs, item["file_id"], item["file_unique_id"], uploaded_by,
+            )
+        except Exception:
+            self.failed += 1
+            logger.exception("załącznik %s zgłoszenia #%s nie został zapisany", item["name"], svc_id)
+            return None
+        finally:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _commit(self, tmp):
+        """Liczy sha256 i przenosi plik do magazynu; duplikat jest usuwany."""
+        digest, size = hashlib.sha256(), 0
+        with open(tmp, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK), b""):
+                digest.update(chunk)
+                size += len(chunk)
+        sha256 = digest.hexdigest()
+
+        dest = self.object_path(sha256)
+        if os.path.exists(dest):
+            os.remove(tmp)
+            self.deduplicated += 1
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(tmp, dest)
+            self.stored += 1
+        return sha256, size
+
+    def _thumbnails(self, sha256, mime):
+        """Rozmiary wygenerowanych miniatur; nieudane (uszkodzony obraz, bomba dekompresji) są pomijane."""
+        if Image is None or not mime.startswith("image/"):
+            return []
+        sizes = []
+        for size in THUMB_SIZES:
+            dest = self.thumb_path(sha256, size)
+            if not os.path.exists(dest):
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                tmp = dest + ".part"
+                try:
+                    with Image.open(self.object_path(sha256)) as im:
+                        im.draft("RGB", (size, size))
+                        im.thumbnail((size, size))
+                        im.convert("RGB").save(tmp, "JPEG", quality=80)
+                    os.replace(tmp, dest)
+                except Exception as e:
+                    logger.warning("miniatura %s px dla %s: %s", size, sha256, e)
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    continue
+            sizes.append(size)
+        return sizes
+
+    async def _telegram_thumb(self, bot, sha256, thumb):
+        size = max(thumb.width, thumb.height)
+        dest = self.thumb_path(sha256, size)
+        if not os.path.exists(dest):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            await bot.download(thumb.file_id, destination=dest)
+        return [size]
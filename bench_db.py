@@ -0,0 +1,252 @@
+"""
+Mikrobenchmark funkcji db.py na dużej, syntetycznej bazie (gen_data.py).
+Każdy przypadek jest mierzony osobno; wynik to JSON do porównań między
+przebiegami (--baseline poprzedni.json dodaje współczynnik zmiany).
+
+    python bench_db.py --scale medium [--iterations 200] [--out wynik.json]
+    python bench_db.py --db duza_kopia.db --baseline wczoraj.json
+    python bench_db.py --scale large --iterations 300 \
+        --only done_services_table analytics_columns analytics_compute
+
+Przypadki inline_* to zapytania, które bot.py wykonywał kiedyś bezpośrednio
+(punkt odniesienia dla wersji w db.py). done_services_table to sam
+odczyt analityki z SQLite (przerywany limitem czasu raportów),
+analytics_columns — odczyt i budowa kolumn NumPy, analytics_compute —
+całość. Archiwizacja, backup i kompaktowanie
+zdarzeń nie są mierzone — przepisują całą bazę.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import analytics
+import db
+import gen_data
+
+
+def _stats(samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return {
+        "n": len(samples),
+        "mean_us": round(statistics.fmean(samples) * 1e6, 2),
+        "median_us": round(statistics.median(samples) * 1e6, 2),
+        "p95_us": round(p95 * 1e6, 2),
+        "min_us": round(samples[0] * 1e6, 2),
+        "max_us": round(samples[-1] * 1e6, 2),
+    }
+
+
+def _sample(path, seed):
+    """Identyfikatory istniejących wierszy do losowania argumentów."""
+    conn = db.get_connection(path)
+    cars = conn.execute(
+        "SELECT id, vin, plate FROM cars WHERE archived_at IS NULL"
+    ).fetchall()
+    svc = conn.execute("SELECT MIN(id), MAX(id), MIN(created_at), MAX(created_at) FROM services").fetchone()
+    mechanics = [r[0] for r in conn.execute("SELECT tg_id FROM users WHERE role = 'mechanic'")]
+    users = [r[0] for r in conn.execute("SELECT tg_id FROM users WHERE role = 'user'")]
+    conn.close()
+    first, last = (datetime.fromisoformat(svc[2]), datetime.fromisoformat(svc[3]))
+    months = [
+        (y, m) for y in range(first.year, last.year + 1) for m in range(1, 13)
+        if (first.year, first.month) <= (y, m) <= (last.year, last.month)
+    ]
+    return {
+        "rng": random.Random(seed),
+        "car_ids": [r["id"] for r in cars],
+        "vins": [r["vin"] for r in cars],
+        "plates": [r["plate"] for r in cars],
+        "svc_ids": (svc[0], svc[1]),
+        "mechanics": mechanics,
+        "users": users,
+        "months": months,
+    }
+
+
+def _inline_mechanics(path):
+    conn = db.get_connection(path)
+    cur = conn.cursor()
+    cur.execute("SELECT tg_id, full_name FROM users WHERE role = 'mechanic'")
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def _inline_car_by_id(path, car_id):
+    conn = db.get_connection(path)
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM cars WHERE id = ?", (car_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+
+def _inline_car_by_plate(path, plate):
+    conn = db.get_connection(path)
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM cars WHERE UPPER(plate) = UPPER(?)", (plate,))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+
+def cases(path, s):
+    """
+    Lista (nazwa, waga, funkcja). Waga skraca liczbę iteracji dla ciężkich
+    przypadków (iteracje // waga). Kolejność ma znaczenie: mutacje na końcu.
+    """
+    rng = s["rng"]
+    counter = iter(range(10**9))
+    lo, hi = s["svc_ids"]
+
+    def svc_id():
+        return rng.randint(lo, hi)
+
+    def cold(invalidate, fn):
+        def run():
+            invalidate(path)
+            return fn()
+        return run
+
+    role = lambda: db.get_user_role(path, rng.choice(s["mechanics"]))  # noqa: E731
+    plate = lambda: db.find_car_by_plate(path, rng.choice(s["plates"]).lower())  # noqa: E731
+
+    return [
+        # --- odczyty ---
+        ("get_user_role", 1, role),
+        ("get_user_role_cold", 1, cold(db.invalidate_users, role)),
+        ("list_mechanics", 1, lambda: db.list_mechanics(path)),
+        ("inline_mechanics", 1, lambda: _inline_mechanics(path)),
+        ("get_user_names", 1, lambda: db.get_user_names(path, rng.sample(s["users"], 20))),
+        ("user_ids_page", 1, lambda: db.user_ids_page(path, "user", after=rng.choice(s["users"]))),
+        ("list_cars", 1, lambda: db.list_cars(path)),
+        ("get_car_by_id", 1, lambda: db.get_car_by_id(path, rng.choice(s["car_ids"]))),
+        ("inline_car_by_id", 1, lambda: _inline_car_by_id(path, rng.choice(s["car_ids"]))),
+        ("get_car_by_vin", 1, lambda: db.get_car_by_vin(path, rng.choice(s["vins"]))),
+        ("find_car_by_plate", 1, plate),
+        ("find_car_by_plate_cold", 50, cold(db.invalidate_cars, plate)),
+        ("inline_car_by_plate", 10, lambda: _inline_car_by_plate(path, rng.choice(s["plates"]).lower())),
+        ("get_service", 1, lambda: db.get_service(path, svc_id())),
+        ("get_service_hot", 1, lambda: db.get_service(path, lo)),
+        ("list_mechanic_jobs", 1, lambda: db.list_mechanic_jobs(path, rng.choice(s["mechanics"]))),
+        ("get_dashboard", 1, lambda: db.get_dashboard(path)),
+        ("monthly_report", 10, lambda: db.monthly_report(path, *rng.choice(s["months"]))),
+        ("done_services_rows", 100, lambda: db.done_services_rows(path)),
+        ("done_services_table", 100, lambda: db.done_services_table(path)),
+        ("analytics_columns", 100, lambda: analytics.Columns(db.done_services_table(path))),
+        ("analytics_compute", 100, lambda: analytics.compute(path)),
+        ("warm_caches", 50, lambda: db.warm_caches(path)),
+        ("rebuild_kpi", 100, lambda: db.rebuild_kpi(path)),
+        # --- zapisy ---
+        ("add_user", 1, lambda: db.add_user(path, 10**9 + next(counter), "Bench")),
+        ("set_user_role", 1, lambda: db.set_user_role(path, rng.choice(s["users"]), "user")),
+        ("add_car", 1, lambda: db.add_car(
+            path, f"BENCH{next(counter):012d}", 1000, 2020, "Bench S.A.",
+            "Bench", f"BE{next(counter):07d}", "benzyna",
+        )),
+        ("update_car_field", 1, lambda: db.update_car_field(
+            path, rng.choice(s["car_ids"]), "mileage", rng.randint(0, 400_000),
+        )),
+        ("create_service", 1, lambda: db.create_service(
+            path, rng.choice(s["car_ids"]), rng.choice(s["mechanics"]), None,
+            "Bench", "2025-12-31 10:00",
+        )),
+        ("update_service_status", 1, lambda: db.update_service_status(path, svc_id(), "confirmed")),
+        ("set_service_result", 1, lambda: db.set_service_result(
+            path, svc_id(), rng.randint(0, 400_000), 50_000, None,
+        )),
+        ("delete_car", 1, lambda: db.delete_car(path, s["car_ids"].pop())),
+    ]
+
+
+def run(path, iterations=200, only=None, seed=1):
+    s = _sample(path, seed)
+    results = {}
+    for name, weight, fn in cases(path, s):
+        if only and name not in only:
+            continue
+        n = max(3, iterations // weight)
+        fn()  # rozgrzewka (pula połączeń, cache zapytań)
+        samples = []
+        for _ in range(n):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+        results[name] = _stats(samples)
+        print(f"{name:24} {results[name]['median_us']:>12.1f} us", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline):
+    """Współczynnik mediany: >1 = wolniej niż w baseline."""
+    old = baseline.get("results", {})
+    return {
+        name: round(r["median_us"] / old[name]["median_us"], 3)
+        for name, r in results.items()
+        if name in old and old[name]["median_us"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="istniejąca baza (benchmark działa na kopii)")
+    parser.add_argument("--scale", choices=gen_data.SCALES, default="small")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--only", nargs="*")
+    parser.add_argument("--baseline")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        if args.db:
+            shutil.copy(args.db, path)
+            db.init_db(path)
+            dataset = {"source": os.path.basename(args.db)}
+        else:
+            dataset = gen_data.generate(path, seed=args.seed, **gen_data.SCALES[args.scale])
+            dataset["scale"] = args.scale
+            dataset["seed"] = args.seed
+
+        results = run(path, args.iterations, args.only)
+        service_cache = db.service_cache_stats()
+        db.close_pools()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "schema_version": db.SCHEMA_VERSION,
+            "iterations": args.iterations,
+            "dataset": dataset,
+            "service_cache": service_cache,
+        },
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["ratio"] = compare(results, json.load(f))
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
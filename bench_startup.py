@@ -0,0 +1,90 @@
+"""
+Benchmark zimnego startu: od uruchomienia procesu do obsłużenia pierwszej
+aktualizacji. Uruchamia bot.py w osobnym procesie z FakeSession (bez sieci)
+na kopii bazy i wypisuje fazy gotowości jako JSON.
+
+    python bench_startup.py [--db fleet.db] [--runs 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+FAKE_TOKEN = "123456:FAKE-TOKEN-FOR-BENCHMARK"
+
+
+async def child():
+    import bot
+    from aiogram.types import Chat, Message, Update, User
+
+    from fakebot import FakeSession
+
+    bot.bot.session = FakeSession()
+    await bot.startup()
+
+    user = User(id=1, is_bot=False, first_name="Bench")
+    update = Update(
+        update_id=1,
+        message=Message(
+            message_id=1,
+            date=int(time.time()),
+            chat=Chat(id=1, type="private"),
+            from_user=user,
+            text="/whoami",
+        ),
+    )
+    await bot.dp.feed_update(bot.bot, update)
+    print(json.dumps(bot.READINESS))
+
+
+def run_once(db_path):
+    env = dict(os.environ, BOT_TOKEN=FAKE_TOKEN, DB_PATH=db_path, TENANTS="")
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, __file__, "--child"],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    wall = time.perf_counter() - start
+    phases = json.loads(out.strip().splitlines()[-1])
+    phases["process_wall"] = wall
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="fleet.db")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child())
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "fleet.db")
+        if os.path.exists(args.db):
+            shutil.copy(args.db, db_path)
+
+        # pierwszy przebieg migruje kopię — liczymy osobno jako "cold_schema"
+        cold = run_once(db_path)
+        runs = [run_once(db_path) for _ in range(args.runs)]
+
+    phases = sorted({k for r in runs for k in r})
+    result = {
+        "runs": args.runs,
+        "cold_schema": cold,
+        "median": {k: statistics.median(r[k] for r in runs if k in r) for k in phases},
+        "max": {k: max(r[k] for r in runs if k in r) for k in phases},
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
+import time
+
+PROCESS_START = time.perf_counter()
+
 import os
 import asyncio
+import logging
+import sqlite3
 from datetime import datetime
 
 from aiogram import Bot, Dispatcher, F
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError
 from aiogram.filters import Command, CommandStart
 from aiogram.types import (
     Message,
@@ -12,10 +19,36 @@ from aiogram.types import (
 )
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from dotenv import load_dotenv
+import analytics
+import attachments
+import broadcast
+import capture
 import db
+import logs
+import memstats
+import money
+import render
+import reports
+import scheduler
+import throttling
+from digest import DigestNotifier
+
+IMPORT_DONE = time.perf_counter()
+
+logger = logging.getLogger("fleet_bot")
+
+# faza startu -> sekundy od uruchomienia procesu
+READINESS = {"imports": IMPORT_DONE - PROCESS_START}
+
+# moment obsłużenia ostatniej aktualizacji (do zadań w czasie bezczynności)
+LAST_UPDATE_AT = time.monotonic()
+
+
+def mark_ready(phase):
+    READINESS[phase] = time.perf_counter() - PROCESS_START
+    logger.info("startup: %s po %.1f ms", phase, READINESS[phase] * 1000)
 
 
 # ---------- ENV ----------
@@ -23,6 +56,40 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DB_PATH = os.getenv("DB_PATH", "fleet.db")
+TENANTS = os.getenv("TENANTS", "")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_INTERVAL_HOURS = int(os.getenv("ARCHIVE_INTERVAL_HOURS", "24"))
+SERVICE_INTERVAL_DAYS = int(os.getenv("SERVICE_INTERVAL_DAYS", "180"))
+EVENTS_KEEP_DAYS = int(os.getenv("EVENTS_KEEP_DAYS", "90"))
+IDLE_COMPACT_SECONDS = int(os.getenv("IDLE_COMPACT_SECONDS", "600"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+DIGEST_WINDOW_SECONDS = int(os.getenv("DIGEST_WINDOW_SECONDS", "0"))
+JOBS_PAGE_SIZE = 5
+BATCH_MAX_CARS = int(os.getenv("BATCH_MAX_CARS", "1000"))
+REPORT_DEADLINE_SECONDS = float(os.getenv("REPORT_DEADLINE_SECONDS", "15"))
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_INTERVAL_HOURS = int(os.getenv("BACKUP_INTERVAL_HOURS", "6"))
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "256"))
+ATTACHMENTS_DIR = os.getenv("ATTACHMENTS_DIR", "attachments")
+ATTACHMENT_DOWNLOADS = int(os.getenv("ATTACHMENT_DOWNLOADS", "4"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_MAX_PER_SECOND = int(os.getenv("LOG_MAX_PER_SECOND", "50"))
+THROTTLE_ROLE_BUDGETS = os.getenv("THROTTLE_ROLE_BUDGETS", "")
+THROTTLE_COMMAND_BUDGETS = os.getenv("THROTTLE_COMMAND_BUDGETS", "")
+FSM_MAX_KEYS = int(os.getenv("FSM_MAX_KEYS", "10000"))
+MEMSTATS_INTERVAL_MINUTES = int(os.getenv("MEMSTATS_INTERVAL_MINUTES", "0"))
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "1"))
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "")
+CAPTURE_SALT = os.getenv("CAPTURE_SALT", "")
+CAPTURE_MAX_MB = int(os.getenv("CAPTURE_MAX_MB", "50"))
+CAPTURE_KEEP = int(os.getenv("CAPTURE_KEEP", "20"))
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "16"))
+QUEUE_HIGH_WATER = int(os.getenv("QUEUE_HIGH_WATER", "200"))
+QUEUE_LOW_WATER = int(os.getenv("QUEUE_LOW_WATER", "100"))
 
 
 # ---------- FSM STATES ----------
@@ -47,8 +114,16 @@ class NewServiceStates(StatesGroup):
 class CompleteServiceStates(StatesGroup):
     svc_id = State()
     final_mileage = State()
-    cost_net = State()
+    cost_net_gr = State()
     comments = State()
+    attachments = State()
+
+
+class BatchServiceStates(StatesGroup):
+    cars = State()
+    choose_mechanic = State()
+    description = State()
+    desired_at = State()
 
 
 class EditCarStates(StatesGroup):
@@ -74,16 +149,26 @@ async def check_admin(message: Message) -> bool:
     return role == "admin"
 
 
-def get_mechanics_from_db():
+def tenant_path(tg_id):
+    """Plik bazy z autami i zgłoszeniami tenanta danego użytkownika."""
+    return router.path_for_user(tg_id)
+
+
+def get_mechanics_from_db(tenant=db.DEFAULT_TENANT):
     """
-    Zwraca listę mechaników z tabeli users: [{tg_id, full_name}, ...]
+    Zwraca listę mechaników tenanta z tabeli users: [{tg_id, full_name}, ...]
     """
-    conn = db.get_connection(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT tg_id, full_name FROM users WHERE role = 'mechanic'")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    return db.list_mechanics(DB_PATH, tenant)
+
+
+async def notify(chat_id, text, **kwargs):
+    """Wiadomość do innego użytkownika; błąd (np. bot zablokowany) tylko logujemy."""
+    try:
+        await bot.send_message(chat_id, text, **kwargs)
+        return True
+    except TelegramAPIError as e:
+        logger.warning("nie udało się wysłać wiadomości do %s: %s", chat_id, e)
+        return False
 
 
 async def start_edit_car_flow(message: Message, state: FSMContext, identifier: str):
@@ -91,23 +176,14 @@ async def start_edit_car_flow(message: Message, state: FSMContext, identifier: s
     Wspólna funkcja do rozpoczęcia edycji auta po numerze / VIN / ID.
     """
     ident = identifier.strip().upper()
-
-    conn = db.get_connection(DB_PATH)
-    cur = conn.cursor()
+    path = tenant_path(message.from_user.id)
     car = None
 
     if ident.isdigit():
-        cur.execute("SELECT * FROM cars WHERE id = ?", (int(ident),))
-        car = cur.fetchone()
+        car = db.get_car_by_id(path, int(ident), active_only=True)
 
     if not car:
-        cur.execute(
-            "SELECT * FROM cars WHERE UPPER(plate) = UPPER(?) OR UPPER(vin) = UPPER(?)",
-            (ident, ident),
-        )
-        car = cur.fetchone()
-
-    conn.close()
+        car = db.find_car_by_plate(path, ident) or db.get_car_by_vin(path, ident)
 
     if not car:
         await message.answer("❗ Samochód nie został znaleziony. Sprawdź numer / VIN lub użyj /list_cars.")
@@ -116,15 +192,7 @@ async def start_edit_car_flow(message: Message, state: FSMContext, identifier: s
     await state.update_data(car_id=car["id"])
     await state.set_state(EditCarStates.waiting_field_choice)
 
-    text = (
-        f"Samochód ID: {car['id']}\n"
-        f"Numer rejestracyjny: {car['plate'] or '-'}\n"
-        f"VIN: {car['vin']}\n"
-        f"Model: {car['model'] or '-'}\n"
-        f"Firma właściciela: {car['owner_company'] or '-'}\n"
-        f"Rok: {car['year']} | Przebieg: {car['mileage']} km\n\n"
-        "Co chcesz zmienić?"
-    )
+    text = render.car_card(path, car["id"], row=car) + "\n\nCo chcesz zmienić?"
 
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -153,7 +221,51 @@ async def start_edit_car_flow(message: Message, state: FSMContext, identifier: s
 # ---------- BOT SETUP ----------
 
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# aktualizacje jednego czatu po kolei, najwyżej MAX_CONCURRENT_UPDATES handlerów naraz;
+# przy pełnej kolejce getUpdates czeka
+update_isolation = scheduler.ChatIsolation(MAX_CONCURRENT_UPDATES, QUEUE_HIGH_WATER, QUEUE_LOW_WATER)
+bot.session.middleware(scheduler.IntakeBackpressure(update_isolation))
+dp = Dispatcher(storage=memstats.BoundedMemoryStorage(FSM_MAX_KEYS), events_isolation=update_isolation)
+router = db.TenantRouter.from_env(DB_PATH, TENANTS)
+report_engine = reports.ReportEngine(workers=REPORT_WORKERS, deadline=REPORT_DEADLINE_SECONDS)
+
+# limity zapytań na użytkownika / ciężką komendę (przed filtrami i handlerami)
+throttle = throttling.ThrottlingMiddleware(
+    lambda tg_id: db.get_user_role(DB_PATH, tg_id),
+    role_budgets=throttling.parse_budgets(THROTTLE_ROLE_BUDGETS, throttling.DEFAULT_ROLE_BUDGETS),
+    command_budgets=throttling.parse_budgets(THROTTLE_COMMAND_BUDGETS, throttling.DEFAULT_COMMAND_BUDGETS),
+)
+dp.message.outer_middleware(throttle)
+dp.callback_query.outer_middleware(throttle)
+
+# identyczne ciężkie zapytania w toku liczone raz
+inflight = throttling.Coalescer()
+
+attachment_store = attachments.AttachmentStore(ATTACHMENTS_DIR, concurrency=ATTACHMENT_DOWNLOADS)
+
+memory_sampler = memstats.MemorySampler(frames=TRACEMALLOC_FRAMES)
+log_sampler = None   # logs.SamplingFilter, ustawiany w main()
+
+# długie zadania komend (raporty, rozsyłki, kopie) — poza blokadą czatu
+background = set()
+
+
+def spawn(coro):
+    """
+    Uruchamia długą część komendy w tle. Handler kończy się od razu
+    i zwalnia blokadę czatu (scheduler.ChatIsolation), więc kolejne
+    wiadomości tego czatu — np. /cancel_report — nie czekają na wynik.
+    """
+    task = asyncio.create_task(coro)
+    background.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+
+def _background_done(task):
+    background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("zadanie w tle nie powiodło się", exc_info=task.exception())
 
 
 # ======================================================================
@@ -174,8 +286,21 @@ async def cmd_start(message: Message):
         "/add_car — dodaj samochód\n"
         "/list_cars — lista samochodów\n"
         "/service_new — nowe zgłoszenie serwisowe\n"
+        "/service_batch — zgłoszenia dla wielu aut (kampania)\n"
         "/edit_car — edycja samochodu\n"
+        "/set_tenant <id> <tenant> — przypisz użytkownika do zajezdni/firmy\n"
+        "/broadcast <mechanic|admin|all|tenant:nazwa> <tekst> — wiadomość do grupy\n"
+        "/my_jobs — moje zlecenia (mechanik)\n"
+        "/attachments <id> — zdjęcia i faktury zgłoszenia\n"
         "/report_month YYYY-MM — raport miesięczny\n"
+        "/rates, /set_rate vat|prowizja PROCENT — stawki VAT i prowizji\n"
+        "/cancel_report — przerwij trwający raport\n"
+        "/dashboard — wskaźniki floty\n"
+        "/analytics — analiza kosztów floty\n"
+        "/archive [dni] — archiwizacja starych zgłoszeń\n"
+        "/memstats — zużycie pamięci i rozmiary cache\n"
+        "/queue — kolejka aktualizacji\n"
+        "/backup — kopia zapasowa bazy\n"
     )
     await message.answer(text)
 
@@ -212,14 +337,115 @@ async def cmd_add_mechanic(message: Message):
     ok = db.set_user_role(DB_PATH, tg_id, "mechanic")
     if ok:
         await message.answer(f"Użytkownik {tg_id} został ustawiony jako mechanik.")
-        try:
-            await bot.send_message(tg_id, "Otrzymałeś rolę mechanika w systemie floty.")
-        except Exception:
-            pass
+        await notify(tg_id, "Otrzymałeś rolę mechanika w systemie floty.")
     else:
         await message.answer("Nie znaleziono użytkownika o podanym ID. Musi najpierw napisać do bota /start.")
 
 
+@dp.message(Command("set_tenant"))
+async def cmd_set_tenant(message: Message):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Nie masz uprawnień administratora.")
+        return
+
+    parts = message.text.split()
+    if len(parts) != 3:
+        await message.answer(
+            "Użycie: /set_tenant <telegram_id> <tenant>\n"
+            f"Dostępne: {', '.join(router.names())}"
+        )
+        return
+
+    try:
+        tg_id = int(parts[1])
+    except ValueError:
+        await message.answer("Telegram ID musi być liczbą.")
+        return
+
+    try:
+        ok = router.set_user_tenant(tg_id, parts[2])
+    except ValueError:
+        await message.answer(f"Nieznany tenant. Dostępne: {', '.join(router.names())}")
+        return
+
+    if ok:
+        await message.answer(f"Użytkownik {tg_id} przypisany do: {parts[2]}.")
+    else:
+        await message.answer("Nie znaleziono użytkownika o podanym ID. Musi najpierw napisać do bota /start.")
+
+
+# ======================================================================
+#                              ROZSYŁANIE
+# ======================================================================
+
+BROADCAST_TARGETS = {"mechanic", "admin", "user", "all"}
+
+
+def format_broadcast_progress(stats):
+    state = "✅ Zakończono" if stats.finished else "⏳ Wysyłanie…"
+    return (
+        f"{state}\n"
+        f"Dostarczone: {stats.delivered}\n"
+        f"Nieudane: {stats.failed} (zablokowany bot: {stats.blocked})\n"
+        f"W kolejce: {stats.queued - stats.done}\n"
+        f"Czas: {stats.elapsed():.0f} s"
+    )
+
+
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Nie masz uprawnień administratora.")
+        return
+
+    parts = message.text.split(maxsplit=2)
+    target = parts[1] if len(parts) == 3 else ""
+    role, tenant = None, None
+    if target.startswith("tenant:"):
+        tenant = target.split(":", 1)[1]
+        if tenant not in router.names():
+            await message.answer(f"Nieznany tenant. Dostępne: {', '.join(router.names())}")
+            return
+    elif target in BROADCAST_TARGETS:
+        role = None if target == "all" else target
+    else:
+        await message.answer(
+            "Użycie: /broadcast <mechanic|admin|all|tenant:nazwa> <tekst>"
+        )
+        return
+
+    spawn(run_broadcast(message, role, tenant, parts[2]))
+
+
+async def run_broadcast(message, role, tenant, text):
+    progress = await message.answer("⏳ Wysyłanie…")
+    last_text = None
+
+    async def pages(after):
+        return await asyncio.to_thread(db.user_ids_page, DB_PATH, role, tenant, after)
+
+    async def on_progress(stats):
+        nonlocal last_text
+        new_text = format_broadcast_progress(stats)
+        if new_text == last_text:
+            return
+        last_text = new_text
+        try:
+            await progress.edit_text(new_text)
+        except TelegramAPIError as e:
+            logger.debug("postęp rozsyłki: %s", e)
+
+    await broadcast.broadcast(
+        bot, pages, text,
+        concurrency=BROADCAST_CONCURRENCY,
+        on_progress=on_progress,
+    )
+
+
 # ======================================================================
 #                             DODAWANIE SAMOCHODU
 # ======================================================================
@@ -244,7 +470,7 @@ async def add_car_vin(message: Message, state: FSMContext):
         await message.answer("VIN jest zbyt krótki. Wprowadź ponownie:")
         return
 
-    if db.get_car_by_vin(DB_PATH, vin):
+    if db.get_car_by_vin(tenant_path(message.from_user.id), vin):
         await message.answer("Samochód z takim VIN już istnieje w systemie.")
         return
 
@@ -314,7 +540,7 @@ async def add_car_fuel(message: Message, state: FSMContext):
     data = await state.get_data()
 
     car_id = db.add_car(
-        DB_PATH,
+        tenant_path(message.from_user.id),
         vin=data["vin"],
         mileage=data["mileage"],
         year=data["year"],
@@ -326,14 +552,11 @@ async def add_car_fuel(message: Message, state: FSMContext):
 
     await state.clear()
 
-    await message.answer(
-        f"Samochód został dodany.\n"
-        f"ID: {car_id}\n"
-        f"Numer: {data['plate']}\n"
-        f"VIN: {data['vin']}\n"
-        f"Firma: {data['owner_company']}\n"
-        f"Przebieg: {data['mileage']} km"
+    card = render.car_card(
+        tenant_path(message.from_user.id), car_id,
+        row=dict(data, id=car_id, fuel_type=fuel_type, model=data.get("model"), plate=data.get("plate")),
     )
+    await message.answer("Samochód został dodany.\n" + card)
 
 
 # ======================================================================
@@ -343,23 +566,16 @@ async def add_car_fuel(message: Message, state: FSMContext):
 @dp.message(Command("list_cars"))
 async def cmd_list_cars(message: Message):
     await ensure_user_registered(message)
-    cars = db.list_cars(DB_PATH, limit=50)
+    cars = db.list_cars(tenant_path(message.from_user.id), limit=50)
 
     if not cars:
         await message.answer("Brak samochodów w systemie.")
         return
 
+    path = tenant_path(message.from_user.id)
     lines = ["Lista samochodów:\n"]
     for c in cars:
-        lines.append(
-            f"ID: {c['id']}\n"
-            f"Numer: {c['plate'] or '-'}\n"
-            f"VIN: {c['vin']}\n"
-            f"Model: {c['model'] or '-'}\n"
-            f"Firma: {c['owner_company'] or '-'}\n"
-            f"Rok: {c['year']} | Przebieg: {c['mileage']} km\n"
-            "---------------------------"
-        )
+        lines.append(render.car_card(path, c["id"], row=c) + "\n---------------------------")
 
     await message.answer("\n".join(lines))
 
@@ -450,30 +666,24 @@ async def edit_car_set_value(message: Message, state: FSMContext):
     elif field in ("vin", "plate"):
         value = value.upper()
 
-    allowed_fields = {"vin", "mileage", "year", "owner_company", "model", "plate", "fuel_type"}
-    if field not in allowed_fields:
+    if field not in db.CAR_FIELDS:
         await message.answer("Tego pola nie można zmienić.")
         await state.clear()
         return
 
-    conn = db.get_connection(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(f"UPDATE cars SET {field} = ? WHERE id = ?", (value, car_id))
-    conn.commit()
-    conn.close()
+    try:
+        db.update_car_field(
+            tenant_path(message.from_user.id), car_id, field, value,
+            actor_tg_id=message.from_user.id,
+        )
+    except sqlite3.IntegrityError:
+        await message.answer("Samochód z takim VIN już istnieje w systemie. Wprowadź inną wartość:")
+        return
 
     await state.clear()
 
-    car = db.get_car_by_id(DB_PATH, car_id)
-    await message.answer(
-        "Dane samochodu zostały zaktualizowane:\n"
-        f"ID: {car['id']}\n"
-        f"Numer: {car['plate'] or '-'}\n"
-        f"VIN: {car['vin']}\n"
-        f"Model: {car['model'] or '-'}\n"
-        f"Firma: {car['owner_company'] or '-'}\n"
-        f"Rok: {car['year']} | Przebieg: {car['mileage']} km"
-    )
+    card = render.car_card(tenant_path(message.from_user.id), car_id)
+    await message.answer("Dane samochodu zostały zaktualizowane:\n" + card)
 
 
 @dp.callback_query(F.data == "editcar:delete")
@@ -511,15 +721,14 @@ async def callback_edit_car_delete_yes(call: CallbackQuery, state: FSMContext):
         await call.answer("Sesja utracona.", show_alert=True)
         return
 
-    conn = db.get_connection(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM cars WHERE id = ?", (car_id,))
-    conn.commit()
-    conn.close()
+    db.delete_car(tenant_path(call.from_user.id), car_id, actor_tg_id=call.from_user.id)
 
     await state.clear()
     await call.answer("Usunięto.")
-    await call.message.answer(f"Samochód ID {car_id} został usunięty.")
+    await call.message.answer(
+        f"Samochód ID {car_id} został usunięty z floty.\n"
+        "Historia jego zgłoszeń serwisowych została zachowana."
+    )
 
 
 @dp.callback_query(F.data == "editcar:delete:no")
@@ -549,11 +758,7 @@ async def cmd_service_new(message: Message, state: FSMContext):
 async def service_car_plate(message: Message, state: FSMContext):
     plate = message.text.strip().upper()
 
-    conn = db.get_connection(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM cars WHERE UPPER(plate) = UPPER(?)", (plate,))
-    car = cur.fetchone()
-    conn.close()
+    car = db.find_car_by_plate(tenant_path(message.from_user.id), plate)
 
     if not car:
         await message.answer("❗ Nie znaleziono samochodu o takim numerze. Wprowadź ponownie lub użyj /list_cars.")
@@ -566,7 +771,7 @@ async def service_car_plate(message: Message, state: FSMContext):
         owner_company=car["owner_company"],
     )
 
-    mechs = get_mechanics_from_db()
+    mechs = get_mechanics_from_db(router.tenant_for_user(message.from_user.id))
     if not mechs:
         await message.answer("❗ W systemie nie ma żadnych mechaników. Dodaj ich przez /add_mechanic <id>.")
         return
@@ -617,38 +822,370 @@ async def service_desired_at(message: Message, state: FSMContext):
     await state.clear()
 
     svc_id = db.create_service(
-        DB_PATH,
+        tenant_path(message.from_user.id),
         car_id=data["car_id"],
         mechanic_tg_id=data["mechanic_tg_id"],
         admin_tg_id=message.from_user.id,
         description=data["description"],
         desired_at=desired,
     )
+    logs.bind(svc_id=svc_id)
 
-    kb = InlineKeyboardMarkup(
+    summary = render.service_summary(
+        tenant_path(message.from_user.id), svc_id,
+        row=dict(data, id=svc_id, desired_at=desired, status="pending"),
+    )
+
+    if mechanic_digest.window > 0:
+        await mechanic_digest.add(data["mechanic_tg_id"], (svc_id, summary))
+        await message.answer(
+            f"Zgłoszenie serwisowe #{svc_id} zostało utworzone. Mechanik otrzyma je "
+            f"w zbiorczym powiadomieniu (do {DIGEST_WINDOW_SECONDS} s)."
+        )
+        return
+
+    try:
+        await send_new_services(data["mechanic_tg_id"], [(svc_id, summary)])
+        await message.answer(f"Zgłoszenie serwisowe #{svc_id} zostało utworzone i wysłane do mechanika.")
+    except Exception as e:
+        logger.warning("nie udało się wysłać zgłoszenia do mechanika %s: %s", data["mechanic_tg_id"], e)
+        await message.answer(f"⚠️ Nie udało się wysłać zgłoszenia do mechanika.\nBłąd: {e}")
+
+
+def service_decision_kb(svc_ids):
+    show_id = len(svc_ids) > 1
+    return InlineKeyboardMarkup(
         inline_keyboard=[
             [
-                InlineKeyboardButton(text="✅ Potwierdź", callback_data=f"svc_confirm:{svc_id}"),
-                InlineKeyboardButton(text="❌ Odrzuć", callback_data=f"svc_reject:{svc_id}"),
+                InlineKeyboardButton(
+                    text=f"✅ Potwierdź #{svc_id}" if show_id else "✅ Potwierdź",
+                    callback_data=f"svc_confirm:{svc_id}",
+                ),
+                InlineKeyboardButton(
+                    text=f"❌ Odrzuć #{svc_id}" if show_id else "❌ Odrzuć",
+                    callback_data=f"svc_reject:{svc_id}",
+                ),
             ]
+            for svc_id in svc_ids
         ]
     )
 
-    text_mech = (
-        f"Nowe zgłoszenie #{svc_id}\n"
-        f"Samochód: {data['plate']}\n"
-        f"VIN: {data['vin']}\n"
-        f"Firma właściciela: {data['owner_company'] or '-'}\n"
-        f"Opis: {data['description']}\n"
-        f"Data/godzina: {desired}\n\n"
-        "Potwierdź lub odrzuć:"
+
+# limit Telegrama to 4096 znaków i 100 przycisków na wiadomość
+MESSAGE_LIMIT = 3900
+SERVICES_PER_MESSAGE = 20      # 2 przyciski na zgłoszenie
+
+
+def service_chunks(items):
+    """Dzieli [(svc_id, podsumowanie), ...] na porcje mieszczące się w jednej wiadomości."""
+    chunks, current, size = [], [], 0
+    for svc_id, summary in items:
+        summary = summary[:MESSAGE_LIMIT - 200]
+        length = len(summary) + 10
+        if current and (size + length > MESSAGE_LIMIT - 100 or len(current) >= SERVICES_PER_MESSAGE):
+            chunks.append(current)
+            current, size = [], 0
+        current.append((svc_id, summary))
+        size += length
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def send_service_message(mechanic_tg_id, items):
+    if len(items) == 1:
+        svc_id, summary = items[0]
+        text = f"Nowe zgłoszenie #{svc_id}\n{summary}\n\nPotwierdź lub odrzuć:"
+    else:
+        text = f"Nowe zgłoszenia ({len(items)}):\n\n" + "\n\n".join(
+            f"#{svc_id}\n{summary}" for svc_id, summary in items
+        ) + "\n\nPotwierdź lub odrzuć:"
+
+    await bot.send_message(
+        mechanic_tg_id, text,
+        reply_markup=service_decision_kb([svc_id for svc_id, _ in items]),
+    )
+
+
+async def send_new_services(mechanic_tg_id, items):
+    """items: [(svc_id, podsumowanie), ...] — wiadomość do mechanika (dłuższe listy w kilku)."""
+    for chunk in service_chunks(items):
+        await send_service_message(mechanic_tg_id, chunk)
+
+
+async def flush_mechanic_digest(mechanic_tg_id, items):
+    """
+    Wysyła zebrane zgłoszenia porcjami. Zwraca niewysłane do ponowienia
+    (błąd sieci, RetryAfter); odrzuconą porcję (BadRequest) wysyła po jednym.
+    Zablokowany bot (Forbidden) — bez ponawiania, zgłoszenia są w /my_jobs.
+    """
+    chunks = service_chunks(items)
+    for i, chunk in enumerate(chunks):
+        try:
+            await send_service_message(mechanic_tg_id, chunk)
+        except TelegramForbiddenError as e:
+            logger.warning("Mechanik %s zablokował bota, zgłoszenia %s tylko w /my_jobs: %s",
+                           mechanic_tg_id, [svc_id for svc_id, _ in items], e)
+            return []
+        except TelegramBadRequest as e:
+            logger.warning("Porcja zgłoszeń %s odrzucona (%s) — wysyłam pojedynczo",
+                           [svc_id for svc_id, _ in chunk], e)
+            for item in chunk:
+                try:
+                    await send_service_message(mechanic_tg_id, [item])
+                except TelegramAPIError as e:
+                    logger.error("Nie udało się wysłać zgłoszenia #%s do mechanika %s: %s",
+                                 item[0], mechanic_tg_id, e)
+        except Exception as e:
+            logger.warning("Nie udało się wysłać zgłoszeń %s do mechanika %s: %s — ponowię",
+                           [svc_id for svc_id, _ in chunk], mechanic_tg_id, e)
+            return [item for rest in chunks[i:] for item in rest]
+    return []
+
+
+mechanic_digest = DigestNotifier(DIGEST_WINDOW_SECONDS, flush_mechanic_digest)
+
+
+# ======================================================================
+#                    ZGŁOSZENIA ZBIORCZE: /service_batch
+# ======================================================================
+
+BATCH_FILTER_KEYS = {
+    "firma": "owner_company",
+    "model": "model",
+    "paliwo": "fuel_type",
+}
+# do tylu zgłoszeń na mechanika wysyłamy pełne karty z przyciskami
+BATCH_DETAILED = 5
+
+
+def parse_batch_filter(text):
+    """
+    'firma=ABC; paliwo=diesel' -> ({owner_company: ..., fuel_type: ...}, None)
+    'WE123 WX456, KR789'       -> ({}, [numery])
+    """
+    if "=" not in text:
+        plates = [p for p in text.replace(",", " ").split() if p]
+        return {}, plates
+
+    filters = {}
+    for part in text.replace("\n", ";").split(";"):
+        if not part.strip():
+            continue
+        key, _, value = part.partition("=")
+        column = BATCH_FILTER_KEYS.get(key.strip().lower())
+        if column is None or not value.strip():
+            raise ValueError(key.strip())
+        filters[column] = value.strip()
+    return filters, None
+
+
+@dp.message(Command("service_batch"))
+async def cmd_service_batch(message: Message, state: FSMContext):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Brak uprawnień administratora.")
+        return
+
+    await state.set_state(BatchServiceStates.cars)
+    await message.answer(
+        "Zgłoszenie zbiorcze. Podaj filtr aut, np.:\n"
+        "firma=ABC Sp. z o.o.; paliwo=diesel\n"
+        "(klucze: firma, model, paliwo)\n\n"
+        "albo listę numerów rejestracyjnych oddzielonych spacją / przecinkiem."
     )
 
+
+@dp.message(BatchServiceStates.cars)
+async def batch_cars(message: Message, state: FSMContext):
     try:
-        await bot.send_message(data["mechanic_tg_id"], text_mech, reply_markup=kb)
-        await message.answer(f"Zgłoszenie serwisowe #{svc_id} zostało utworzone i wysłane do mechanika.")
+        filters, plates = parse_batch_filter(message.text or "")
+    except ValueError as e:
+        await message.answer(f"❗ Nieznany klucz filtra: {e}. Dozwolone: firma, model, paliwo.")
+        return
+    if not filters and not plates:
+        await message.answer("❗ Podaj filtr albo numery rejestracyjne.")
+        return
+
+    cars, missing = db.find_cars(tenant_path(message.from_user.id), plates=plates, **filters)
+    if missing:
+        await message.answer("⚠️ Nie znaleziono: " + ", ".join(missing[:50]))
+    if not cars:
+        await message.answer("❗ Żadne auto nie pasuje. Podaj inny filtr:")
+        return
+    if len(cars) > BATCH_MAX_CARS:
+        await message.answer(f"❗ Pasuje {len(cars)} aut (limit {BATCH_MAX_CARS}). Zawęź filtr:")
+        return
+
+    mechs = get_mechanics_from_db(router.tenant_for_user(message.from_user.id))
+    if not mechs:
+        await state.clear()
+        await message.answer("❗ W systemie nie ma żadnych mechaników. Dodaj ich przez /add_mechanic <id>.")
+        return
+
+    await state.update_data(car_ids=[c["id"] for c in cars])
+    await state.set_state(BatchServiceStates.choose_mechanic)
+
+    sample = ", ".join(c["plate"] or str(c["id"]) for c in cars[:10])
+    more = f" i {len(cars) - 10} innych" if len(cars) > 10 else ""
+    kb = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text=(m["full_name"] or str(m["tg_id"])),
+                                  callback_data=f"batch_mech:{m['tg_id']}")]
+            for m in mechs
+        ] + [[InlineKeyboardButton(text="🔁 Rozdziel równo", callback_data="batch_mech:all")]]
+    )
+    await message.answer(
+        f"Wybrano aut: {len(cars)} ({sample}{more}).\nKomu przydzielić zlecenia?",
+        reply_markup=kb,
+    )
+
+
+@dp.callback_query(BatchServiceStates.choose_mechanic, F.data.startswith("batch_mech:"))
+async def callback_batch_mechanic(call: CallbackQuery, state: FSMContext):
+    choice = call.data.split(":")[1]
+    await state.update_data(batch_mechanic=choice)
+    await state.set_state(BatchServiceStates.description)
+    await call.answer()
+    await call.message.edit_reply_markup(reply_markup=None)
+    await call.message.answer("Opisz zakres prac (wspólny dla wszystkich aut):")
+
+
+@dp.message(BatchServiceStates.description)
+async def batch_description(message: Message, state: FSMContext):
+    await state.update_data(description=message.text.strip())
+    await state.set_state(BatchServiceStates.desired_at)
+    await message.answer("Wprowadź preferowany termin (np. 2025-12-05 11:00):")
+
+
+@dp.message(BatchServiceStates.desired_at)
+async def batch_desired_at(message: Message, state: FSMContext):
+    desired = message.text.strip()
+    data = await state.get_data()
+    await state.clear()
+    path = tenant_path(message.from_user.id)
+
+    if data["batch_mechanic"] == "all":
+        mechs = [m["tg_id"] for m in get_mechanics_from_db(router.tenant_for_user(message.from_user.id))]
+    else:
+        mechs = [int(data["batch_mechanic"])]
+    if not mechs:
+        await message.answer("❗ W systemie nie ma żadnych mechaników. Dodaj ich przez /add_mechanic <id>.")
+        return
+    assignments = [(car_id, mechs[i % len(mechs)]) for i, car_id in enumerate(data["car_ids"])]
+
+    started = time.perf_counter()
+    rows = db.create_services(path, assignments, message.from_user.id, data["description"], desired)
+
+    per_mechanic = {}
+    for r in rows:
+        per_mechanic.setdefault(r["mechanic_tg_id"], []).append(r)
+    results = await asyncio.gather(*(
+        send_batch_services(path, mech, jobs) for mech, jobs in per_mechanic.items()
+    ))
+
+    await message.answer(
+        f"Utworzono zgłoszeń: {len(rows)} (#{rows[0]['id']}–#{rows[-1]['id']}) "
+        f"w {time.perf_counter() - started:.1f} s.\n"
+        f"Powiadomieni mechanicy: {sum(results)}/{len(results)}."
+    )
+
+
+async def send_batch_services(path, mechanic_tg_id, rows):
+    """Jedna wiadomość na mechanika: pełne karty dla kilku zleceń, lista dla wielu."""
+    try:
+        if len(rows) <= BATCH_DETAILED:
+            await send_new_services(mechanic_tg_id, [
+                (r["id"], render.service_summary(path, r["id"], row=r)) for r in rows
+            ])
+            return True
+
+        header = (
+            f"Nowe zgłoszenia ({len(rows)}): {rows[0]['description'] or '-'}\n"
+            f"Termin: {rows[0]['desired_at'] or '-'}\n\n"
+        )
+        lines = [f"#{r['id']} {r['plate'] or '-'} — {r['owner_company'] or '-'}" for r in rows]
+        chunks, current = [], header
+        for line in lines:
+            if len(current) + len(line) > 3900:
+                chunks.append(current)
+                current = ""
+            current += line + "\n"
+        chunks.append(current + "\nPotwierdź lub odrzuć w /my_jobs.")
+
+        kb = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="📋 Moje zlecenia", callback_data="jobs:page:0"),
+        ]])
+        for i, chunk in enumerate(chunks):
+            await bot.send_message(
+                mechanic_tg_id, chunk, reply_markup=kb if i == len(chunks) - 1 else None
+            )
+        return True
     except Exception as e:
-        await message.answer(f"⚠️ Nie udało się wysłać zgłoszenia do mechanika.\nBłąd: {e}")
+        logger.warning("Nie udało się wysłać zgłoszeń zbiorczych do mechanika %s: %s", mechanic_tg_id, e)
+        return False
+
+
+# ======================================================================
+#                          ZLECENIA MECHANIKA: /my_jobs
+# ======================================================================
+
+JOB_STATUS_ICONS = {"pending": "🕓", "confirmed": "🔧"}
+
+
+def render_jobs_page(tg_id, page):
+    rows, total = db.list_mechanic_jobs(
+        tenant_path(tg_id), tg_id, offset=page * JOBS_PAGE_SIZE, limit=JOBS_PAGE_SIZE
+    )
+    if total == 0:
+        return "Nie masz otwartych zleceń.", None
+
+    pages = (total + JOBS_PAGE_SIZE - 1) // JOBS_PAGE_SIZE
+    lines = [f"Twoje zlecenia ({total}), strona {page + 1}/{pages}:\n"]
+    buttons = []
+    for job in rows:
+        lines.append(
+            f"{JOB_STATUS_ICONS.get(job['status'], '')} #{job['id']} {job['plate'] or '-'} — "
+            f"{job['desired_at'] or '-'}\n{job['description'] or ''}"
+        )
+        if job["status"] == "pending":
+            buttons.append([
+                InlineKeyboardButton(text=f"✅ #{job['id']}", callback_data=f"svc_confirm:{job['id']}"),
+                InlineKeyboardButton(text=f"❌ #{job['id']}", callback_data=f"svc_reject:{job['id']}"),
+            ])
+        else:
+            buttons.append([
+                InlineKeyboardButton(text=f"🏁 Zakończ #{job['id']}", callback_data=f"svc_complete:{job['id']}"),
+            ])
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"jobs:page:{page - 1}"))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"jobs:page:{page + 1}"))
+    if nav:
+        buttons.append(nav)
+
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@dp.message(Command("my_jobs"))
+async def cmd_my_jobs(message: Message):
+    await ensure_user_registered(message)
+    text, kb = render_jobs_page(message.from_user.id, 0)
+    await message.answer(text, reply_markup=kb)
+
+
+@dp.callback_query(F.data.startswith("jobs:page:"))
+async def callback_jobs_page(call: CallbackQuery):
+    page = max(0, int(call.data.split(":")[2]))
+    text, kb = render_jobs_page(call.from_user.id, page)
+    await call.answer()
+    try:
+        await call.message.edit_text(text, reply_markup=kb)
+    except TelegramAPIError as e:
+        logger.debug("strona zleceń: %s", e)
 
 
 # ======================================================================
@@ -658,7 +1195,8 @@ async def service_desired_at(message: Message, state: FSMContext):
 @dp.callback_query(F.data.startswith("svc_confirm:"))
 async def callback_confirm_service(call: CallbackQuery):
     svc_id = int(call.data.split(":")[1])
-    svc = db.get_service(DB_PATH, svc_id)
+    logs.bind(svc_id=svc_id)
+    svc = db.get_service(tenant_path(call.from_user.id), svc_id)
 
     if not svc:
         await call.answer("Zgłoszenie nie zostało znalezione.", show_alert=True)
@@ -672,17 +1210,13 @@ async def callback_confirm_service(call: CallbackQuery):
         await call.answer("Status został już zmieniony.", show_alert=True)
         return
 
-    db.update_service_status(DB_PATH, svc_id, "confirmed")
+    db.update_service_status(
+        tenant_path(call.from_user.id), svc_id, "confirmed", actor_tg_id=call.from_user.id
+    )
     await call.answer("Zgłoszenie potwierdzone.")
     await call.message.edit_reply_markup(reply_markup=None)
 
-    try:
-        await bot.send_message(
-            svc["admin_tg_id"],
-            f"Mechanik potwierdził zgłoszenie serwisowe #{svc_id}."
-        )
-    except Exception:
-        pass
+    await notify(svc["admin_tg_id"], f"Mechanik potwierdził zgłoszenie serwisowe #{svc_id}.")
 
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -704,7 +1238,8 @@ async def callback_confirm_service(call: CallbackQuery):
 @dp.callback_query(F.data.startswith("svc_reject:"))
 async def callback_reject_service(call: CallbackQuery, state: FSMContext):
     svc_id = int(call.data.split(":")[1])
-    svc = db.get_service(DB_PATH, svc_id)
+    logs.bind(svc_id=svc_id)
+    svc = db.get_service(tenant_path(call.from_user.id), svc_id)
 
     if not svc:
         await call.answer("Zgłoszenie nie zostało znalezione.", show_alert=True)
@@ -733,6 +1268,7 @@ async def callback_reject_service(call: CallbackQuery, state: FSMContext):
 async def reject_alt_time(message: Message, state: FSMContext):
     data = await state.get_data()
     svc_id = data.get("svc_id")
+    logs.bind(svc_id=svc_id)
     alt = message.text.strip()
     await state.clear()
 
@@ -740,24 +1276,21 @@ async def reject_alt_time(message: Message, state: FSMContext):
         await message.answer("Sesja utracona. Spróbuj ponownie.")
         return
 
-    db.update_service_status(DB_PATH, svc_id, "rejected")
-    svc = db.get_service(DB_PATH, svc_id)
+    db.update_service_status(
+        tenant_path(message.from_user.id), svc_id, "rejected", actor_tg_id=message.from_user.id
+    )
+    svc = db.get_service(tenant_path(message.from_user.id), svc_id)
 
     alt_text = alt if alt != "-" else "—"
 
+    summary = render.service_summary(tenant_path(message.from_user.id), svc_id, row=svc)
     text_admin = (
         f"Mechanik ODRZUCIŁ zgłoszenie #{svc_id}.\n\n"
-        f"Samochód: {svc['plate']}\n"
-        f"VIN: {svc['vin']}\n"
-        f"Firma: {svc['owner_company'] or '-'}\n"
-        f"Pierwotna data: {svc['desired_at']}\n"
+        f"{summary}\n"
         f"Proponowany termin od mechanika: {alt_text}"
     )
 
-    try:
-        await bot.send_message(svc["admin_tg_id"], text_admin)
-    except Exception:
-        pass
+    await notify(svc["admin_tg_id"], text_admin)
 
     await message.answer("Dziękujemy. Twoja propozycja czasu została wysłana administratorowi.")
 
@@ -769,7 +1302,8 @@ async def reject_alt_time(message: Message, state: FSMContext):
 @dp.callback_query(F.data.startswith("svc_complete:"))
 async def callback_complete_service(call: CallbackQuery, state: FSMContext):
     svc_id = int(call.data.split(":")[1])
-    svc = db.get_service(DB_PATH, svc_id)
+    logs.bind(svc_id=svc_id)
+    svc = db.get_service(tenant_path(call.from_user.id), svc_id)
 
     if not svc:
         await call.answer("Zgłoszenie nie zostało znalezione.", show_alert=True)
@@ -803,70 +1337,188 @@ async def complete_final_mileage(message: Message, state: FSMContext):
         return
 
     await state.update_data(final_mileage=mileage)
-    await state.set_state(CompleteServiceStates.cost_net)
+    await state.set_state(CompleteServiceStates.cost_net_gr)
     await message.answer("Wprowadź koszt netto (liczba, np. 500):")
 
 
-@dp.message(CompleteServiceStates.cost_net)
+@dp.message(CompleteServiceStates.cost_net_gr)
 async def complete_cost_net(message: Message, state: FSMContext):
     try:
-        cost_net = float(message.text.replace(",", ".").strip())
-        if cost_net < 0:
-            raise ValueError
+        cost_net_gr = money.parse(message.text)
     except ValueError:
-        await message.answer("Koszt musi być liczbą dodatnią. Wprowadź ponownie:")
+        await message.answer(
+            "Koszt musi być kwotą dodatnią (najwyżej 2 miejsca po przecinku, "
+            f"do {money.fmt(money.MAX_GROSZE)} zł). Wprowadź ponownie:"
+        )
         return
 
-    await state.update_data(cost_net=cost_net)
+    await state.update_data(cost_net_gr=cost_net_gr)
     await state.set_state(CompleteServiceStates.comments)
     await message.answer("Dodaj komentarz/zalecenia (lub '-' jeśli brak):")
 
 
 @dp.message(CompleteServiceStates.comments)
 async def complete_comments(message: Message, state: FSMContext):
-    comments = message.text.strip()
+    comments = (message.text or "").strip()
     if comments == "-":
         comments = None
 
-    data = await state.get_data()
-    await state.clear()
+    await state.update_data(comments=comments, attached=0)
+    await state.set_state(CompleteServiceStates.attachments)
+    await message.answer(
+        "📎 Wyślij zdjęcia uszkodzeń lub faktury (PDF).\n"
+        "Gdy skończysz, napisz 'gotowe' (lub '-' jeśli brak załączników)."
+    )
+
+
+@dp.message(CompleteServiceStates.attachments, F.photo | F.document)
+async def complete_attachment(message: Message, state: FSMContext):
+    item = attachments.describe(message)
+    error = attachments.validate(item)
+    if error:
+        await message.answer(f"❗ {error}")
+        return
 
-    db.set_service_result(
-        DB_PATH,
-        svc_id=data["svc_id"],
-        final_mileage=data["final_mileage"],
-        cost_net=data["cost_net"],
-        comments=comments,
+    data = await state.get_data()
+    task = attachment_store.submit(
+        bot, tenant_path(message.from_user.id), data["svc_id"], item, message.from_user.id
     )
+    if task is None:
+        await message.answer("⏳ Zbyt wiele plików w kolejce. Wyślij ten załącznik za chwilę.")
+        return
+    attached = data.get("attached", 0) + 1
+    await state.update_data(attached=attached)
+    await message.answer(f"📎 Przyjęto załącznik ({attached}). Wyślij kolejny lub napisz 'gotowe'.")
+
 
-    sum_vat = round(data["cost_net"] * 0.23, 2)
-    sum_gross = round(data["cost_net"] + sum_vat, 2)
+@dp.message(CompleteServiceStates.attachments)
+async def complete_service_done(message: Message, state: FSMContext):
+    if (message.text or "").strip().lower() not in ("gotowe", "-"):
+        await message.answer("Wyślij zdjęcie / PDF albo napisz 'gotowe'.")
+        return
+
+    data = await state.get_data()
+    logs.bind(svc_id=data["svc_id"])
+    path = tenant_path(message.from_user.id)
+
+    # stan czyścimy dopiero po zapisie — przy błędzie można ponowić 'gotowe'
+    try:
+        db.set_service_result(
+            path,
+            svc_id=data["svc_id"],
+            final_mileage=data["final_mileage"],
+            cost_net_gr=data["cost_net_gr"],
+            comments=data["comments"],
+            actor_tg_id=message.from_user.id,
+        )
+    except (sqlite3.Error, OverflowError) as e:
+        logger.exception("Nie udało się zapisać wyniku serwisu #%s", data["svc_id"])
+        await message.answer(
+            f"⚠️ Nie udało się zapisać wyniku serwisu.\nBłąd: {e}\n"
+            "Napisz 'gotowe', aby spróbować ponownie."
+        )
+        return
+    await state.clear()
 
     await message.answer(
         f"Serwis #{data['svc_id']} zakończony.\n"
         f"Przebieg: {data['final_mileage']} km\n"
-        f"NETTO: {data['cost_net']:.2f}\n"
-        f"VAT 23%: {sum_vat:.2f}\n"
-        f"BRUTTO: {sum_gross:.2f}"
+        f"{render.money_lines(data['cost_net_gr'], db.get_rates(path)['vat_bp'])}"
     )
 
-    svc = db.get_service(DB_PATH, data["svc_id"])
-    admin_text = (
-        f"ZGŁOSZENIE SERWISOWE ZAKOŃCZONE #{data['svc_id']}\n\n"
-        f"Samochód: {svc['plate']}\n"
-        f"VIN: {svc['vin']}\n"
-        f"Firma: {svc['owner_company'] or '-'}\n"
-        f"Końcowy przebieg: {data['final_mileage']} km\n"
-        f"NETTO: {data['cost_net']:.2f}\n"
-        f"VAT 23%: {sum_vat:.2f}\n"
-        f"BRUTTO: {sum_gross:.2f}\n"
-        f"Komentarz mechanika: {comments or '—'}"
-    )
+    spawn(notify_service_done(path, data["svc_id"]))
+
+
+async def notify_service_done(path, svc_id):
+    """Admin dostaje podsumowanie dopiero, gdy załączniki są zapisane."""
+    await attachment_store.wait(path, svc_id)
+    files = db.list_attachments(path, svc_id)
+
+    svc = db.get_service(path, svc_id)
+    summary = render.service_summary(path, svc_id, row=svc)
+    admin_text = f"ZGŁOSZENIE SERWISOWE ZAKOŃCZONE #{svc_id}\n\n{summary}"
+    if files:
+        admin_text += f"\n\n📎 Załączniki: {len(files)} (/attachments {svc_id})"
+
+    await notify(svc["admin_tg_id"], admin_text)
+
+
+@dp.message(Command("attachments"))
+async def cmd_attachments(message: Message):
+    await ensure_user_registered(message)
+
+    parts = message.text.split()
+    if len(parts) != 2 or not parts[1].isdigit():
+        await message.answer("Użycie: /attachments ID_zgłoszenia")
+        return
+
+    svc_id = int(parts[1])
+    path = tenant_path(message.from_user.id)
+    svc = db.get_service(path, svc_id)
+    if not svc or (svc["mechanic_tg_id"] != message.from_user.id and not await check_admin(message)):
+        await message.answer("❗ Zgłoszenie nie zostało znalezione.")
+        return
+
+    files = db.list_attachments(path, svc_id)
+    if not files:
+        await message.answer(f"Zgłoszenie #{svc_id} nie ma załączników.")
+        return
+
+    for f in files:
+        caption = f"#{svc_id}: {f['name'] or f['kind']}"
+        if f["kind"] == "photo":
+            await message.answer_photo(f["tg_file_id"], caption=caption)
+        else:
+            await message.answer_document(f["tg_file_id"], caption=caption)
+
+
+# ======================================================================
+#                           STAWKI: VAT / PROWIZJA
+# ======================================================================
+
+RATE_NAMES = {"vat": "vat_bp", "prowizja": "commission_bp"}
+
+
+@dp.message(Command("rates"))
+async def cmd_rates(message: Message):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Brak uprawnień.")
+        return
+
+    per_tenant = await asyncio.to_thread(router.fanout, db.get_rates)
+    lines = ["<b>Stawki</b>"]
+    for tenant, rates in per_tenant.items():
+        prefix = f"{tenant}: " if len(per_tenant) > 1 else ""
+        lines.append(
+            f"{prefix}VAT {money.fmt_rate(rates['vat_bp'])}, "
+            f"prowizja {money.fmt_rate(rates['commission_bp'])}"
+        )
+    await message.answer("\n".join(lines))
+
 
+@dp.message(Command("set_rate"))
+async def cmd_set_rate(message: Message):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Brak uprawnień.")
+        return
+
+    parts = message.text.split()
     try:
-        await bot.send_message(svc["admin_tg_id"], admin_text)
-    except Exception:
-        pass
+        name = RATE_NAMES[parts[1].lower()]
+        # procent z dwoma miejscami po przecinku = punkty bazowe (23 -> 2300)
+        bp = money.parse(parts[2].rstrip("%"))
+        if bp > money.BP:
+            raise ValueError
+    except (IndexError, KeyError, ValueError):
+        await message.answer("Użycie: /set_rate vat|prowizja PROCENT, np. /set_rate vat 23")
+        return
+
+    await asyncio.to_thread(router.fanout, db.set_rate, name, bp)
+    await message.answer(f"Ustawiono {parts[1].lower()}: {money.fmt_rate(bp)}.")
 
 
 # ======================================================================
@@ -894,27 +1546,572 @@ async def cmd_report_month(message: Message):
         now = datetime.now()
         year, month = now.year, now.month
 
-    sum_net, commission = db.monthly_report(DB_PATH, year, month)
+    spawn(send_month_report(message, year, month))
 
-    await message.answer(
+
+async def send_month_report(message, year, month):
+    tenants = router.tenant_paths()
+    owner = message.from_user.id
+    results = await asyncio.gather(*(
+        shared_report(("report_month", path, year, month), owner, path, db.monthly_report, year, month)
+        for path in tenants.values()
+    ))
+    failed = next((r for r in results if not r.ok), None)
+    if failed is not None:
+        await message.answer(report_failure_text(failed))
+        return
+
+    per_tenant = {tenant: r.value for tenant, r in zip(tenants, results)}
+    sum_net = sum(net for net, _, _ in per_tenant.values())
+    commission = sum(comm for _, comm, _ in per_tenant.values())
+    rates = {rate for _, _, rate in per_tenant.values()}
+    rate_label = f" {money.fmt_rate(rates.pop())}" if len(rates) == 1 else ""
+
+    text = (
         f"Raport za {year}-{month:02d}:\n"
-        f"Suma NETTO zakończonych serwisów: <b>{sum_net:.2f}</b>\n"
-        f"Prowizja 10%: <b>{commission:.2f}</b>"
+        f"Suma NETTO zakończonych serwisów: <b>{money.fmt(sum_net)}</b>\n"
+        f"Prowizja{rate_label}: <b>{money.fmt(commission)}</b>"
     )
+    if len(per_tenant) > 1:
+        text += "\n\nWg tenanta:\n" + "\n".join(
+            f"{tenant}: {money.fmt(net)} / {money.fmt(comm)} ({money.fmt_rate(rate)})"
+            for tenant, (net, comm, rate) in per_tenant.items()
+        )
+    await message.answer(text)
+
+
+async def shared_report(key, owner, path, fn, *args):
+    """
+    Raport przez inflight (identyczne zapytania dzielą jedno obliczenie);
+    owner jest zapisany jako oczekujący — /cancel_report nie przerwie
+    raportu, na który czeka też ktoś inny.
+    """
+    with report_engine.waiting(key, owner):
+        return await inflight.run(
+            key, lambda: report_engine.run(path, fn, *args, owner=owner, key=key)
+        )
+
+
+def report_failure_text(result):
+    if result.status == reports.TIMEOUT:
+        return (
+            f"⏱ Raport przekroczył limit czasu ({REPORT_DEADLINE_SECONDS:.0f} s) i został przerwany. "
+            "Spróbuj węższego zakresu."
+        )
+    if result.status == reports.CANCELLED:
+        return "Raport został anulowany."
+    if result.status == reports.BUSY:
+        return "⏳ Zbyt wiele raportów w toku. Spróbuj ponownie za chwilę."
+    return f"⚠️ Nie udało się wygenerować raportu.\nBłąd: {result.error}"
+
+
+@dp.message(Command("cancel_report"))
+async def cmd_cancel_report(message: Message):
+    count, shared = report_engine.cancel(message.from_user.id)
+    if count:
+        await message.answer(f"Przerywam raporty: {count}.")
+    elif shared:
+        await message.answer(
+            "Twój raport liczy się razem z raportem innego użytkownika — nie przerywam go, "
+            "wynik przyjdzie za chwilę."
+        )
+    else:
+        await message.answer("Nie masz trwających raportów.")
+
+
+# ======================================================================
+#                               DASHBOARD
+# ======================================================================
+
+STATUS_LABELS = {
+    "pending": "Oczekujące",
+    "confirmed": "Potwierdzone",
+    "rejected": "Odrzucone",
+    "done": "Zakończone",
+}
+
+
+def merge_dashboards(kpis):
+    """Łączy wskaźniki z wielu tenantów w jeden dashboard."""
+    statuses, mechanics, companies = {}, {}, {}
+    overdue_count, overdue = 0, []
+
+    for kpi in kpis:
+        for status, cnt in kpi["statuses"].items():
+            statuses[status] = statuses.get(status, 0) + cnt
+        for m in kpi["mechanics"]:
+            mechanics[m["mechanic_tg_id"]] = mechanics.get(m["mechanic_tg_id"], 0) + m["cnt"]
+        for c in kpi["companies"]:
+            services, total = companies.get(c["owner_company"], (0, 0))
+            companies[c["owner_company"]] = (services + c["services"], total + c["total_gr"])
+        overdue_count += kpi["overdue_count"]
+        overdue.extend(kpi["overdue"])
+
+    names = db.get_user_names(DB_PATH, mechanics)
+    return {
+        "statuses": dict(sorted(statuses.items())),
+        "mechanics": [
+            {"mechanic_tg_id": tg_id, "full_name": names.get(tg_id), "cnt": cnt}
+            for tg_id, cnt in sorted(mechanics.items(), key=lambda kv: -kv[1])
+        ],
+        "companies": [
+            {"owner_company": name, "services": services, "total_gr": total}
+            for name, (services, total) in sorted(companies.items(), key=lambda kv: -kv[1][1])
+        ][:5],
+        "overdue_count": overdue_count,
+        "overdue": sorted(overdue, key=lambda car: car["last_service_at"])[:5],
+    }
+
+
+@dp.message(Command("dashboard"))
+async def cmd_dashboard(message: Message):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Brak uprawnień.")
+        return
+
+    per_tenant = await asyncio.to_thread(
+        router.fanout, db.get_dashboard, overdue_days=SERVICE_INTERVAL_DAYS
+    )
+    kpi = merge_dashboards(per_tenant.values())
+
+    lines = ["<b>Dashboard floty</b>", "", "<b>Zgłoszenia wg statusu:</b>"]
+    for status, cnt in kpi["statuses"].items():
+        lines.append(f"{STATUS_LABELS.get(status, status)}: {cnt}")
+    if not kpi["statuses"]:
+        lines.append("—")
+
+    lines += ["", "<b>Zgłoszenia mechaników w tym tygodniu:</b>"]
+    for m in kpi["mechanics"]:
+        lines.append(f"{m['full_name'] or m['mechanic_tg_id']}: {m['cnt']}")
+    if not kpi["mechanics"]:
+        lines.append("—")
+
+    lines += ["", "<b>Wydatki NETTO wg firmy:</b>"]
+    for c in kpi["companies"]:
+        lines.append(f"{c['owner_company']}: {money.fmt(c['total_gr'])} ({c['services']} serwisów)")
+    if not kpi["companies"]:
+        lines.append("—")
+
+    lines += ["", f"<b>Auta bez serwisu > {SERVICE_INTERVAL_DAYS} dni:</b> {kpi['overdue_count']}"]
+    for car in kpi["overdue"]:
+        lines.append(f"{car['plate'] or car['id']} — od {car['last_service_at'][:10]}")
+
+    await message.answer("\n".join(lines))
+
+
+# ======================================================================
+#                               ANALITYKA
+# ======================================================================
+
+ANALYTICS_GROUP_LABELS = {
+    "model": "Model",
+    "company": "Firma",
+    "fuel": "Paliwo",
+}
+
+
+def format_analytics(result, top=5):
+    lines = [f"<b>Analityka kosztów</b> ({result['services']} zakończonych serwisów)"]
+
+    for group, label in ANALYTICS_GROUP_LABELS.items():
+        rows = sorted(result["groups"][group], key=lambda r: -r["total"])[:top]
+        lines += ["", f"<b>{label}:</b>"]
+        for r in rows:
+            per_km = f"{r['cost_per_km'] / 100:.3f}/km" if r["cost_per_km"] else "—/km"
+            lines.append(
+                f"{r['label']}: {money.fmt(r['total'])} "
+                f"({r['services']} szt., śr. {r['mean'] / 100:.2f}, {per_km})"
+            )
+
+    cars = [r for r in result["groups"]["car"] if r["cost_per_km"]]
+    cars.sort(key=lambda r: -r["cost_per_km"])
+    if cars:
+        lines += ["", "<b>Najdroższe auta na km:</b>"]
+        for r in cars[:top]:
+            lines.append(f"ID {r['label']}: {r['cost_per_km'] / 100:.3f}/km ({r['km']:.0f} km)")
+
+    if result["trend"]:
+        lines += ["", "<b>Wydatki miesięczne:</b>"]
+        for month, total in result["trend"][-6:]:
+            lines.append(f"{month}: {money.fmt(total)}")
+
+    lines += ["", f"<b>Nietypowo drogie serwisy:</b> {len(result['outliers'])}"]
+    for o in result["outliers"][:top]:
+        lines.append(f"#{o['svc_id']} ({o['model']}): {money.fmt(o['cost'])}")
+
+    lines += ["", f"<b>Cofnięty licznik:</b> {len(result['regressions'])}"]
+    for r in result["regressions"][:top]:
+        lines.append(f"#{r['svc_id']} auto ID {r['car_id']}: {r['final_mileage']} km")
+
+    return "\n".join(lines)
+
+
+@dp.message(Command("analytics"))
+async def cmd_analytics(message: Message):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Brak uprawnień.")
+        return
+
+    spawn(send_analytics(message, tenant_path(message.from_user.id)))
+
+
+async def send_analytics(message, path):
+    result = await shared_report(("analytics", path), message.from_user.id, path, analytics.fleet_analytics)
+    if not result.ok:
+        await message.answer(report_failure_text(result))
+        return
+    await message.answer(format_analytics(result.value))
+
+
+# ======================================================================
+#                             ARCHIWIZACJA
+# ======================================================================
+
+@dp.message(Command("archive"))
+async def cmd_archive(message: Message):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Brak uprawnień.")
+        return
+
+    parts = message.text.split()
+    days = ARCHIVE_AFTER_DAYS
+    if len(parts) == 2:
+        try:
+            days = int(parts[1])
+            if days < 0:
+                raise ValueError
+        except ValueError:
+            await message.answer("Użycie: /archive [dni], np. /archive 365")
+            return
+
+    spawn(run_archive(message, days))
+
+
+async def run_archive(message, days):
+    moved = merge_archive_results(
+        await asyncio.to_thread(router.fanout, db.archive_services, days)
+    )
+
+    if not moved:
+        await message.answer(f"Brak zgłoszeń starszych niż {days} dni do archiwizacji.")
+        return
+
+    lines = [f"Zarchiwizowano zgłoszenia starsze niż {days} dni:"]
+    for year, count in sorted(moved.items()):
+        lines.append(f"{year}: {count}")
+    await message.answer("\n".join(lines))
+
+
+def merge_archive_results(per_tenant):
+    moved = {}
+    for tenant_moved in per_tenant.values():
+        for year, count in tenant_moved.items():
+            moved[year] = moved.get(year, 0) + count
+    return moved
+
+
+async def archive_loop():
+    """Okresowo przenosi stare zgłoszenia do archiwum."""
+    while True:
+        try:
+            moved = merge_archive_results(
+                await asyncio.to_thread(router.fanout, db.archive_services, ARCHIVE_AFTER_DAYS)
+            )
+            if moved:
+                logger.info("Archiwizacja: %s", moved)
+        except Exception:
+            logger.exception("Archiwizacja nie powiodła się")
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+
+# ======================================================================
+#                               PAMIĘĆ
+# ======================================================================
+
+def memory_structures():
+    """Rozmiar, limit i usunięte wpisy każdej struktury trzymanej w pamięci."""
+    structures = {}
+    structures.update(db.cache_stats())
+    structures.update(router.cache_stats())
+    structures.update(render.cache_stats())
+    structures.update(analytics.cache_stats())
+    structures.update(dp.storage.stats())
+    structures.update(throttle.stats())
+    structures.update(inflight.stats())
+    structures.update(mechanic_digest.stats())
+    structures.update(report_engine.stats())
+    structures.update(attachment_store.stats())
+    structures.update(update_isolation.stats())
+    if log_sampler is not None:
+        structures.update(log_sampler.stats())
+    # aktualizacje w toku liczy ChatIsolation (scheduler.updates);
+    # długie komendy uruchomione przez spawn() — raporty ogranicza report_engine
+    structures["bot.background"] = {"size": len(background), "bound": None, "evictions": 0}
+    # pozostałe zadania asyncio — bez własnego limitu
+    structures["asyncio.tasks"] = {"size": len(asyncio.all_tasks()), "bound": None, "evictions": 0}
+    return structures
+
+
+@dp.message(Command("memstats"))
+async def cmd_memstats(message: Message):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Brak uprawnień.")
+        return
+
+    sample = None
+    if memory_sampler.tracing():
+        sample = await asyncio.to_thread(memory_sampler.sample)
+    process = await asyncio.to_thread(memstats.process_stats)
+    await message.answer(memstats.format_report(process, memory_structures(), sample))
+
+
+@dp.message(Command("queue"))
+async def cmd_queue(message: Message):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Brak uprawnień.")
+        return
+
+    m = update_isolation.metrics()
+    await message.answer(
+        "Kolejka aktualizacji\n"
+        f"Czeka: {m['queued']}, w obsłudze: {m['running']}/{MAX_CONCURRENT_UPDATES} "
+        f"(czatów: {m['chats']})\n"
+        f"Maks. głębokość: {m['max_depth']} (wstrzymanie odbioru od {QUEUE_HIGH_WATER})\n"
+        f"Obsłużone: {m['handled']}, błędy: {m['failed']}\n"
+        f"Czekanie w kolejce: p50 {m['wait_p50_ms']} ms, p95 {m['wait_p95_ms']} ms\n"
+        f"Wstrzymania odbioru: {m['paused']} ({m['paused_seconds']} s)"
+    )
+
+
+async def memstats_loop():
+    """Okresowa próbka tracemalloc i rozmiarów struktur do logu."""
+    while True:
+        await asyncio.sleep(MEMSTATS_INTERVAL_MINUTES * 60)
+        try:
+            sample = await asyncio.to_thread(memory_sampler.sample)
+            structures = memory_structures()
+            logger.info(
+                "memstats", extra={
+                    "rss": memstats.rss_bytes(),
+                    "traced": sample["traced"],
+                    "top": sample["top"],
+                    "growth": sample["growth"],
+                    "structures": structures,
+                    "queue": update_isolation.metrics(),
+                },
+            )
+            full = memstats.near_bound(structures)
+            if full:
+                logger.warning("memstats: struktury blisko limitu: %s", ", ".join(full))
+        except Exception:
+            logger.exception("Próbka pamięci nie powiodła się")
+
+
+# ======================================================================
+#                        KOMPAKCJA DZIENNIKA ZDARZEŃ
+# ======================================================================
+
+async def compact_events_when_idle():
+    """Raz na dobę, gdy bot jest bezczynny, zwija stare zdarzenia."""
+    last_run = 0.0
+    while True:
+        await asyncio.sleep(60)
+        now = time.monotonic()
+        if now - LAST_UPDATE_AT < IDLE_COMPACT_SECONDS or now - last_run < 24 * 3600:
+            continue
+        try:
+            result = await asyncio.to_thread(router.fanout, db.compact_events, EVENTS_KEEP_DAYS)
+            logger.info("Kompakcja zdarzeń: %s", result)
+        except Exception:
+            logger.exception("Kompakcja zdarzeń nie powiodła się")
+        last_run = now
+
+
+# ======================================================================
+#                             KOPIA ZAPASOWA
+# ======================================================================
+
+def format_backup_report(dest, steps, ok, removed, archives):
+    total_pages = sum(st["pages"] for st in steps)
+    total_time = sum(st["duration"] for st in steps)
+    longest = max((st["duration"] for st in steps), default=0.0)
+
+    lines = [
+        f"Kopia: {os.path.basename(dest)}",
+        f"Weryfikacja: {'✅ OK' if ok else '❌ BŁĄD'}",
+        f"Stron: {total_pages} w {len(steps)} krokach, {total_time:.3f} s "
+        f"(najdłuższy krok {longest * 1000:.1f} ms)",
+    ]
+    if archives:
+        lines.append("Archiwa: " + ", ".join(
+            f"{year} {'✅' if archive_ok else '❌'}" for year, archive_ok in sorted(archives.items())
+        ))
+    for st in steps[:10]:
+        lines.append(f"  krok {st['step']}: {st['pages']} stron, {st['duration'] * 1000:.1f} ms")
+    if len(steps) > 10:
+        lines.append(f"  … i {len(steps) - 10} kolejnych kroków")
+    if removed:
+        lines.append(f"Usunięte stare kopie: {len(removed)}")
+    return "\n".join(lines)
+
+
+@dp.message(Command("backup"))
+async def cmd_backup(message: Message):
+    await ensure_user_registered(message)
+
+    if not await check_admin(message):
+        await message.answer("❌ Brak uprawnień.")
+        return
+
+    await message.answer("Tworzę kopię zapasową…")
+    spawn(run_backup(message))
+
+
+async def run_backup(message):
+    try:
+        results = await asyncio.to_thread(
+            router.fanout, db.snapshot_db, BACKUP_DIR, BACKUP_KEEP, BACKUP_STEP_PAGES
+        )
+    except Exception as e:
+        await message.answer(f"⚠️ Kopia zapasowa nie powiodła się.\nBłąd: {e}")
+        return
+
+    await message.answer("\n\n".join(format_backup_report(*r) for r in results.values()))
+
+
+async def backup_loop():
+    """Okresowa kopia online bazy z rotacją."""
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL_HOURS * 3600)
+        try:
+            results = await asyncio.to_thread(
+                router.fanout, db.snapshot_db, BACKUP_DIR, BACKUP_KEEP, BACKUP_STEP_PAGES
+            )
+            for tenant, result in results.items():
+                logger.info("Kopia zapasowa (%s):\n%s", tenant, format_backup_report(*result))
+        except Exception:
+            logger.exception("Kopia zapasowa nie powiodła się")
 
 
 # ======================================================================
 #                             STARTUP
 # ======================================================================
 
+@dp.update.outer_middleware()
+async def trace_update(handler, event, data):
+    """Kontekst śledzenia (update_id, user) i czas obsługi każdej aktualizacji."""
+    user = getattr(event.event, "from_user", None)
+    token = logs.start_trace(update_id=event.update_id, user=user.id if user else None)
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception:
+        logger.exception("błąd obsługi aktualizacji")
+        raise
+    finally:
+        logger.info(
+            "update", extra={
+                "sample": "update",
+                "type": event.event_type,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            },
+        )
+        logs.reset_trace(token)
+
+
+async def trace_handler(handler, event, data):
+    """Nazwa handlera w kontekście (znana dopiero po dopasowaniu filtrów)."""
+    matched = data.get("handler")
+    if matched is not None:
+        logs.bind(handler=matched.callback.__name__)
+    return await handler(event, data)
+
+
+dp.message.middleware(trace_handler)
+dp.callback_query.middleware(trace_handler)
+
+
+@dp.update.outer_middleware()
+async def first_update_probe(handler, event, data):
+    global LAST_UPDATE_AT
+    result = await handler(event, data)
+    LAST_UPDATE_AT = time.monotonic()
+    if "first_update" not in READINESS:
+        mark_ready("first_update")
+    return result
+
+
+async def startup():
+    """Sprawdza wersję schematu i równolegle rozgrzewa cache każdego tenanta."""
+    changed = await asyncio.to_thread(router.init_all)
+    migrated = [p for p, was_changed in changed.items() if was_changed]
+    if migrated:
+        logger.info("startup: zmigrowano schemat: %s", ", ".join(migrated))
+    mark_ready("schema")
+
+    timings = await asyncio.gather(
+        *(asyncio.to_thread(db.warm_caches, p) for p in router.paths())
+    )
+    for p, phases in zip(router.paths(), timings):
+        logger.info(
+            "startup: cache %s — %s", p,
+            ", ".join(f"{name} {sec * 1000:.1f} ms" for name, sec in phases.items()),
+        )
+    mark_ready("caches")
+
+
 async def main():
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN nie został ustawiony w .env")
-
-    db.init_db(DB_PATH)
-    print("Baza danych zainicjalizowana.")
-    print("Bot uruchomiony.")
-    await dp.start_polling(bot)
+    if CAPTURE_DIR and not CAPTURE_SALT:
+        raise RuntimeError("CAPTURE_DIR wymaga CAPTURE_SALT (sól anonimizacji nagrania)")
+
+    global log_sampler
+    log_listener, log_sampler = logs.setup(LOG_LEVEL, LOG_FILE or None, LOG_SAMPLE_RATE, LOG_MAX_PER_SECOND)
+    logger.info("startup: import modułów %.1f ms", READINESS["imports"] * 1000)
+    if MEMSTATS_INTERVAL_MINUTES > 0:
+        # przed rozgrzaniem cache, żeby było widać ich alokacje
+        memory_sampler.start()
+
+    await startup()
+
+    capture_listener = None
+    if CAPTURE_DIR:
+        capture_middleware, capture_listener = capture.setup(
+            CAPTURE_DIR, CAPTURE_SALT, CAPTURE_MAX_MB * 1024 * 1024, CAPTURE_KEEP
+        )
+        dp.update.outer_middleware(capture_middleware)
+        logger.info("startup: nagrywanie ruchu do %s", CAPTURE_DIR)
+
+    tasks = [
+        asyncio.create_task(archive_loop()),
+        asyncio.create_task(backup_loop()),
+        asyncio.create_task(compact_events_when_idle()),
+    ]
+    if MEMSTATS_INTERVAL_MINUTES > 0:
+        tasks.append(asyncio.create_task(memstats_loop()))
+    mark_ready("polling")
+    try:
+        await dp.start_polling(bot)
+    finally:
+        for task in tasks + list(background):
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await mechanic_digest.flush_all()
+        report_engine.shutdown()
+        if capture_listener is not None:
+            capture_listener.stop()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
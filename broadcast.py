@@ -0,0 +1,163 @@
+"""
+Rozsyłanie wiadomości do wielu odbiorców z ograniczeniem współbieżności
+i globalnym limitem tempa (Telegram: ok. 30 wiadomości / s na bota).
+"""
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+logger = logging.getLogger("fleet_bot.broadcast")
+
+MAX_RETRIES = 3
+
+
+class RateLimiter:
+    """
+    Kubełek tokenów: `rate` zdarzeń na sekundę, najwyżej `burst` naraz.
+    pause() wstrzymuje wszystkich korzystających (RetryAfter dotyczy bota,
+    nie pojedynczego odbiorcy).
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.pauses = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def pause(self, seconds):
+        """Brak tokenów przez `seconds` s; potem kubełek napełnia się od zera."""
+        until = time.monotonic() + seconds
+        if until > self.paused_until:
+            self.paused_until = until
+            self.tokens = 0
+            self.updated = until
+            self.pauses += 1
+
+    def try_acquire(self):
+        """Bez czekania: bierze token, jeśli jest; inaczej False."""
+        if time.monotonic() < self.paused_until:
+            return False
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_in(self):
+        """Sekundy do następnego tokenu."""
+        paused = self.paused_until - time.monotonic()
+        if paused > 0:
+            return paused
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    async def acquire(self):
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep(self.retry_in())
+
+
+# globalny limit bota — współdzielony przez wszystkie rozsyłki
+global_limiter = RateLimiter(rate=25)
+
+
+class BroadcastStats:
+    def __init__(self):
+        self.queued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.blocked = 0
+        self.started = time.monotonic()
+        self.finished = False
+
+    @property
+    def done(self):
+        return self.delivered + self.failed
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+async def _send(bot, chat_id, text, limiter, stats):
+    for _ in range(MAX_RETRIES):
+        await limiter.acquire()
+        try:
+            await bot.send_message(chat_id, text)
+            stats.delivered += 1
+            return
+        except TelegramRetryAfter as e:
+            # limit przekroczony dla całego bota — wstrzymuje wszystkie workery
+            limiter.pause(e.retry_after)
+        except TelegramForbiddenError:
+            stats.blocked += 1
+            break
+        except Exception as e:
+            logger.warning("rozsyłka do %s: %s", chat_id, e, extra={"sample": "broadcast_error"})
+            break
+    stats.failed += 1
+
+
+async def broadcast(bot, pages, text, concurrency=8, limiter=None,
+                    on_progress=None, progress_interval=2.0):
+    """
+    pages: funkcja async after -> lista ID (pusta = koniec); odbiorcy są
+    pobierani stronami w trakcie wysyłki, a nie ładowani wszyscy naraz.
+    on_progress: async callback(stats) wołany co `progress_interval` s.
+    """
+    limiter = limiter or global_limiter
+    stats = BroadcastStats()
+    queue = asyncio.Queue(maxsize=concurrency * 4)
+
+    async def producer():
+        after = 0
+        while True:
+            ids = await pages(after)
+            if not ids:
+                break
+            for chat_id in ids:
+                await queue.put(chat_id)
+                stats.queued += 1
+            after = ids[-1]
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def worker():
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            await _send(bot, chat_id, text, limiter, stats)
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(progress_interval)
+            await on_progress(stats)
+
+    tasks = [asyncio.create_task(producer())]
+    tasks += [asyncio.create_task(worker()) for _ in range(concurrency)]
+    running = list(tasks)
+    if on_progress:
+        tasks.append(asyncio.create_task(reporter()))
+    try:
+        await asyncio.gather(*running)
+    finally:
+        # błąd producenta (np. bazy) albo anulowanie — bez wiszących workerów
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    stats.finished = True
+    if on_progress:
+        await on_progress(stats)
+    return stats
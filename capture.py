@@ -0,0 +1,243 @@
+"""
+Nagrywanie ruchu (opcjonalne, CAPTURE_DIR): każda przychodząca aktualizacja
+trafia jako linia JSON do rotowanego logu; zamknięte pliki są kompresowane
+gzipem. Zapis i anonimizacja odbywają się w wątku listenera, na pętli
+zdarzeń aktualizacja jest tylko wkładana do kolejki.
+
+Anonimizacja jest deterministyczna dla danej soli (CAPTURE_SALT):
+- identyfikatory użytkowników i czatów -> HMAC (ten sam użytkownik zawsze
+  ma ten sam zastępczy id),
+- imiona, nazwy, nazwy plików -> stały tekst,
+- w tekstach każde słowo z liter jest podmieniane na litery z HMAC tego
+  słowa (długość i wielkość liter zachowane, cyfry i komendy bez zmian,
+  słowa kluczowe przepływów z KEEP_WORDS bez zmian).
+anonymize_db() przepisuje tą samą solą kopię bazy (tg_id, VIN, numery,
+firmy, modele), więc odtworzony ruch trafia na te same wiersze.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import shutil
+import sqlite3
+
+from aiogram import BaseMiddleware
+
+import logs
+
+# słowa sterujące przepływami bota (bez nich odtworzenie skręca w inne gałęzie)
+KEEP_WORDS = {
+    "gotowe", "tak", "nie", "vat", "prowizja",
+    "firma", "model", "paliwo", "numery",
+    "mechanic", "admin", "all", "tenant", "user",
+    "benzyna", "diesel", "gaz", "lpg", "elektryczne", "elektryczny", "hybryda",
+}
+_WORD = re.compile(r"[^\W\d_]+")
+_PEOPLE = {"from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat", "via_bot"}
+_NAMES = {"first_name", "last_name", "username", "title", "file_name"}
+_TEXTS = {"text", "caption", "query"}
+_DROPPED = {"contact", "location", "venue", "phone_number", "bio"}
+_FILE_IDS = {"file_id", "file_unique_id"}
+# komendy i callbacki niosące tg_id jako pierwszy argument
+ID_COMMANDS = ("/add_mechanic", "/set_tenant")
+ID_CALLBACKS = ("choose_mech:", "batch_mech:")
+
+
+# ------------------------------------------------------------
+#  ANONIMIZACJA
+# ------------------------------------------------------------
+
+def _digest(salt, value):
+    return hmac.new(salt.encode(), str(value).encode(), hashlib.sha256).digest()
+
+
+def anon_id(value, salt):
+    """Id Telegrama -> stały zastępczy id (48 bitów, znak zachowany — grupy są ujemne)."""
+    if value is None:
+        return None
+    h = int.from_bytes(_digest(salt, abs(value))[:6], "big") or 1
+    return -h if value < 0 else h
+
+
+def _mask_word(word, salt):
+    h = _digest(salt, word.lower())
+    out = []
+    for i, c in enumerate(word):
+        letter = chr(ord("a") + h[i % len(h)] % 26)
+        out.append(letter.upper() if c.isupper() else letter)
+    return "".join(out)
+
+
+def _anon_id_args(text, salt):
+    """tg_id w argumentach ID_COMMANDS i w callbackach ID_CALLBACKS."""
+    for prefix in ID_CALLBACKS:
+        if text.startswith(prefix) and text[len(prefix):].lstrip("-").isdigit():
+            return prefix + str(anon_id(int(text[len(prefix):]), salt))
+    parts = text.split(" ", 2)
+    if len(parts) > 1 and parts[0].split("@")[0] in ID_COMMANDS and parts[1].lstrip("-").isdigit():
+        parts[1] = str(anon_id(int(parts[1]), salt))
+        return " ".join(parts)
+    return text
+
+
+def anon_text(text, salt):
+    """Podmienia słowa z liter; cyfry, interpunkcja, komendy i KEEP_WORDS zostają."""
+    if not text:
+        return text
+
+    def word(m):
+        w = m.group(0)
+        return w if w.lower() in KEEP_WORDS else _mask_word(w, salt)
+
+    # komenda ('/report_month@bot') zostaje w całości
+    command = text.split(maxsplit=1)[0] if text.startswith("/") else ""
+    return command + _WORD.sub(word, text[len(command):])
+
+
+def anonymize(obj, salt, parent=None):
+    """Anonimizuje zrzut aktualizacji (model_dump) rekurencyjnie."""
+    if isinstance(obj, list):
+        return [anonymize(item, salt, parent) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    out = {}
+    for key, value in obj.items():
+        if key in _DROPPED:
+            continue
+        if (key == "id" and parent in _PEOPLE) or key in ("user_id", "chat_id"):
+            out[key] = anon_id(value, salt)
+        elif key in _NAMES and isinstance(value, str):
+            out[key] = "anon"
+        elif key in _TEXTS and isinstance(value, str):
+            out[key] = _anon_id_args(anon_text(value, salt), salt)
+        elif key == "data" and parent == "callback_query":
+            out[key] = _anon_id_args(value, salt)
+        elif key in _FILE_IDS and isinstance(value, str):
+            out[key] = _digest(salt, value).hex()[:32]
+        else:
+            out[key] = anonymize(value, salt, key)
+    return out
+
+
+_DB_COLUMNS = (
+    ("users", "tg_id = anon_id(tg_id), full_name = 'anon'"),
+    ("cars", "vin = anon_text(vin), plate = anon_text(plate), "
+             "owner_company = anon_text(owner_company), model = anon_text(model)"),
+    ("services", "mechanic_tg_id = anon_id(mechanic_tg_id), admin_tg_id = anon_id(admin_tg_id), "
+                 "description = anon_text(description), comments = anon_text(comments)"),
+    ("events", "actor_tg_id = anon_id(actor_tg_id)"),
+    ("attachments", "uploaded_by = anon_id(uploaded_by), name = 'anon'"),
+)
+
+
+def anonymize_db(path, salt):
+    """
+    Przepisuje kopię bazy (albo archiwum) tą samą solą co nagranie. Tylko
+    dla kopii! Ładunki w events (JSON) zostają bez zmian — replay ich nie
+    czyta. Tabele KPI trzeba potem przeliczyć (db.rebuild_kpi).
+    """
+    conn = sqlite3.connect(path)
+    conn.create_function("anon_id", 1, lambda v: anon_id(v, salt), deterministic=True)
+    conn.create_function("anon_text", 1, lambda v: anon_text(v, salt), deterministic=True)
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {r[0] for r in cur.fetchall()}
+    for table, assignments in _DB_COLUMNS:
+        if table in tables:
+            cur.execute(f"UPDATE {table} SET {assignments}")
+    conn.commit()
+    conn.close()
+
+
+# ------------------------------------------------------------
+#  ZAPIS
+# ------------------------------------------------------------
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+class CaptureFormatter(logging.Formatter):
+    def __init__(self, salt):
+        super().__init__()
+        self.salt = salt
+
+    def format(self, record):
+        update = record.msg.model_dump(mode="json", by_alias=True, exclude_none=True)
+        return json.dumps(
+            {"ts": record.created, "update": anonymize(update, self.salt)},
+            ensure_ascii=False,
+        )
+
+
+class CaptureMiddleware(BaseMiddleware):
+    """Outer middleware dp.update — nagrywa wszystko, także odrzucone przez limity."""
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.captured = 0
+
+    async def __call__(self, handler, event, data):
+        self.logger.info(event)
+        self.captured += 1
+        return await handler(event, data)
+
+
+def setup(directory, salt, max_bytes=50 * 1024 * 1024, keep=20):
+    """
+    Zwraca (middleware, listener). Bieżący plik: updates.jsonl, zamknięte:
+    updates.jsonl.1.gz … updates.jsonl.<keep>.gz (1 = najnowszy).
+    """
+    os.makedirs(directory, exist_ok=True)
+    target = logging.handlers.RotatingFileHandler(
+        os.path.join(directory, "updates.jsonl"), maxBytes=max_bytes, backupCount=keep, encoding="utf-8"
+    )
+    target.namer = lambda name: name + ".gz"
+    target.rotator = _gzip_rotator
+    target.setFormatter(CaptureFormatter(salt))
+
+    q = queue.SimpleQueue()
+    logger = logging.getLogger("fleet_bot.capture")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers[:] = [logs.DeferredQueueHandler(q)]
+
+    listener = logging.handlers.QueueListener(q, target)
+    listener.start()
+    return CaptureMiddleware(logger), listener
+
+
+# ------------------------------------------------------------
+#  ODCZYT
+# ------------------------------------------------------------
+
+def capture_files(paths):
+    """Pliki nagrania w kolejności chronologicznej (katalog albo lista plików)."""
+    files = []
+    for p in paths:
+        if not os.path.isdir(p):
+            files.append(p)
+            continue
+        names = [n for n in os.listdir(p) if n.startswith("updates.jsonl")]
+        # updates.jsonl.N.gz: większe N = starszy; bieżący plik na końcu
+        names.sort(key=lambda n: -int(n.split(".")[2]) if n.count(".") >= 3 else 0)
+        files.extend(os.path.join(p, n) for n in names)
+    return files
+
+
+def read_capture(paths):
+    """Generator (ts, dict aktualizacji)."""
+    for path in capture_files(paths):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    yield entry["ts"], entry["update"]
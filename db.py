@@ -1,25 +1,318 @@
+import glob
+import json
+import logging
+import os
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+
+import money
+
+logger = logging.getLogger("fleet_bot.db")
 
 
 # ------------------------------------------------------------
 #  CONNECTION
 # ------------------------------------------------------------
 
+POOL_SIZE = 4
+MAX_POOLS = 64          # plików bazy (tenanci, kopie w benchmarkach)
+BUSY_TIMEOUT = 5.0
+
+
+class PooledConnection(sqlite3.Connection):
+    """close() oddaje połączenie do puli zamiast je zamykać."""
+    pool = None
+
+    def close(self):
+        if self.pool is not None and self.pool.release(self):
+            return
+        super().close()
+
+
+class ConnectionPool:
+    """Pula połączeń do jednego pliku bazy (jednego tenanta)."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT,
+            factory=PooledConnection,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.pool = self
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if not self.closed and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return True
+        return False
+
+    def idle(self):
+        return len(self._idle)
+
+    def close_all(self):
+        """Zamyka wolne połączenia; wypożyczone zamkną się przy oddaniu."""
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.pool = None
+            conn.close()
+
+
+_pools = OrderedDict()
+_pools_lock = threading.Lock()
+_pool_evictions = 0
+
+
+def get_pool(path):
+    global _pool_evictions
+    key = os.path.abspath(path)
+    evicted = []
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(path)
+            while len(_pools) > MAX_POOLS:
+                evicted.append(_pools.popitem(last=False)[1])
+                _pool_evictions += 1
+        else:
+            _pools.move_to_end(key)
+    for old in evicted:
+        old.close_all()
+    return pool
+
+
 def get_connection(path):
-    conn = sqlite3.connect(path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_pool(path).acquire()
+
+
+@contextmanager
+def _rollback_on_error(conn):
+    """
+    Przy błędzie (np. UNIQUE / FOREIGN KEY) wycofuje transakcję i oddaje
+    połączenie do puli — inaczej trzymałoby blokadę zapisu do czasu GC.
+    """
+    try:
+        yield
+    except Exception:
+        conn.rollback()
+        conn.close()
+        raise
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
 
 
 # ------------------------------------------------------------
 #  INIT DATABASE
 # ------------------------------------------------------------
 
+def _add_column(cur, table, column, decl):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in {r["name"] for r in cur.fetchall()}:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# Podbijać przy każdej zmianie schematu w init_db
+SCHEMA_VERSION = 9
+
+
+def schema_version(path):
+    conn = get_connection(path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    return version
+
+
+def _migrate_cars_soft_delete(conn):
+    """
+    Stara tabela cars miała `vin TEXT UNIQUE` i brak archived_at.
+    Przebudowa tabeli (SQLite nie usuwa ograniczeń przez ALTER TABLE).
+    """
+    cur = conn.cursor()
+    cur.execute("PRAGMA table_info(cars)")
+    if "archived_at" in {r["name"] for r in cur.fetchall()}:
+        return
+
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        # sqlite3 nie otwiera transakcji przed DDL — bez BEGIN sam CREATE
+        # zostałby zatwierdzony i po błędzie zostałaby osierocona cars_new
+        cur.execute("BEGIN")
+        cur.execute("DROP TABLE IF EXISTS cars_new")
+        cur.execute("""
+            CREATE TABLE cars_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                vin TEXT,
+                mileage INTEGER,
+                year INTEGER,
+                owner_company TEXT,
+                model TEXT,
+                plate TEXT,
+                fuel_type TEXT,
+                archived_at TEXT
+            )
+        """)
+        cur.execute("""
+            INSERT INTO cars_new (id, vin, mileage, year, owner_company, model, plate, fuel_type)
+            SELECT id, vin, mileage, year, owner_company, model, plate, fuel_type FROM cars
+        """)
+        cur.execute("DROP TABLE cars")
+        cur.execute("ALTER TABLE cars_new RENAME TO cars")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+
+SERVICE_COLUMNS = (
+    "id", "car_id", "mechanic_tg_id", "admin_tg_id", "description", "desired_at",
+    "status", "final_mileage", "cost_net_gr", "comments", "created_at",
+)
+
+
+def _grosze_select(columns):
+    """Lista kolumn z cost_net (REAL, złote) przeliczonym na cost_net_gr."""
+    return ", ".join(
+        "CAST(ROUND(cost_net * 100) AS INTEGER) AS cost_net_gr" if c == "cost_net_gr" else c
+        for c in columns
+    )
+
+
+def _migrate_money_to_grosze(conn, path):
+    """
+    services.cost_net REAL (złote) -> cost_net_gr INTEGER (grosze), także
+    w plikach archiwum. Przebudowa tabeli — ALTER TABLE nie zmienia typu.
+    Sumy w kpi_company_spend są przeliczane na miejscu (×100) — przebudowa
+    KPI od zera nie jest potrzebna.
+    """
+    cur = conn.cursor()
+    cur.execute("PRAGMA table_info(services)")
+    if "cost_net" in {r["name"] for r in cur.fetchall()}:
+        _rebuild_services_in_grosze(conn)
+
+    # archiwa po głównej tabeli — przerwana migracja dokończy je przy kolejnym init_db
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'archive_years'")
+    years = _present_archive_years(cur, path) if cur.fetchone() else []
+    for year in years:
+        with _attached_archive(conn, path, year) as alias:
+            cur.execute(f"PRAGMA {alias}.table_info(services)")
+            if "cost_net" not in {r["name"] for r in cur.fetchall()}:
+                continue
+            cur.execute("BEGIN")
+            cur.execute(f"DROP TABLE IF EXISTS {alias}.services_new")
+            cur.execute(f"""
+                CREATE TABLE {alias}.services_new AS
+                SELECT {_grosze_select(SERVICE_COLUMNS)} FROM {alias}.services
+            """)
+            cur.execute(f"DROP TABLE {alias}.services")
+            cur.execute(f"ALTER TABLE {alias}.services_new RENAME TO services")
+            _archive_indexes(cur, alias)
+
+
+def _rebuild_services_in_grosze(conn):
+    """Przebudowa main.services razem z KPI wydatków — jedna transakcja."""
+    cur = conn.cursor()
+    columns = ", ".join(SERVICE_COLUMNS)
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        # jawny BEGIN jak w _migrate_cars_soft_delete: kwot nie da się
+        # przeliczyć drugi raz, więc nic nie może zostać zatwierdzone w połowie
+        cur.execute("BEGIN")
+        cur.execute("DROP TABLE IF EXISTS services_new")
+        cur.execute("""
+            CREATE TABLE services_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                car_id INTEGER,
+                mechanic_tg_id INTEGER,
+                admin_tg_id INTEGER,
+                description TEXT,
+                desired_at TEXT,
+                status TEXT DEFAULT 'pending',
+                final_mileage INTEGER,
+                cost_net_gr INTEGER,
+                comments TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+
+                FOREIGN KEY (car_id) REFERENCES cars(id)
+            )
+        """)
+        cur.execute(f"INSERT INTO services_new ({columns}) SELECT {_grosze_select(SERVICE_COLUMNS)} FROM services")
+        cur.execute("DROP TABLE services")
+        cur.execute("ALTER TABLE services_new RENAME TO services")
+        _migrate_kpi_spend_to_grosze(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+
+def _migrate_kpi_spend_to_grosze(cur):
+    """kpi_company_spend.total REAL (złote) -> total_gr INTEGER (grosze), w tej samej transakcji."""
+    cur.execute("PRAGMA table_info(kpi_company_spend)")
+    if "total" not in {r["name"] for r in cur.fetchall()}:
+        return
+    cur.execute("DROP TABLE IF EXISTS kpi_company_spend_new")
+    cur.execute("""
+        CREATE TABLE kpi_company_spend_new (
+            owner_company TEXT PRIMARY KEY,
+            services INTEGER NOT NULL DEFAULT 0,
+            total_gr INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("""
+        INSERT INTO kpi_company_spend_new (owner_company, services, total_gr)
+        SELECT owner_company, services, CAST(ROUND(total * 100) AS INTEGER) FROM kpi_company_spend
+    """)
+    cur.execute("DROP TABLE kpi_company_spend")
+    cur.execute("ALTER TABLE kpi_company_spend_new RENAME TO kpi_company_spend")
+
+
 def init_db(path):
+    """
+    Tworzy / migruje schemat. Jeśli PRAGMA user_version jest aktualne,
+    nie wykonuje żadnego DDL. Zwraca True, gdy schemat był zmieniany.
+    """
+    if schema_version(path) == SCHEMA_VERSION:
+        return False
+
     conn = get_connection(path)
     cur = conn.cursor()
 
+    # WAL: czytelnicy (raporty na migawkach) nie blokują zapisu
+    cur.execute("PRAGMA journal_mode = WAL")
+
     # --- USERS ---
     cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -28,20 +321,49 @@ def init_db(path):
             role TEXT DEFAULT 'user'
         )
     """)
+    # tenant (zajezdnia / firma), do którego należy użytkownik; NULL = domyślny
+    _add_column(cur, "users", "tenant", "TEXT")
 
     # --- CARS ---
+    # archived_at: miękkie usunięcie; VIN unikalny tylko wśród aktywnych aut
     cur.execute("""
         CREATE TABLE IF NOT EXISTS cars (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            vin TEXT UNIQUE,
+            vin TEXT,
             mileage INTEGER,
             year INTEGER,
             owner_company TEXT,
             model TEXT,
             plate TEXT,
-            fuel_type TEXT
+            fuel_type TEXT,
+            archived_at TEXT
         )
     """)
+    conn.commit()
+    _migrate_cars_soft_delete(conn)
+
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_cars_active_vin
+        ON cars (vin) WHERE archived_at IS NULL
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cars_active_id
+        ON cars (id) WHERE archived_at IS NULL
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cars_active_plate
+        ON cars (plate) WHERE archived_at IS NULL
+    """)
+    # find_cars porównuje bez wielkości liter — indeks musi mieć tę samą kolację
+    cur.execute("DROP INDEX IF EXISTS idx_cars_active_company")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cars_active_company_nocase
+        ON cars (owner_company COLLATE NOCASE) WHERE archived_at IS NULL
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_cars_active_model_nocase
+        ON cars (model COLLATE NOCASE) WHERE archived_at IS NULL
+    """)
 
     # --- SERVICES ---
     cur.execute("""
@@ -54,16 +376,400 @@ def init_db(path):
             desired_at TEXT,
             status TEXT DEFAULT 'pending',
             final_mileage INTEGER,
-            cost_net REAL,
+            cost_net_gr INTEGER,
             comments TEXT,
             created_at TEXT DEFAULT CURRENT_TIMESTAMP,
 
             FOREIGN KEY (car_id) REFERENCES cars(id)
         )
     """)
+    conn.commit()
+    _migrate_money_to_grosze(conn, path)
+
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_services_status_created
+        ON services (status, created_at)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_services_mechanic_jobs
+        ON services (mechanic_tg_id, status, desired_at)
+    """)
+    # historia auta / ostatni serwis (rebuild_kpi był kwadratowy bez tego indeksu)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_services_car
+        ON services (car_id, status, created_at)
+    """)
+
+    # --- ARCHIWUM (lata przeniesione do plików archiwalnych) ---
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS archive_years (
+            year INTEGER PRIMARY KEY,
+            rows INTEGER DEFAULT 0,
+            archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # --- KPI (utrzymywane przyrostowo przez funkcje zapisu) ---
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS kpi_status (
+            status TEXT PRIMARY KEY,
+            cnt INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS kpi_mechanic_week (
+            week TEXT,
+            mechanic_tg_id INTEGER,
+            cnt INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (week, mechanic_tg_id)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS kpi_company_spend (
+            owner_company TEXT PRIMARY KEY,
+            services INTEGER NOT NULL DEFAULT 0,
+            total_gr INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # last_service_at: ostatni zakończony serwis, a dla aut bez serwisu — data dodania
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS kpi_car_service (
+            car_id INTEGER PRIMARY KEY,
+            last_service_at TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_kpi_car_service_last
+        ON kpi_car_service (last_service_at)
+    """)
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_role ON users (role)")
+
+    # --- EVENTS (append-only, zapisywane w tej samej transakcji co zmiana) ---
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts TEXT DEFAULT CURRENT_TIMESTAMP,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            actor_tg_id INTEGER,
+            payload TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_events_entity
+        ON events (entity, entity_id, id)
+    """)
+    cur.execute("SELECT COUNT(*) AS cnt FROM events")
+    if cur.fetchone()["cnt"] == 0:
+        _seed_events(cur)
+
+    # --- ATTACHMENTS (tylko metadane; pliki w magazynie wg sha256) ---
+    # bez FOREIGN KEY: zgłoszenie może zostać przeniesione do archiwum
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            service_id INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            mime TEXT,
+            name TEXT,
+            size INTEGER,
+            thumbs TEXT,
+            tg_file_id TEXT,
+            tg_file_unique_id TEXT,
+            uploaded_by INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_attachments_service
+        ON attachments (service_id, id)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_attachments_unique
+        ON attachments (tg_file_unique_id)
+    """)
+
+    # --- SETTINGS (stawki w punktach bazowych: 2300 = 23%) ---
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+    cur.executemany(
+        "INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", DEFAULT_RATES.items()
+    )
+
+    conn.commit()
+
+    cur.execute("SELECT COUNT(*) AS cnt FROM kpi_status")
+    kpi_empty = cur.fetchone()["cnt"] == 0
+    conn.close()
+
+    if kpi_empty:
+        rebuild_kpi(path)
+
+    conn = get_connection(path)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.close()
+    return True
+
+
+# ------------------------------------------------------------
+#  EVENTS
+# ------------------------------------------------------------
+
+def _log_events(cur, events):
+    """
+    events: [(entity, entity_id, action, actor_tg_id, payload_dict), ...]
+    Jeden executemany w bieżącej transakcji.
+    """
+    cur.executemany("""
+        INSERT INTO events (entity, entity_id, action, actor_tg_id, payload)
+        VALUES (?, ?, ?, ?, ?)
+    """, [
+        (entity, entity_id, action, actor, json.dumps(payload, ensure_ascii=False, default=str))
+        for entity, entity_id, action, actor, payload in events
+    ])
+
+
+def _seed_events(cur):
+    """Zdarzenia 'snapshot' dla danych sprzed wprowadzenia dziennika."""
+    cur.execute("SELECT * FROM cars ORDER BY id")
+    events = [("car", r["id"], "snapshot", None, dict(r)) for r in cur.fetchall()]
+
+    cur.execute("""
+        SELECT s.*, c.owner_company
+        FROM services s
+        LEFT JOIN cars c ON c.id = s.car_id
+        ORDER BY s.id
+    """)
+    for r in cur.fetchall():
+        state = dict(r)
+        if state["status"] == "done":
+            state["done_at"] = state["created_at"]
+        events.append(("service", r["id"], "snapshot", None, state))
+
+    _log_events(cur, events)
+
+
+# ------------------------------------------------------------
+#  CACHES
+# ------------------------------------------------------------
+
+_cache_lock = threading.Lock()
+
+# limity struktur w pamięci; po przekroczeniu wylatują najstarsze wpisy
+ROLE_CACHE_SIZE = 50_000
+MECHANICS_CACHE_SIZE = 256
+PLATE_INDEX_FILES = 64
+ROW_VERSIONS_SIZE = 200_000
+SERVICE_CACHE_SIZE = 1024
+SETTINGS_CACHE_FILES = 64
+
+_role_cache = {}        # (plik, tg_id) -> rola
+_mechanics_cache = {}   # (plik, tenant) -> [wiersze users]
+_plate_index = {}       # plik -> {NUMER: car_id}
+_evictions = dict.fromkeys(("roles", "mechanics", "plates", "versions", "services", "settings"), 0)
+
+
+def _cache_key(path):
+    return os.path.abspath(path)
+
+
+def _trim(name, cache, bound):
+    """Usuwa najstarsze wpisy ponad limit (dict zachowuje kolejność wstawiania). Pod _cache_lock."""
+    while len(cache) > bound:
+        del cache[next(iter(cache))]
+        _evictions[name] += 1
+
+
+def invalidate_users(path):
+    key = _cache_key(path)
+    with _cache_lock:
+        for k in [k for k in _role_cache if k[0] == key]:
+            del _role_cache[k]
+        for k in [k for k in _mechanics_cache if k[0] == key]:
+            del _mechanics_cache[k]
+
+
+# (plik, encja, id) -> wersja wiersza; ("dataset", 0) — zmiana zbioru
+# zakończonych zgłoszeń (wynik serwisu, edycja auta, archiwizacja).
+# Wersja to (epoka, licznik): po przekroczeniu limitu liczniki są czyszczone,
+# a nowa epoka unieważnia wszystko, co zapamiętano ze starymi wersjami.
+_row_versions = {}
+_version_epoch = 0
+
+
+def _version(key):
+    """Pod _cache_lock."""
+    return (_version_epoch, _row_versions.get(key, 0))
+
+
+def bump_version(path, entity, row_id):
+    global _version_epoch
+    key = (_cache_key(path), entity, row_id)
+    with _cache_lock:
+        _row_versions[key] = _row_versions.get(key, 0) + 1
+        if len(_row_versions) > ROW_VERSIONS_SIZE:
+            _evictions["versions"] += len(_row_versions)
+            _row_versions.clear()
+            _version_epoch += 1
+
+
+def row_version(path, entity, row_id):
+    with _cache_lock:
+        return _version((_cache_key(path), entity, row_id))
+
+
+def invalidate_cars(path):
+    with _cache_lock:
+        _plate_index.pop(_cache_key(path), None)
+
+
+# zgłoszenia (z danymi auta) dla callbacków potwierdź / odrzuć / zakończ
+_service_cache = OrderedDict()   # (plik, svc_id) -> (wersja zgł., wersja auta, wiersz)
+_service_stats = {"hits": 0, "misses": 0}
+
+
+def invalidate_services(path, svc_id=None, car_id=None):
+    """Usuwa jedno zgłoszenie, zgłoszenia danego auta albo (bez argumentów) wszystkie z pliku."""
+    key = _cache_key(path)
+    with _cache_lock:
+        if svc_id is not None:
+            _service_cache.pop((key, svc_id), None)
+            return
+        for k, (_, _, row) in list(_service_cache.items()):
+            if k[0] == key and (car_id is None or row["car_id"] == car_id):
+                del _service_cache[k]
+
+
+def service_cache_stats():
+    with _cache_lock:
+        return dict(
+            _service_stats, size=len(_service_cache), capacity=SERVICE_CACHE_SIZE,
+            evictions=_evictions["services"],
+        )
+
+
+def cache_stats():
+    """{struktura: {size, bound, evictions}} — do /memstats."""
+    with _cache_lock:
+        stats = {
+            "db.roles": (len(_role_cache), ROLE_CACHE_SIZE, _evictions["roles"]),
+            "db.mechanics": (len(_mechanics_cache), MECHANICS_CACHE_SIZE, _evictions["mechanics"]),
+            "db.plates": (len(_plate_index), PLATE_INDEX_FILES, _evictions["plates"]),
+            "db.versions": (len(_row_versions), ROW_VERSIONS_SIZE, _evictions["versions"]),
+            "db.services": (len(_service_cache), SERVICE_CACHE_SIZE, _evictions["services"]),
+            "db.settings": (len(_settings_cache), SETTINGS_CACHE_FILES, _evictions["settings"]),
+        }
+    with _pools_lock:
+        stats["db.pools"] = (len(_pools), MAX_POOLS, _pool_evictions)
+        stats["db.connections"] = (
+            sum(p.idle() for p in _pools.values()), MAX_POOLS * POOL_SIZE, _pool_evictions,
+        )
+    return {
+        name: {"size": size, "bound": bound, "evictions": evictions}
+        for name, (size, bound, evictions) in stats.items()
+    }
+
+
+def _load_plate_index(path):
+    conn = get_connection(path)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, plate FROM cars
+        WHERE archived_at IS NULL AND plate IS NOT NULL
+        ORDER BY id
+    """)
+    index = {}
+    for r in cur.fetchall():
+        index.setdefault(r["plate"].upper(), r["id"])
+    conn.close()
+    return index
+
+
+def warm_caches(path):
+    """
+    Ładuje role, mechaników i indeks numerów rejestracyjnych.
+    Zwraca {faza: sekundy}.
+    """
+    timings = {}
+    key = _cache_key(path)
+
+    t = time.perf_counter()
+    conn = get_connection(path)
+    cur = conn.cursor()
+    cur.execute("SELECT tg_id, full_name, role, tenant FROM users")
+    users = cur.fetchall()
+    conn.close()
+
+    mechanics = {}
+    for u in users:
+        if u["role"] == "mechanic":
+            mechanics.setdefault(u["tenant"] or DEFAULT_TENANT, []).append(u)
+    with _cache_lock:
+        for u in users:
+            _role_cache[(key, u["tg_id"])] = u["role"]
+        for tenant, rows in mechanics.items():
+            _mechanics_cache[(key, tenant)] = rows
+        _trim("roles", _role_cache, ROLE_CACHE_SIZE)
+        _trim("mechanics", _mechanics_cache, MECHANICS_CACHE_SIZE)
+    timings["roles"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    index = _load_plate_index(path)
+    with _cache_lock:
+        _plate_index[key] = index
+        _trim("plates", _plate_index, PLATE_INDEX_FILES)
+    timings["plates"] = time.perf_counter() - t
+
+    return timings
+
+
+# ------------------------------------------------------------
+#  SETTINGS
+# ------------------------------------------------------------
 
+DEFAULT_RATES = {"vat_bp": 2300, "commission_bp": 1000}
+_settings_cache = {}    # plik -> {klucz: wartość}
+
+
+def get_rates(path):
+    """Stawki VAT i prowizji (punkty bazowe) z tabeli settings, z cache."""
+    key = _cache_key(path)
+    with _cache_lock:
+        rates = _settings_cache.get(key)
+    if rates is not None:
+        return rates
+
+    conn = get_connection(path)
+    cur = conn.cursor()
+    cur.execute("SELECT key, value FROM settings")
+    rates = dict(DEFAULT_RATES, **{r["key"]: r["value"] for r in cur.fetchall()})
+    conn.close()
+    with _cache_lock:
+        _settings_cache[key] = rates
+        _trim("settings", _settings_cache, SETTINGS_CACHE_FILES)
+    return rates
+
+
+def set_rate(path, name, bp):
+    if name not in DEFAULT_RATES:
+        raise ValueError(f"Nieznana stawka: {name}")
+    conn = get_connection(path)
+    conn.execute("""
+        INSERT INTO settings (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """, (name, bp))
     conn.commit()
     conn.close()
+    with _cache_lock:
+        _settings_cache.pop(_cache_key(path), None)
+    bump_version(path, "settings", 0)
 
 
 # ------------------------------------------------------------
@@ -76,6 +782,8 @@ def add_user(path, tg_id, full_name):
     cur.execute("INSERT OR IGNORE INTO users (tg_id, full_name) VALUES (?, ?)",
                 (tg_id, full_name))
     conn.commit()
+    if cur.rowcount > 0:
+        invalidate_users(path)
     conn.close()
 
 
@@ -86,16 +794,51 @@ def set_user_role(path, tg_id, role):
     conn.commit()
     ok = cur.rowcount > 0
     conn.close()
+    invalidate_users(path)
     return ok
 
 
 def get_user_role(path, tg_id):
+    key = (_cache_key(path), tg_id)
+    with _cache_lock:
+        if key in _role_cache:
+            return _role_cache[key]
+
     conn = get_connection(path)
     cur = conn.cursor()
     cur.execute("SELECT role FROM users WHERE tg_id = ?", (tg_id,))
     row = cur.fetchone()
     conn.close()
-    return row["role"] if row else None
+
+    role = row["role"] if row else None
+    if role is not None:
+        with _cache_lock:
+            _role_cache[key] = role
+            _trim("roles", _role_cache, ROLE_CACHE_SIZE)
+    return role
+
+
+def list_mechanics(path, tenant=None):
+    """Mechanicy tenanta: [{tg_id, full_name}, ...]"""
+    tenant = tenant or DEFAULT_TENANT
+    key = (_cache_key(path), tenant)
+    with _cache_lock:
+        if key in _mechanics_cache:
+            return _mechanics_cache[key]
+
+    conn = get_connection(path)
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT tg_id, full_name FROM users WHERE role = 'mechanic' AND COALESCE(tenant, ?) = ?",
+        (DEFAULT_TENANT, tenant),
+    )
+    rows = cur.fetchall()
+    conn.close()
+
+    with _cache_lock:
+        _mechanics_cache[key] = rows
+        _trim("mechanics", _mechanics_cache, MECHANICS_CACHE_SIZE)
+    return rows
 
 
 def promote_to_admin_if_first(path, tg_id):
@@ -108,90 +851,532 @@ def promote_to_admin_if_first(path, tg_id):
         cur.execute("UPDATE users SET role = 'admin' WHERE tg_id = ?", (tg_id,))
     conn.commit()
     conn.close()
+    if cnt == 1:
+        invalidate_users(path)
 
 
-# ------------------------------------------------------------
-#  CARS
-# ------------------------------------------------------------
-
-def add_car(path, vin, mileage, year, owner_company, model, plate, fuel_type):
+def get_user_names(path, tg_ids):
+    tg_ids = list(tg_ids)
+    if not tg_ids:
+        return {}
     conn = get_connection(path)
     cur = conn.cursor()
-
-    cur.execute("""
-        INSERT INTO cars (vin, mileage, year, owner_company, model, plate, fuel_type)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (vin, mileage, year, owner_company, model, plate, fuel_type))
-
-    conn.commit()
-    car_id = cur.lastrowid
+    cur.execute(
+        f"SELECT tg_id, full_name FROM users WHERE tg_id IN ({','.join('?' * len(tg_ids))})",
+        tg_ids,
+    )
+    names = {r["tg_id"]: r["full_name"] for r in cur.fetchall()}
     conn.close()
-    return car_id
+    return names
 
 
-def list_cars(path, limit=50):
-    conn = get_connection(path)
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT *
-        FROM cars
-        ORDER BY id DESC
-        LIMIT ?
-    """, (limit,))
-
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+def user_ids_page(path, role=None, tenant=None, after=0, limit=500):
+    """
+    Strona ID użytkowników (paginacja po kluczu, indeks idx_users_role).
+    role=None — wszyscy; tenant=None — wszystkie tenanty.
+    """
+    where, params = ["tg_id > ?"], [after]
+    if role is not None:
+        where.append("role = ?")
+        params.append(role)
+    if tenant is not None:
+        where.append("COALESCE(tenant, ?) = ?")
+        params += [DEFAULT_TENANT, tenant]
 
-
-def get_car_by_vin(path, vin):
     conn = get_connection(path)
     cur = conn.cursor()
-    cur.execute("SELECT * FROM cars WHERE vin = ?", (vin,))
-    row = cur.fetchone()
+    cur.execute(f"""
+        SELECT tg_id FROM users
+        WHERE {' AND '.join(where)}
+        ORDER BY tg_id
+        LIMIT ?
+    """, params + [limit])
+    ids = [r["tg_id"] for r in cur.fetchall()]
     conn.close()
-    return row
+    return ids
 
 
-def get_car_by_id(path, car_id):
-    conn = get_connection(path)
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM cars WHERE id = ?", (car_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+def iter_user_ids(path, role=None, tenant=None, batch=500):
+    after = 0
+    while True:
+        ids = user_ids_page(path, role, tenant, after, batch)
+        if not ids:
+            return
+        yield from ids
+        after = ids[-1]
 
 
 # ------------------------------------------------------------
-#  SERVICES
+#  TENANTS
 # ------------------------------------------------------------
 
-def create_service(path, car_id, mechanic_tg_id, admin_tg_id, description, desired_at):
-    conn = get_connection(path)
-    cur = conn.cursor()
+DEFAULT_TENANT = "default"
+USER_TENANTS_SIZE = 50_000
 
-    cur.execute("""
-        INSERT INTO services (car_id, mechanic_tg_id, admin_tg_id, description, desired_at)
-        VALUES (?, ?, ?, ?, ?)
-    """, (car_id, mechanic_tg_id, admin_tg_id, description, desired_at))
 
-    conn.commit()
+class TenantRouter:
+    """
+    Kieruje użytkowników (a przez nich auta i zgłoszenia) do osobnych plików
+    SQLite. Tabela users w bazie domyślnej jest katalogiem: kolumna tenant
+    wskazuje plik z autami i zgłoszeniami danego użytkownika.
+    Każdy plik ma własną pulę połączeń i własną blokadę zapisu SQLite.
+    """
+
+    def __init__(self, default_path, tenants=None):
+        self.default_path = default_path
+        self.tenants = {DEFAULT_TENANT: default_path}
+        self.tenants.update(tenants or {})
+        self._user_tenants = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls, default_path, spec):
+        """spec: 'zajezdnia_a=fleet_a.db,firma_b=fleet_b.db'"""
+        tenants = {}
+        for item in (spec or "").split(","):
+            if "=" in item:
+                name, tenant_path = item.split("=", 1)
+                tenants[name.strip()] = tenant_path.strip()
+        return cls(default_path, tenants)
+
+    def names(self):
+        return list(self.tenants)
+
+    def paths(self):
+        return list(dict.fromkeys(self.tenants.values()))
+
+    def path_for(self, tenant):
+        return self.tenants.get(tenant or DEFAULT_TENANT, self.default_path)
+
+    def tenant_for_user(self, tg_id):
+        with self._lock:
+            if tg_id in self._user_tenants:
+                return self._user_tenants[tg_id]
+
+        conn = get_connection(self.default_path)
+        cur = conn.cursor()
+        cur.execute("SELECT tenant FROM users WHERE tg_id = ?", (tg_id,))
+        row = cur.fetchone()
+        conn.close()
+
+        tenant = row["tenant"] if row and row["tenant"] in self.tenants else DEFAULT_TENANT
+        with self._lock:
+            self._user_tenants[tg_id] = tenant
+            while len(self._user_tenants) > USER_TENANTS_SIZE:
+                del self._user_tenants[next(iter(self._user_tenants))]
+                self.evictions += 1
+        return tenant
+
+    def path_for_user(self, tg_id):
+        return self.path_for(self.tenant_for_user(tg_id))
+
+    def set_user_tenant(self, tg_id, tenant):
+        if tenant not in self.tenants:
+            raise ValueError(f"Nieznany tenant: {tenant}")
+
+        conn = get_connection(self.default_path)
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE users SET tenant = ? WHERE tg_id = ?",
+            (None if tenant == DEFAULT_TENANT else tenant, tg_id),
+        )
+        conn.commit()
+        ok = cur.rowcount > 0
+        conn.close()
+
+        invalidate_users(self.default_path)
+        with self._lock:
+            self._user_tenants.pop(tg_id, None)
+        return ok
+
+    def cache_stats(self):
+        with self._lock:
+            size = len(self._user_tenants)
+        return {"db.user_tenants": {"size": size, "bound": USER_TENANTS_SIZE, "evictions": self.evictions}}
+
+    def init_all(self):
+        return {tenant_path: init_db(tenant_path) for tenant_path in self.paths()}
+
+    def fanout(self, fn, *args, **kwargs):
+        """
+        Wywołuje fn(path, *args, **kwargs) równolegle dla każdego tenanta.
+        Zwraca {tenant: wynik}.
+        """
+        unique = self.tenant_paths()
+        with ThreadPoolExecutor(max_workers=len(unique)) as pool:
+            futures = {
+                name: pool.submit(fn, tenant_path, *args, **kwargs)
+                for name, tenant_path in unique.items()
+            }
+            return {name: fut.result() for name, fut in futures.items()}
+
+    def tenant_paths(self):
+        """{tenant: plik} — każdy plik tylko raz."""
+        unique = {}
+        for name, tenant_path in self.tenants.items():
+            if tenant_path not in unique.values():
+                unique[name] = tenant_path
+        return unique
+
+
+# ------------------------------------------------------------
+#  CARS
+# ------------------------------------------------------------
+
+def add_car(path, vin, mileage, year, owner_company, model, plate, fuel_type):
+    conn = get_connection(path)
+    cur = conn.cursor()
+
+    with _rollback_on_error(conn):
+        cur.execute("""
+            INSERT INTO cars (vin, mileage, year, owner_company, model, plate, fuel_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (vin, mileage, year, owner_company, model, plate, fuel_type))
+    car_id = cur.lastrowid
+
+    cur.execute("""
+        INSERT OR REPLACE INTO kpi_car_service (car_id, last_service_at)
+        VALUES (?, CURRENT_TIMESTAMP)
+    """, (car_id,))
+
+    cur.execute("SELECT * FROM cars WHERE id = ?", (car_id,))
+    _log_events(cur, [("car", car_id, "created", None, dict(cur.fetchone()))])
+
+    conn.commit()
+    conn.close()
+    invalidate_cars(path)
+    return car_id
+
+
+CAR_FIELDS = {"vin", "mileage", "year", "owner_company", "model", "plate", "fuel_type"}
+
+
+def update_car_field(path, car_id, field, value, actor_tg_id=None):
+    if field not in CAR_FIELDS:
+        raise ValueError(f"Nieznane pole: {field}")
+
+    conn = get_connection(path)
+    cur = conn.cursor()
+    try:
+        with ExitStack() as archives:
+            # wydatki firm liczone są wg bieżącej firmy auta — przy zmianie firmy
+            # zakończone zgłoszenia auta (także archiwalne) przechodzą do nowej.
+            # Archiwa dołączamy przed BEGIN (ATTACH nie działa w transakcji),
+            # sumy liczymy już pod blokadą zapisu, razem z UPDATE
+            tables = ["main.services"]
+            if field == "owner_company":
+                tables += [
+                    f"{archives.enter_context(_attached_archive(conn, path, year))}.services"
+                    for year in _present_archive_years(cur, path)
+                ]
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                changed = _update_car_field(cur, tables, car_id, field, value, actor_tg_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    finally:
+        conn.close()
+
+    if not changed:
+        return False
+    bump_version(path, "car", car_id)
+    bump_version(path, "dataset", 0)
+    invalidate_cars(path)
+    invalidate_services(path, car_id=car_id)
+    return True
+
+
+def _update_car_field(cur, tables, car_id, field, value, actor_tg_id):
+    """Zmiana pola auta w otwartej transakcji; tables — tabele zgłoszeń z archiwami."""
+    cur.execute(f"SELECT {field} FROM cars WHERE id = ? AND archived_at IS NULL", (car_id,))
+    row = cur.fetchone()
+    if row is None:
+        return False
+
+    cur.execute(f"UPDATE cars SET {field} = ? WHERE id = ?", (value, car_id))
+    cnt, amount = _car_done_totals(cur, tables, car_id) if field == "owner_company" else (0, 0)
+    if cnt:
+        cur.execute("""
+            UPDATE kpi_company_spend SET services = services - ?, total_gr = total_gr - ?
+            WHERE owner_company = ?
+        """, (cnt, amount, row[field] or "-"))
+        cur.execute("DELETE FROM kpi_company_spend WHERE services <= 0")
+        cur.execute("""
+            INSERT INTO kpi_company_spend (owner_company, services, total_gr) VALUES (?, ?, ?)
+            ON CONFLICT(owner_company) DO UPDATE SET
+                services = services + excluded.services,
+                total_gr = total_gr + excluded.total_gr
+        """, (value or "-", cnt, amount))
+    _log_events(cur, [("car", car_id, "updated", actor_tg_id,
+                       {"field": field, "old": row[field], "new": value})])
+    return True
+
+
+def _car_done_totals(cur, tables, car_id):
+    """(liczba, suma groszy) zakończonych zgłoszeń auta we wszystkich `tables`."""
+    cnt = amount = 0
+    for table in tables:
+        cur.execute(f"""
+            SELECT COUNT(*) AS cnt, COALESCE(SUM(cost_net_gr), 0) AS total
+            FROM {table} WHERE car_id = ? AND status = 'done'
+        """, (car_id,))
+        r = cur.fetchone()
+        cnt += r["cnt"]
+        amount += r["total"]
+    return cnt, amount
+
+
+def delete_car(path, car_id, actor_tg_id=None):
+    """Miękkie usunięcie: auto znika z floty, historia zgłoszeń zostaje."""
+    conn = get_connection(path)
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM cars WHERE id = ? AND archived_at IS NULL", (car_id,))
+    if cur.fetchone() is None:
+        conn.close()
+        return False
+
+    cur.execute("UPDATE cars SET archived_at = CURRENT_TIMESTAMP WHERE id = ?", (car_id,))
+    cur.execute("DELETE FROM kpi_car_service WHERE car_id = ?", (car_id,))
+    _log_events(cur, [("car", car_id, "archived", actor_tg_id, {})])
+    conn.commit()
+    conn.close()
+    bump_version(path, "car", car_id)
+    bump_version(path, "dataset", 0)
+    invalidate_cars(path)
+    invalidate_services(path, car_id=car_id)
+    return True
+
+
+def list_cars(path, limit=50):
+    conn = get_connection(path)
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT *
+        FROM cars
+        WHERE archived_at IS NULL
+        ORDER BY id DESC
+        LIMIT ?
+    """, (limit,))
+
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
+def get_car_by_vin(path, vin):
+    conn = get_connection(path)
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM cars WHERE vin = ? AND archived_at IS NULL", (vin,))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+
+def get_car_by_id(path, car_id, active_only=False):
+    """active_only=False zwraca też auta zarchiwizowane (historia zgłoszeń)."""
+    conn = get_connection(path)
+    cur = conn.cursor()
+    if active_only:
+        cur.execute("SELECT * FROM cars WHERE id = ? AND archived_at IS NULL", (car_id,))
+    else:
+        cur.execute("SELECT * FROM cars WHERE id = ?", (car_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+
+def _get_plate_index(path):
+    key = _cache_key(path)
+    with _cache_lock:
+        index = _plate_index.get(key)
+    if index is None:
+        index = _load_plate_index(path)
+        with _cache_lock:
+            _plate_index[key] = index
+            _trim("plates", _plate_index, PLATE_INDEX_FILES)
+    return index
+
+
+def find_car_by_plate(path, plate):
+    """Wyszukanie po numerze rejestracyjnym przez indeks w pamięci."""
+    car_id = _get_plate_index(path).get((plate or "").strip().upper())
+    return get_car_by_id(path, car_id, active_only=True) if car_id is not None else None
+
+
+def find_cars(path, owner_company=None, model=None, fuel_type=None, plates=None):
+    """
+    Aktywne auta wg filtra (firma / model / paliwo, bez wielkości liter)
+    albo listy numerów. Zwraca (auta, nieznalezione numery).
+    """
+    if plates is not None:
+        index = _get_plate_index(path)
+    conn = get_connection(path)
+    cur = conn.cursor()
+
+    if plates is not None:
+        wanted = [p.strip().upper() for p in plates if p.strip()]
+        ids = {index[p] for p in wanted if p in index}
+        missing = [p for p in wanted if p not in index]
+        rows = []
+        id_list = sorted(ids)
+        for i in range(0, len(id_list), 500):
+            chunk = id_list[i:i + 500]
+            cur.execute(f"""
+                SELECT * FROM cars
+                WHERE archived_at IS NULL AND id IN ({",".join("?" * len(chunk))})
+                ORDER BY id
+            """, chunk)
+            rows.extend(cur.fetchall())
+        conn.close()
+        return rows, missing
+
+    where, params = ["archived_at IS NULL"], []
+    for column, value in (("owner_company", owner_company), ("model", model), ("fuel_type", fuel_type)):
+        if value:
+            where.append(f"{column} = ? COLLATE NOCASE")
+            params.append(value.strip())
+    cur.execute(f"SELECT * FROM cars WHERE {' AND '.join(where)} ORDER BY id", params)
+    rows = cur.fetchall()
+    conn.close()
+    return rows, []
+
+
+# ------------------------------------------------------------
+#  SERVICES
+# ------------------------------------------------------------
+
+def create_service(path, car_id, mechanic_tg_id, admin_tg_id, description, desired_at):
+    conn = get_connection(path)
+    cur = conn.cursor()
+
+    with _rollback_on_error(conn):
+        cur.execute("""
+            INSERT INTO services (car_id, mechanic_tg_id, admin_tg_id, description, desired_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (car_id, mechanic_tg_id, admin_tg_id, description, desired_at))
     svc_id = cur.lastrowid
+
+    cur.execute("""
+        SELECT s.*, c.owner_company
+        FROM services s
+        LEFT JOIN cars c ON c.id = s.car_id
+        WHERE s.id = ?
+    """, (svc_id,))
+    _log_events(cur, [("service", svc_id, "created", admin_tg_id, dict(cur.fetchone()))])
+
+    _kpi_status_move(cur, None, "pending")
+    cur.execute("""
+        INSERT INTO kpi_mechanic_week (week, mechanic_tg_id, cnt) VALUES (?, ?, 1)
+        ON CONFLICT(week, mechanic_tg_id) DO UPDATE SET cnt = cnt + 1
+    """, (kpi_week(), mechanic_tg_id))
+
+    conn.commit()
     conn.close()
     return svc_id
 
 
-def update_service_status(path, svc_id, status):
+def create_services(path, assignments, admin_tg_id, description, desired_at):
+    """
+    Wiele zgłoszeń w jednej transakcji (kampanie: opony, przeglądy).
+    assignments: [(car_id, mechanic_tg_id), ...]. Zwraca wiersze nowych
+    zgłoszeń w kolejności `assignments` (jak get_service).
+    """
+    if not assignments:
+        return []
+    conn = get_connection(path)
+    cur = conn.cursor()
+
+    ids = []
+    with _rollback_on_error(conn):
+        for car_id, mech in assignments:
+            cur.execute("""
+                INSERT INTO services (car_id, mechanic_tg_id, admin_tg_id, description, desired_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (car_id, mech, admin_tg_id, description, desired_at))
+            ids.append(cur.lastrowid)
+
+    cur.execute("""
+        SELECT s.*, c.plate, c.vin, c.owner_company
+        FROM json_each(?) j
+        JOIN services s ON s.id = j.value
+        LEFT JOIN cars c ON c.id = s.car_id
+        ORDER BY j.key
+    """, (json.dumps(ids),))
+    rows = cur.fetchall()
+
+    _log_events(cur, [
+        ("service", r["id"], "created", admin_tg_id,
+         {k: r[k] for k in r.keys() if k not in ("plate", "vin")})
+        for r in rows
+    ])
+    _kpi_status_move(cur, None, "pending", len(rows))
+    per_mechanic = {}
+    for r in rows:
+        per_mechanic[r["mechanic_tg_id"]] = per_mechanic.get(r["mechanic_tg_id"], 0) + 1
+    week = kpi_week()
+    cur.executemany("""
+        INSERT INTO kpi_mechanic_week (week, mechanic_tg_id, cnt) VALUES (?, ?, ?)
+        ON CONFLICT(week, mechanic_tg_id) DO UPDATE SET cnt = cnt + excluded.cnt
+    """, [(week, mech, cnt) for mech, cnt in per_mechanic.items()])
+
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def update_service_status(path, svc_id, status, actor_tg_id=None):
     conn = get_connection(path)
     cur = conn.cursor()
+    cur.execute("SELECT status FROM services WHERE id = ?", (svc_id,))
+    row = cur.fetchone()
     cur.execute("UPDATE services SET status = ? WHERE id = ?", (status, svc_id))
+    if row is not None:
+        _kpi_status_move(cur, row["status"], status)
+        _log_events(cur, [("service", svc_id, "status", actor_tg_id,
+                           {"old": row["status"], "new": status})])
     conn.commit()
     conn.close()
+    bump_version(path, "service", svc_id)
+    invalidate_services(path, svc_id)
 
 
 # ❗❗❗ ВАЖНО: эта версия возвращает ВСЁ, что нужно
 def get_service(path, svc_id):
+    """
+    Zgłoszenie z numerem / VIN / firmą auta. Wynik trzymany w LRU; wpis jest
+    ważny, dopóki nie zmieni się wersja zgłoszenia ani auta.
+    """
+    key = (_cache_key(path), svc_id)
+    with _cache_lock:
+        entry = _service_cache.get(key)
+        svc_version = _version((key[0], "service", svc_id))
+        if entry is not None:
+            car_version = _version((key[0], "car", entry[2]["car_id"]))
+            if entry[:2] == (svc_version, car_version):
+                _service_cache.move_to_end(key)
+                _service_stats["hits"] += 1
+                return entry[2]
+        _service_stats["misses"] += 1
+
+    row = _load_service(path, svc_id)
+    if row is None:
+        return None
+
+    with _cache_lock:
+        car_version = _version((key[0], "car", row["car_id"]))
+        # zapis w trakcie odczytu podbił wersję — nie cache'ujemy starego wiersza
+        if _version((key[0], "service", svc_id)) == svc_version:
+            _service_cache[key] = (svc_version, car_version, row)
+            _service_cache.move_to_end(key)
+            _trim("services", _service_cache, SERVICE_CACHE_SIZE)
+    return row
+
+
+def _load_service(path, svc_id):
     conn = get_connection(path)
     cur = conn.cursor()
 
@@ -207,48 +1392,874 @@ def get_service(path, svc_id):
     """, (svc_id,))
 
     row = cur.fetchone()
+
+    # zgłoszenia przeniesione do archiwum — szukamy od najnowszego roku
+    if row is None:
+        for year in _present_archive_years(cur, path):
+            with _attached_archive(conn, path, year) as alias:
+                cur.execute(f"""
+                    SELECT 
+                        s.*,
+                        c.plate,
+                        c.vin,
+                        c.owner_company
+                    FROM {alias}.services s
+                    LEFT JOIN cars c ON c.id = s.car_id
+                    WHERE s.id = ?
+                """, (svc_id,))
+                row = cur.fetchone()
+            if row is not None:
+                break
+
     conn.close()
     return row
 
 
-def set_service_result(path, svc_id, final_mileage, cost_net, comments):
+OPEN_STATUSES = ("pending", "confirmed")
+
+
+def list_mechanic_jobs(path, mechanic_tg_id, offset=0, limit=5, statuses=OPEN_STATUSES):
+    """Otwarte zgłoszenia mechanika wg terminu. Zwraca (wiersze, liczba_wszystkich)."""
+    marks = ",".join("?" * len(statuses))
+    conn = get_connection(path)
+    cur = conn.cursor()
+
+    cur.execute(f"""
+        SELECT COUNT(*) AS cnt FROM services
+        WHERE mechanic_tg_id = ? AND status IN ({marks})
+    """, (mechanic_tg_id, *statuses))
+    total = cur.fetchone()["cnt"]
+
+    cur.execute(f"""
+        SELECT s.id, s.status, s.desired_at, s.description, c.plate
+        FROM services s
+        LEFT JOIN cars c ON c.id = s.car_id
+        WHERE s.mechanic_tg_id = ? AND s.status IN ({marks})
+        ORDER BY s.desired_at, s.id
+        LIMIT ? OFFSET ?
+    """, (mechanic_tg_id, *statuses, limit, offset))
+    rows = cur.fetchall()
+
+    conn.close()
+    return rows, total
+
+
+def set_service_result(path, svc_id, final_mileage, cost_net_gr, comments, actor_tg_id=None):
+    """cost_net_gr: koszt netto w groszach (int)."""
     conn = get_connection(path)
     cur = conn.cursor()
 
+    cur.execute("""
+        SELECT s.status, s.car_id, c.owner_company
+        FROM services s
+        LEFT JOIN cars c ON c.id = s.car_id
+        WHERE s.id = ?
+    """, (svc_id,))
+    prev = cur.fetchone()
+
     cur.execute("""
         UPDATE services
         SET 
             final_mileage = ?,
-            cost_net = ?,
+            cost_net_gr = ?,
             comments = ?,
             status = 'done'
         WHERE id = ?
-    """, (final_mileage, cost_net, comments, svc_id))
+    """, (final_mileage, cost_net_gr, comments, svc_id))
+
+    if prev is not None:
+        _kpi_status_move(cur, prev["status"], "done")
+        cur.execute("""
+            INSERT INTO kpi_company_spend (owner_company, services, total_gr) VALUES (?, 1, ?)
+            ON CONFLICT(owner_company) DO UPDATE SET
+                services = services + 1,
+                total_gr = total_gr + excluded.total_gr
+        """, (prev["owner_company"] or "-", cost_net_gr or 0))
+        cur.execute("""
+            INSERT OR REPLACE INTO kpi_car_service (car_id, last_service_at)
+            VALUES (?, CURRENT_TIMESTAMP)
+        """, (prev["car_id"],))
+        _log_events(cur, [("service", svc_id, "done", actor_tg_id, {
+            "old": prev["status"],
+            "car_id": prev["car_id"],
+            "owner_company": prev["owner_company"],
+            "final_mileage": final_mileage,
+            "cost_net_gr": cost_net_gr,
+            "comments": comments,
+        })])
+
+    conn.commit()
+    conn.close()
+    bump_version(path, "service", svc_id)
+    bump_version(path, "dataset", 0)
+    invalidate_services(path, svc_id)
+
+
+# ------------------------------------------------------------
+#  ATTACHMENTS
+# ------------------------------------------------------------
 
+def add_attachment(path, svc_id, sha256, kind, mime, name, size, thumbs=(),
+                   tg_file_id=None, tg_file_unique_id=None, uploaded_by=None):
+    """Zapisuje metadane załącznika; thumbs — rozmiary wygenerowanych miniatur."""
+    conn = get_connection(path)
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO attachments (service_id, sha256, kind, mime, name, size, thumbs,
+                                 tg_file_id, tg_file_unique_id, uploaded_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (svc_id, sha256, kind, mime, name, size, ",".join(map(str, thumbs)),
+          tg_file_id, tg_file_unique_id, uploaded_by))
+    att_id = cur.lastrowid
+    _log_events(cur, [("service", svc_id, "attached", uploaded_by, {
+        "attachment_id": att_id, "sha256": sha256, "kind": kind, "name": name,
+    })])
     conn.commit()
     conn.close()
+    return att_id
+
+
+def find_attachment_by_unique_id(path, tg_file_unique_id):
+    """Wcześniej zapisany plik o tym samym file_unique_id (bez ponownego pobierania)."""
+    conn = get_connection(path)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT * FROM attachments WHERE tg_file_unique_id = ? ORDER BY id LIMIT 1
+    """, (tg_file_unique_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row
+
+
+def list_attachments(path, svc_id):
+    conn = get_connection(path)
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM attachments WHERE service_id = ? ORDER BY id", (svc_id,))
+    rows = cur.fetchall()
+    conn.close()
+    return rows
 
 
 # ------------------------------------------------------------
 #  REPORTS
 # ------------------------------------------------------------
 
-def monthly_report(path, year, month):
+def _month_range(year, month):
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def done_services_rows(path, conn=None):
+    """
+    Wszystkie zakończone zgłoszenia (także z archiwów) z danymi auta,
+    posortowane po aucie i dacie — wejście dla analytics.
+    `conn` — opcjonalne połączenie (np. migawka z reports.py).
+    """
+    columns = """
+        s.id, s.car_id, s.final_mileage, s.cost_net_gr, s.created_at,
+        c.mileage AS car_mileage, c.model, c.owner_company, c.fuel_type
+    """
+    own_conn = conn is None
+    conn = conn or get_connection(path)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {columns}
+        FROM services s
+        LEFT JOIN cars c ON c.id = s.car_id
+        WHERE s.status = 'done'
+    """)
+    rows = cur.fetchall()
+
+    for year in _present_archive_years(cur, path):
+        with _attached_archive(conn, path, year) as alias:
+            cur.execute(f"""
+                SELECT {columns}
+                FROM {alias}.services s
+                LEFT JOIN cars c ON c.id = s.car_id
+                WHERE s.status = 'done'
+            """)
+            rows += cur.fetchall()
+
+    if own_conn:
+        conn.close()
+    rows.sort(key=lambda r: (r["car_id"] or 0, r["created_at"] or "", r["id"]))
+    return rows
+
+
+# kolumny done_services_table: liczby całkowite, potem teksty; braki to -1 / '-'.
+# created_ts — sekundy epoki (kolejność serwisów auta), month — RRRRMM (0 = brak daty)
+DONE_COLUMNS = (
+    "id", "car_id", "final_mileage", "cost_net_gr", "car_mileage", "created_ts", "month",
+    "model", "owner_company", "fuel_type",
+)
+
+
+def done_services_table(path, conn=None):
+    """
+    Jak done_services_rows, ale zwykłe krotki w kolejności DONE_COLUMNS,
+    bez NULL-i i bez sortowania — daty zamienione na liczby w SQLite,
+    żeby analytics budowało kolumny NumPy bez pętli w Pythonie.
+    """
+    columns = """
+        s.id, COALESCE(s.car_id, -1), COALESCE(s.final_mileage, -1), COALESCE(s.cost_net_gr, 0),
+        COALESCE(c.mileage, -1),
+        COALESCE(CAST(strftime('%s', s.created_at) AS INTEGER), -1),
+        COALESCE(CAST(strftime('%Y%m', s.created_at) AS INTEGER), 0),
+        COALESCE(c.model, '-'), COALESCE(c.owner_company, '-'), COALESCE(c.fuel_type, '-')
+    """
+    own_conn = conn is None
+    conn = conn or get_connection(path)
+    archives = _present_archive_years(conn.cursor(), path)
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(f"""
+        SELECT {columns}
+        FROM services s
+        LEFT JOIN cars c ON c.id = s.car_id
+        WHERE s.status = 'done'
+    """)
+    rows = cur.fetchall()
+
+    for year in archives:
+        with _attached_archive(conn, path, year) as alias:
+            cur.execute(f"""
+                SELECT {columns}
+                FROM {alias}.services s
+                LEFT JOIN cars c ON c.id = s.car_id
+                WHERE s.status = 'done'
+            """)
+            rows += cur.fetchall()
+
+    if own_conn:
+        conn.close()
+    return rows
+
+
+def monthly_report(path, year, month, conn=None):
+    """
+    (suma netto, prowizja, stawka prowizji) — kwoty w groszach, liczone
+    w SQLite na liczbach całkowitych (prowizja zaokrąglona do grosza).
+    """
+    own_conn = conn is None
+    conn = conn or get_connection(path)
+    cur = conn.cursor()
+
+    cur.execute("SELECT value FROM settings WHERE key = 'commission_bp'")
+    row = cur.fetchone()
+    rate = row["value"] if row is not None else DEFAULT_RATES["commission_bp"]
+
+    start, end = _month_range(year, month)
+    params = ("done", start, end)
+    totals = """
+        SELECT total, (total * ? + 5000) / 10000 AS commission
+        FROM (SELECT COALESCE(SUM(cost_net_gr), 0) AS total FROM ({source}))
+    """
+
+    if year in _present_archive_years(cur, path):
+        # miesiąc częściowo lub w całości w archiwum — UNION z plikiem roku
+        with _attached_archive(conn, path, year) as alias:
+            cur.execute(totals.format(source=f"""
+                SELECT cost_net_gr FROM services
+                WHERE status = ? AND created_at >= ? AND created_at < ?
+                UNION ALL
+                SELECT cost_net_gr FROM {alias}.services
+                WHERE status = ? AND created_at >= ? AND created_at < ?
+            """), (rate,) + params + params)
+            row = cur.fetchone()
+    else:
+        cur.execute(totals.format(source="""
+            SELECT cost_net_gr FROM services
+            WHERE status = ?
+              AND created_at >= ?
+              AND created_at < ?
+        """), (rate,) + params)
+        row = cur.fetchone()
+
+    if own_conn:
+        conn.close()
+    return row["total"], row["commission"], rate
+
+
+# ------------------------------------------------------------
+#  KPI / DASHBOARD
+# ------------------------------------------------------------
+
+def kpi_week(when=None):
+    """Klucz tygodnia ISO, np. '2025-W49'."""
+    return (when or datetime.now()).strftime("%G-W%V")
+
+
+def _kpi_status_move(cur, old, new, count=1):
+    if old == new:
+        return
+    if old is not None:
+        cur.execute("UPDATE kpi_status SET cnt = cnt - ? WHERE status = ?", (count, old))
+    if new is not None:
+        cur.execute("""
+            INSERT INTO kpi_status (status, cnt) VALUES (?, ?)
+            ON CONFLICT(status) DO UPDATE SET cnt = cnt + excluded.cnt
+        """, (new, count))
+
+
+def _service_tables(conn, path):
+    """
+    Generator nazw tabel zgłoszeń: main.services, potem services z każdego
+    pliku archiwum (dołączanego na czas przetwarzania — generator trzeba
+    wyczerpać). Poza transakcją: ATTACH jej nie dopuszcza.
+    """
+    cur = conn.cursor()
+    yield "main.services"
+    for year in _present_archive_years(cur, path):
+        with _attached_archive(conn, path, year) as alias:
+            yield f"{alias}.services"
+
+
+def _done_times(cur):
+    """
+    {svc_id: czas zakończenia} z dziennika zdarzeń — jak w rebuild_from_events
+    (zdarzenie 'done', albo done_at z migawki; 'created' go zeruje).
+    """
+    cur.execute("""
+        SELECT entity_id, action, ts, json_extract(payload, '$.done_at') AS done_at
+        FROM events
+        WHERE entity = 'service' AND action IN ('created', 'snapshot', 'done')
+        ORDER BY id
+    """)
+    return {r["entity_id"]: r["ts"] if r["action"] == "done" else r["done_at"] for r in cur.fetchall()}
+
+
+def _car_added_times(cur):
+    """{car_id: data dodania} z dziennika zdarzeń (jak created_at w rebuild_from_events)."""
+    cur.execute("""
+        SELECT entity_id, COALESCE(json_extract(payload, '$.created_at'), ts) AS created_at
+        FROM events
+        WHERE entity = 'car' AND action IN ('created', 'snapshot')
+        ORDER BY id
+    """)
+    return {r["entity_id"]: r["created_at"] for r in cur.fetchall()}
+
+
+def rebuild_kpi(path):
+    """
+    Przelicza tabele KPI od zera z services (także w plikach archiwum),
+    cars i dziennika zdarzeń. Definicje jak w ścieżce przyrostowej
+    i w rebuild_from_events:
+    - wydatki firmy — zakończone zgłoszenia wg bieżącej firmy auta,
+    - ostatni serwis — czas zakończenia (nie utworzenia) zgłoszenia,
+      dla aut bez serwisu — data dodania auta.
+    """
     conn = get_connection(path)
     cur = conn.cursor()
+    done_at = _done_times(cur)
+
+    statuses, weeks, spend, last_done = {}, {}, {}, {}
+    for table in _service_tables(conn, path):
+        cur.execute(f"""
+            SELECT s.id, s.car_id, s.mechanic_tg_id, s.status, s.cost_net_gr, s.created_at,
+                   c.owner_company
+            FROM {table} s
+            LEFT JOIN cars c ON c.id = s.car_id
+        """)
+        for r in cur.fetchall():
+            statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+            if r["created_at"] is not None:
+                key = (kpi_week(datetime.fromisoformat(r["created_at"])), r["mechanic_tg_id"])
+                weeks[key] = weeks.get(key, 0) + 1
+            if r["status"] != "done":
+                continue
+            company = r["owner_company"] or "-"
+            cnt, amount = spend.get(company, (0, 0))
+            spend[company] = (cnt + 1, amount + (r["cost_net_gr"] or 0))
+            when = done_at.get(r["id"]) or r["created_at"]
+            if when and when > last_done.get(r["car_id"], ""):
+                last_done[r["car_id"]] = when
+
+    added = _car_added_times(cur)
+    cur.execute("SELECT CURRENT_TIMESTAMP AS now")
+    now = cur.fetchone()["now"]
+    cur.execute("SELECT id FROM cars WHERE archived_at IS NULL")
+    last_service = {}
+    for (car_id,) in cur.fetchall():
+        last_service[car_id] = max(added.get(car_id) or now, last_done.get(car_id, ""))
+
+    cur.execute("DELETE FROM kpi_status")
+    cur.execute("DELETE FROM kpi_mechanic_week")
+    cur.execute("DELETE FROM kpi_company_spend")
+    cur.execute("DELETE FROM kpi_car_service")
+    cur.executemany("INSERT INTO kpi_status (status, cnt) VALUES (?, ?)", statuses.items())
+    cur.executemany(
+        "INSERT INTO kpi_mechanic_week (week, mechanic_tg_id, cnt) VALUES (?, ?, ?)",
+        [(week, mech, cnt) for (week, mech), cnt in weeks.items()],
+    )
+    cur.executemany(
+        "INSERT INTO kpi_company_spend (owner_company, services, total_gr) VALUES (?, ?, ?)",
+        [(company, cnt, amount) for company, (cnt, amount) in spend.items()],
+    )
+    cur.executemany(
+        "INSERT INTO kpi_car_service (car_id, last_service_at) VALUES (?, ?)",
+        last_service.items(),
+    )
+
+    conn.commit()
+    conn.close()
+
+
+def get_dashboard(path, overdue_days=180, top=5):
+    conn = get_connection(path)
+    cur = conn.cursor()
+
+    cur.execute("SELECT status, cnt FROM kpi_status WHERE cnt > 0 ORDER BY status")
+    statuses = {r["status"]: r["cnt"] for r in cur.fetchall()}
+
+    cur.execute("""
+        SELECT k.mechanic_tg_id, k.cnt, u.full_name
+        FROM kpi_mechanic_week k
+        LEFT JOIN users u ON u.tg_id = k.mechanic_tg_id
+        WHERE k.week = ?
+        ORDER BY k.cnt DESC
+    """, (kpi_week(),))
+    mechanics = cur.fetchall()
 
     cur.execute("""
-        SELECT SUM(cost_net) AS total
+        SELECT owner_company, services, total_gr
+        FROM kpi_company_spend
+        ORDER BY total_gr DESC
+        LIMIT ?
+    """, (top,))
+    companies = cur.fetchall()
+
+    cutoff = (datetime.now() - timedelta(days=overdue_days)).strftime("%Y-%m-%d %H:%M:%S")
+    cur.execute("SELECT COUNT(*) AS cnt FROM kpi_car_service WHERE last_service_at < ?", (cutoff,))
+    overdue_count = cur.fetchone()["cnt"]
+    cur.execute("""
+        SELECT c.id, c.plate, k.last_service_at
+        FROM kpi_car_service k
+        JOIN cars c ON c.id = k.car_id
+        WHERE k.last_service_at < ?
+        ORDER BY k.last_service_at
+        LIMIT ?
+    """, (cutoff, top))
+    overdue = cur.fetchall()
+
+    conn.close()
+    return {
+        "statuses": statuses,
+        "mechanics": mechanics,
+        "companies": companies,
+        "overdue_count": overdue_count,
+        "overdue": overdue,
+    }
+
+
+# ------------------------------------------------------------
+#  ARCHIVE
+# ------------------------------------------------------------
+
+ARCHIVED_STATUSES = ("done", "rejected")
+
+
+def archive_path(path, year):
+    """fleet.db -> fleet_archive_2023.db (obok głównej bazy)"""
+    base, ext = os.path.splitext(path)
+    return f"{base}_archive_{year}{ext or '.db'}"
+
+
+def _archived_years(cur):
+    cur.execute("SELECT year FROM archive_years ORDER BY year DESC")
+    return [r["year"] for r in cur.fetchall()]
+
+
+_missing_archives = set()
+
+
+def _present_archive_years(cur, path):
+    """
+    Lata archiwum, których plik istnieje. Brakującego (przeniesionego,
+    usuniętego) pliku nie dołączamy — ATTACH utworzyłby pusty plik,
+    a w trybie tylko do odczytu zgłosiłby błąd. Ostrzeżenie raz na plik.
+    """
+    years = []
+    for year in _archived_years(cur):
+        archive = archive_path(path, year)
+        if os.path.exists(archive):
+            years.append(year)
+        elif archive not in _missing_archives:
+            _missing_archives.add(archive)
+            logger.warning("brak pliku archiwum %s — pomijam rok %s", archive, year)
+    return years
+
+
+def _archive_indexes(cur, alias):
+    cur.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {alias}.idx_archive_services_id
+        ON services (id)
+    """)
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS {alias}.idx_archive_services_status_created
+        ON services (status, created_at)
+    """)
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS {alias}.idx_archive_services_car
+        ON services (car_id, status)
+    """)
+
+
+@contextmanager
+def _attached_archive(conn, path, year):
+    alias = f"archive_{int(year)}"
+    if alias in {r[1] for r in conn.execute("PRAGMA database_list")}:
+        # już dołączone (połączenie-migawka raportów) — nic nie zmieniamy
+        yield alias
+        return
+
+    conn.execute("ATTACH DATABASE ? AS " + alias, (archive_path(path, year),))
+    try:
+        yield alias
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE " + alias)
+
+
+def archive_services(path, older_than_days=365):
+    """
+    Przenosi zakończone / odrzucone zgłoszenia starsze niż `older_than_days`
+    do rocznych plików archiwalnych. Zwraca {rok: liczba_przeniesionych}.
+    """
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M:%S")
+    marks = ",".join("?" * len(ARCHIVED_STATUSES))
+
+    conn = get_connection(path)
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT DISTINCT CAST(strftime('%Y', created_at) AS INTEGER) AS year
         FROM services
-        WHERE status = 'done'
-          AND strftime('%Y', created_at) = ?
-          AND strftime('%m', created_at) = ?
-    """, (str(year), f"{month:02d}"))
+        WHERE status IN ({marks}) AND created_at < ?
+    """, ARCHIVED_STATUSES + (cutoff,))
+    years = [r["year"] for r in cur.fetchall()]
+    conn.commit()
+
+    moved = {}
+    for year in years:
+        start, _ = _month_range(year, 1)
+        end, _ = _month_range(year + 1, 1)
+        where = f"status IN ({marks}) AND created_at < ? AND created_at >= ? AND created_at < ?"
+        params = ARCHIVED_STATUSES + (cutoff, start, end)
+
+        with _attached_archive(conn, path, year) as alias:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {alias}.services AS
+                SELECT * FROM main.services WHERE 0
+            """)
+            _archive_indexes(cur, alias)
+            cur.execute(f"INSERT OR REPLACE INTO {alias}.services SELECT * FROM main.services WHERE {where}", params)
+            cur.execute(f"DELETE FROM main.services WHERE {where}", params)
+            count = cur.rowcount
+            cur.execute("""
+                INSERT INTO archive_years (year, rows) VALUES (?, ?)
+                ON CONFLICT(year) DO UPDATE SET
+                    rows = rows + excluded.rows,
+                    archived_at = CURRENT_TIMESTAMP
+            """, (year, count))
+        moved[year] = count
+
+    conn.close()
+    if moved:
+        bump_version(path, "dataset", 0)
+        invalidate_services(path)
+    return moved
+
+
+# ------------------------------------------------------------
+#  BACKUP
+# ------------------------------------------------------------
+
+def backup_db(path, dest, pages=256, sleep=0.05):
+    """
+    Kopia online przez sqlite3 backup API, krokami po `pages` stron —
+    między krokami zapisujący mogą przejąć blokadę.
+    Zwraca listę kroków: [{step, pages, remaining, total, duration}, ...].
+    """
+    steps = []
+    last = time.perf_counter()
+    prev_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal last, prev_remaining
+        now = time.perf_counter()
+        copied = (total if prev_remaining is None else prev_remaining) - remaining
+        steps.append({
+            "step": len(steps) + 1,
+            "pages": copied,
+            "remaining": remaining,
+            "total": total,
+            "duration": now - last,
+        })
+        prev_remaining = remaining
+        last = now
+
+    tmp = dest + ".part"
+    src = get_connection(path)
+    dst = sqlite3.connect(tmp)
+    try:
+        src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+        # kopia jako jeden plik — bez -wal / -shm obok (zostawałyby po rotacji)
+        dst.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        dst.close()
+        src.close()
+
+    os.replace(tmp, dest)
+    return steps
 
-    row = cur.fetchone()
-    total = row["total"] if row["total"] is not None else 0
 
-    commission = round(total * 0.10, 2)
+def _reserve_snapshot(backup_dir, stem):
+    """
+    Nowa, pusta nazwa kopii (O_EXCL) — dwie kopie w tej samej chwili
+    (okresowa i /backup) nie nadpiszą się nawzajem ani swoich archiwów.
+    Mikrosekundy w nazwie zachowują kolejność sortowania przy rotacji.
+    """
+    while True:
+        dest = os.path.join(backup_dir, f"{stem}-{datetime.now():%Y%m%d-%H%M%S-%f}.db")
+        try:
+            os.close(os.open(dest, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return dest
+        except FileExistsError:
+            continue
+
+
+def verify_snapshot(dest):
+    """PRAGMA integrity_check na kopii — True, jeśli 'ok'."""
+    conn = sqlite3.connect(f"file:{dest}?mode=ro", uri=True)
+    try:
+        row = conn.execute("PRAGMA integrity_check").fetchone()
+    finally:
+        conn.close()
+    return row is not None and row[0] == "ok"
+
+
+def _snapshot_archive_years(dest):
+    """Lata archiwum zapisane w kopii (archive_years w samej kopii)."""
+    conn = sqlite3.connect(f"file:{dest}?mode=ro", uri=True)
+    try:
+        return [r[0] for r in conn.execute("SELECT year FROM archive_years ORDER BY year")]
+    except sqlite3.OperationalError:  # baza sprzed archiwizacji
+        return []
+    finally:
+        conn.close()
+
+
+def snapshot_db(path, backup_dir, keep=7, pages=256):
+    """
+    Tworzy kopię <backup_dir>/<nazwa>-YYYYmmdd-HHMMSS-ffffff.db razem z plikami
+    archiwum (<nazwa>-YYYYmmdd-HHMMSS-ffffff_archive_<rok>.db), weryfikuje każdy
+    plik i usuwa najstarsze kopie (z ich archiwami) ponad `keep`.
+    Archiwa są kopiowane po głównej bazie, wg archive_years z kopii —
+    archiwizacja w trakcie może najwyżej zdublować wiersze, nie zgubić.
+    Zwraca (ścieżka_kopii, kroki, ok, usunięte, {rok: ok archiwum}).
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    dest = _reserve_snapshot(backup_dir, stem)
+
+    try:
+        steps = backup_db(path, dest, pages=pages)
+    except Exception:
+        os.remove(dest)
+        raise
+    ok = verify_snapshot(dest)
+
+    archives = {}
+    for year in _snapshot_archive_years(dest):
+        source = archive_path(path, year)
+        if not os.path.exists(source):
+            continue
+        target = archive_path(dest, year)
+        steps += backup_db(source, target, pages=pages)
+        archives[year] = verify_snapshot(target)
+    ok = ok and all(archives.values())
+
+    snapshots = sorted(
+        f for f in os.listdir(backup_dir)
+        if f.startswith(stem + "-") and f.endswith(".db") and "_archive_" not in f
+    )
+    removed = []
+    for name in snapshots[:-keep] if keep > 0 else []:
+        old = os.path.join(backup_dir, name)
+        for archive in glob.glob(archive_path(glob.escape(old), "*")):
+            os.remove(archive)
+        os.remove(old)
+        removed.append(name)
+
+    return dest, steps, ok, removed, archives
+
+
+# ------------------------------------------------------------
+#  EVENT REPLAY / COMPACTION
+# ------------------------------------------------------------
+
+def _apply_event(state, ts, action, payload):
+    """Stan encji po zastosowaniu jednego zdarzenia (None = usunięta)."""
+    if action in ("created", "snapshot"):
+        state = dict(payload)
+        # starsze wiersze mogą mieć created_at = NULL — wtedy czas zdarzenia
+        state["created_at"] = state.get("created_at") or ts
+    elif state is None:
+        return None
+    elif action == "updated":
+        state[payload["field"]] = payload["new"]
+    elif action == "status":
+        state["status"] = payload["new"]
+    elif action == "done":
+        state.update({k: v for k, v in payload.items() if k != "old"})
+        state["status"] = "done"
+        state["done_at"] = ts
+    elif action == "archived":
+        state["archived_at"] = ts
+    elif action == "deleted":
+        # twarde usunięcie sprzed miękkiego (dzienniki starszych wersji)
+        return None
+    return state
+
+
+def _event_cost_gr(state):
+    """Koszt z odtworzonego stanu; zdarzenia sprzed groszy mają cost_net w złotych."""
+    if "cost_net_gr" in state:
+        return state["cost_net_gr"]
+    return money.from_float(state.get("cost_net"))
+
+
+def _fold_events(rows):
+    """rows: (ts, entity, entity_id, action, payload) w kolejności id."""
+    states = {"car": {}, "service": {}}
+    for ts, entity, entity_id, action, payload in rows:
+        target = states[entity]
+        new = _apply_event(target.get(entity_id), ts, action, json.loads(payload))
+        if new is None:
+            target.pop(entity_id, None)
+        else:
+            target[entity_id] = new
+    return states["car"], states["service"]
+
+
+def rebuild_from_events(path):
+    """
+    Odtwarza tabele pochodne (KPI, indeks numerów) wyłącznie z dziennika
+    zdarzeń. Zwraca {events, cars, services, seconds}.
+    """
+    started = time.perf_counter()
+    conn = get_connection(path)
+    cur = conn.cursor()
+
+    cur.execute("SELECT COUNT(*) AS cnt FROM events")
+    total = cur.fetchone()["cnt"]
+
+    raw = conn.execute("SELECT ts, entity, entity_id, action, payload FROM events ORDER BY id")
+    cars, services = _fold_events(raw)
+
+    statuses, weeks, spend, last_service = {}, {}, {}, {}
+    active = {car_id: car for car_id, car in cars.items() if not car.get("archived_at")}
+    for car_id, car in active.items():
+        last_service[car_id] = car["created_at"]
+
+    for svc in services.values():
+        statuses[svc["status"]] = statuses.get(svc["status"], 0) + 1
+        week = (kpi_week(datetime.fromisoformat(svc["created_at"])), svc["mechanic_tg_id"])
+        weeks[week] = weeks.get(week, 0) + 1
+        if svc["status"] == "done":
+            car = cars.get(svc["car_id"])
+            company = (car.get("owner_company") if car else svc.get("owner_company")) or "-"
+            cnt, amount = spend.get(company, (0, 0))
+            spend[company] = (cnt + 1, amount + (_event_cost_gr(svc) or 0))
+            if svc["car_id"] in active:
+                done_at = svc.get("done_at") or svc["created_at"]
+                last_service[svc["car_id"]] = max(last_service[svc["car_id"]], done_at)
+
+    cur.execute("DELETE FROM kpi_status")
+    cur.execute("DELETE FROM kpi_mechanic_week")
+    cur.execute("DELETE FROM kpi_company_spend")
+    cur.execute("DELETE FROM kpi_car_service")
+    cur.executemany("INSERT INTO kpi_status (status, cnt) VALUES (?, ?)", statuses.items())
+    cur.executemany(
+        "INSERT INTO kpi_mechanic_week (week, mechanic_tg_id, cnt) VALUES (?, ?, ?)",
+        [(week, mech, cnt) for (week, mech), cnt in weeks.items()],
+    )
+    cur.executemany(
+        "INSERT INTO kpi_company_spend (owner_company, services, total_gr) VALUES (?, ?, ?)",
+        [(company, cnt, amount) for company, (cnt, amount) in spend.items()],
+    )
+    cur.executemany(
+        "INSERT INTO kpi_car_service (car_id, last_service_at) VALUES (?, ?)",
+        last_service.items(),
+    )
+    conn.commit()
+    conn.close()
+
+    invalidate_cars(path)
+    invalidate_users(path)
+    index = {}
+    for car_id in sorted(active):
+        if active[car_id].get("plate"):
+            index.setdefault(active[car_id]["plate"].upper(), car_id)
+    with _cache_lock:
+        _plate_index[_cache_key(path)] = index
+        _trim("plates", _plate_index, PLATE_INDEX_FILES)
+
+    return {
+        "events": total,
+        "cars": len(cars),
+        "services": len(services),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def compact_events(path, older_than_days=90):
+    """
+    Zwija zdarzenia starsze niż `older_than_days` w jedno zdarzenie
+    'snapshot' na encję. Zarchiwizowane auta zostają jako snapshot
+    z archived_at (zgłoszenia wciąż się do nich odwołują), usunięte
+    twardo ('deleted' ze starszych wersji) znikają z dziennika.
+    Zwraca (liczba_przed, liczba_po).
+    """
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_connection(path)
+    cur = conn.cursor()
+
+    cur.execute("SELECT COUNT(*) AS cnt FROM events")
+    before = cur.fetchone()["cnt"]
+
+    cur.execute("""
+        SELECT entity, entity_id, MAX(id) AS last_id, COUNT(*) AS cnt
+        FROM events
+        WHERE ts < ?
+        GROUP BY entity, entity_id
+        HAVING cnt > 1 OR MAX(action IN ('archived', 'deleted')) = 1
+    """, (cutoff,))
+    groups = cur.fetchall()
+
+    snapshots, drops = [], []
+    for g in groups:
+        rows = conn.execute("""
+            SELECT ts, entity, entity_id, action, payload FROM events
+            WHERE entity = ? AND entity_id = ? AND id <= ?
+            ORDER BY id
+        """, (g["entity"], g["entity_id"], g["last_id"])).fetchall()
+        cars, services = _fold_events(rows)
+        state = (cars if g["entity"] == "car" else services).get(g["entity_id"])
+        if state is None:
+            drops.append((g["entity"], g["entity_id"], g["last_id"]))
+        else:
+            snapshots.append((json.dumps(state, ensure_ascii=False, default=str), g["last_id"]))
+            drops.append((g["entity"], g["entity_id"], g["last_id"] - 1))
+
+    cur.executemany("UPDATE events SET action = 'snapshot', payload = ? WHERE id = ?", snapshots)
+    cur.executemany("DELETE FROM events WHERE entity = ? AND entity_id = ? AND id <= ?", drops)
+    conn.commit()
 
+    cur.execute("SELECT COUNT(*) AS cnt FROM events")
+    after = cur.fetchone()["cnt"]
     conn.close()
-    return total, commission
+    return before, after
@@ -0,0 +1,117 @@
+"""
+Zbiorcze powiadomienia: elementy dla jednego odbiorcy zebrane w oknie
+czasowym są wysyłane jedną wiadomością. Bufor odbiorcy jest wysyłany
+przed końcem okna, gdy osiągnie `max_items`; ponad `max_recipients`
+odbiorców nowe elementy idą od razu, bez buforowania. Elementy, których
+flush nie wysłał, wracają na początek bufora i są ponawiane po
+`retry_delay` s, najwyżej `max_retries` razy z rzędu.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger("fleet_bot.digest")
+
+MAX_ITEMS = 50
+MAX_RECIPIENTS = 1000
+MAX_RETRIES = 3
+RETRY_DELAY = 30
+
+
+class DigestNotifier:
+    def __init__(self, window, flush, max_items=MAX_ITEMS, max_recipients=MAX_RECIPIENTS,
+                 max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY):
+        """
+        window: długość okna w sekundach (0 = wysyłka od razu)
+        flush: async flush(recipient, items) — wysyła zebrane elementy,
+               zwraca listę niewysłanych (do ponowienia)
+        """
+        self.window = window
+        self.flush = flush
+        self.max_items = max_items
+        self.max_recipients = max_recipients
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._buffers = {}
+        self._tasks = {}
+        self._retries = {}
+        self.early_flushes = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def pending(self):
+        return sum(len(items) for items in self._buffers.values())
+
+    def stats(self):
+        return {
+            "digest.recipients": {
+                "size": len(self._buffers), "bound": self.max_recipients, "evictions": self.early_flushes,
+            },
+            "digest.items": {
+                "size": self.pending(), "bound": self.max_items * self.max_recipients,
+                "evictions": self.early_flushes,
+            },
+            "digest.retries": {"size": len(self._retries), "bound": None, "evictions": self.dropped},
+        }
+
+    async def _deliver(self, recipient, items, retry=True):
+        unsent = await self.flush(recipient, items)
+        if not unsent:
+            self._retries.pop(recipient, None)
+            return
+        attempt = self._retries.get(recipient, 0) + 1
+        if not retry or attempt > self.max_retries:
+            self._retries.pop(recipient, None)
+            self.dropped += len(unsent)
+            logger.error("Porzucone powiadomienia dla %s po %s próbach: %s",
+                         recipient, attempt, unsent)
+            return
+        self._retries[recipient] = attempt
+        self.retried += len(unsent)
+        # niewysłane przed nowymi; ponowienie po retry_delay
+        self._buffers[recipient] = list(unsent) + self._buffers.get(recipient, [])
+        task = self._tasks.pop(recipient, None)
+        if task is not None:
+            task.cancel()
+        self._tasks[recipient] = asyncio.create_task(
+            self._flush_later(recipient, max(self.window, self.retry_delay))
+        )
+
+    async def add(self, recipient, item):
+        if self.window <= 0 and recipient not in self._buffers:
+            await self._deliver(recipient, [item])
+            return
+
+        if recipient not in self._buffers and len(self._buffers) >= self.max_recipients:
+            self.early_flushes += 1
+            await self._deliver(recipient, [item])
+            return
+
+        items = self._buffers.setdefault(recipient, [])
+        items.append(item)
+        if len(items) >= self.max_items:
+            self.early_flushes += 1
+            task = self._tasks.pop(recipient, None)
+            if task is not None:
+                task.cancel()
+            del self._buffers[recipient]
+            await self._deliver(recipient, items)
+            return
+        if recipient not in self._tasks:
+            self._tasks[recipient] = asyncio.create_task(self._flush_later(recipient, self.window))
+
+    async def _flush_later(self, recipient, delay):
+        # anulowanie (wcześniejsza wysyłka, flush_all) sprząta po stronie wołającego
+        await asyncio.sleep(delay)
+        self._tasks.pop(recipient, None)
+        items = self._buffers.pop(recipient, [])
+        if items:
+            await self._deliver(recipient, items)
+
+    async def flush_all(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        self._tasks.clear()
+        for recipient in list(self._buffers):
+            items = self._buffers.pop(recipient)
+            if items:
+                await self._deliver(recipient, items, retry=False)
@@ -0,0 +1,54 @@
+"""
+Narzędzie do dziennika zdarzeń.
+
+    python events_tool.py rebuild [--db fleet.db]
+        odtwarza tabele KPI i indeks numerów wyłącznie ze zdarzeń
+    python events_tool.py compact [--db fleet.db] [--days 90]
+        zwija stare zdarzenia w snapshoty
+    python events_tool.py history car|service <id> [--db fleet.db]
+        pokazuje historię encji
+"""
+import argparse
+import json
+import os
+
+from dotenv import load_dotenv
+
+import db
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "fleet.db"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild")
+    compact = sub.add_parser("compact")
+    compact.add_argument("--days", type=int, default=int(os.getenv("EVENTS_KEEP_DAYS", "90")))
+    history = sub.add_parser("history")
+    history.add_argument("entity", choices=("car", "service"))
+    history.add_argument("entity_id", type=int)
+    args = parser.parse_args()
+
+    db.init_db(args.db)
+
+    if args.command == "rebuild":
+        result = db.rebuild_from_events(args.db)
+        rate = result["events"] / result["seconds"] if result["seconds"] else 0
+        print(json.dumps(dict(result, events_per_second=round(rate)), indent=2))
+    elif args.command == "compact":
+        before, after = db.compact_events(args.db, args.days)
+        print(f"Zdarzenia: {before} -> {after}")
+    else:
+        conn = db.get_connection(args.db)
+        for r in conn.execute("""
+            SELECT id, ts, action, actor_tg_id, payload FROM events
+            WHERE entity = ? AND entity_id = ?
+            ORDER BY id
+        """, (args.entity, args.entity_id)):
+            print(f"#{r['id']} {r['ts']} {r['action']} (actor: {r['actor_tg_id'] or '-'}) {r['payload']}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
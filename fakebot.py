@@ -0,0 +1,45 @@
+"""
+Sesja aiogram bez sieci: odpowiada na wywołania Bot API lokalnie.
+Używana przez benchmarki i odtwarzanie ruchu.
+"""
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, User
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def close(self):
+        pass
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        returning = method.__returning__
+        if returning is Message:
+            self._message_id += 1
+            chat_id = getattr(method, "chat_id", 0)
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type="private"),
+                text=getattr(method, "text", None),
+            )
+        if returning is User:
+            return User(id=bot.id, is_bot=True, first_name="fake")
+        if getattr(returning, "__origin__", None) is list:
+            return []
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
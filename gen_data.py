@@ -0,0 +1,162 @@
+"""
+Deterministyczny generator dużych zbiorów danych floty (users, cars,
+services) do testów wydajności. Ten sam seed daje tę samą bazę.
+
+    python gen_data.py out.db --cars 100000 --services-per-car 20 [--seed 42]
+"""
+import argparse
+import os
+import random
+import string
+import time
+from datetime import datetime, timedelta
+
+import db
+
+MODELS = [
+    "Toyota Corolla", "Skoda Octavia", "VW Golf", "Toyota Yaris", "Kia Ceed",
+    "Hyundai i30", "Ford Focus", "Opel Astra", "Renault Clio", "Dacia Logan",
+    "Toyota Camry", "Skoda Superb", "Kia Niro", "Tesla Model 3", "VW Passat",
+]
+FUEL_TYPES = ["benzyna", "diesel", "gaz", "elektryczne", "hybryda"]
+REGIONS = ["WX", "WE", "WI", "WO", "WW", "WN", "WY", "WB", "KR", "PO", "GD"]
+DESCRIPTIONS = [
+    "Wymiana oleju i filtrów", "Wymiana klocków hamulcowych", "Przegląd okresowy",
+    "Wymiana opon na zimowe", "Wymiana opon na letnie", "Naprawa zawieszenia",
+    "Diagnostyka komputerowa", "Wymiana akumulatora", "Naprawa klimatyzacji",
+    "Wymiana rozrządu", "Naprawa blacharska", "Geometria kół",
+]
+VIN_CHARS = "ABCDEFGHJKLMNPRSTUVWXYZ0123456789"
+
+SCALES = {
+    "small": {"cars": 1_000, "services_per_car": 10},
+    "medium": {"cars": 10_000, "services_per_car": 20},
+    "large": {"cars": 100_000, "services_per_car": 20},
+}
+
+
+def _companies(rng, count):
+    suffixes = ["Sp. z o.o.", "S.A.", "Sp.j.", "Transport", "Logistics"]
+    return [
+        f"{''.join(rng.choices(string.ascii_uppercase, k=rng.randint(3, 7)))} {rng.choice(suffixes)}"
+        for _ in range(count)
+    ]
+
+
+def generate(path, cars=1000, services_per_car=10, mechanics=50, admins=3,
+             companies=200, years=5, seed=42, batch=10_000):
+    """
+    Tworzy nową bazę `path`. Zwraca liczności i czas generowania.
+    Wiersze są wstawiane executemany w paczkach po `batch`.
+    """
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    if os.path.exists(path):
+        os.remove(path)
+    db.init_db(path)
+
+    now = datetime(2025, 12, 31, 12, 0, 0)
+    horizon = timedelta(days=365 * years)
+    companies = _companies(rng, companies)
+
+    conn = db.get_connection(path)
+    cur = conn.cursor()
+
+    admin_ids = list(range(1_000, 1_000 + admins))
+    mechanic_ids = list(range(2_000, 2_000 + mechanics))
+    users = [(tg_id, f"Admin {i}", "admin") for i, tg_id in enumerate(admin_ids)]
+    users += [(tg_id, f"Mechanik {i}", "mechanic") for i, tg_id in enumerate(mechanic_ids)]
+    users += [(10_000 + i, f"Kierowca {i}", "user") for i in range(cars // 10)]
+    cur.executemany("INSERT INTO users (tg_id, full_name, role) VALUES (?, ?, ?)", users)
+
+    car_rows, services = [], 0
+    for car_id in range(1, cars + 1):
+        mileage = rng.randint(0, 150_000)
+        car_rows.append((
+            car_id,
+            "".join(rng.choices(VIN_CHARS, k=17)),
+            mileage,
+            rng.randint(2010, 2025),
+            rng.choice(companies),
+            rng.choice(MODELS),
+            f"{rng.choice(REGIONS)}{rng.randint(10000, 99999)}",
+            rng.choice(FUEL_TYPES),
+        ))
+    for i in range(0, len(car_rows), batch):
+        cur.executemany("""
+            INSERT INTO cars (id, vin, mileage, year, owner_company, model, plate, fuel_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, car_rows[i:i + batch])
+
+    svc_batch = []
+
+    def flush():
+        cur.executemany("""
+            INSERT INTO services (car_id, mechanic_tg_id, admin_tg_id, description, desired_at,
+                                  status, final_mileage, cost_net_gr, comments, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, svc_batch)
+        svc_batch.clear()
+
+    for car_id, _, mileage, *_ in car_rows:
+        count = max(0, int(rng.gauss(services_per_car, services_per_car / 4)))
+        created = sorted(now - horizon * rng.random() for _ in range(count))
+        for k, created_at in enumerate(created):
+            mileage += rng.randint(3_000, 25_000)
+            recent = now - created_at < timedelta(days=14)
+            status = (
+                rng.choice(["pending", "confirmed"]) if recent and k == count - 1
+                else "rejected" if rng.random() < 0.05 else "done"
+            )
+            done = status == "done"
+            cost = round(rng.lognormvariate(6.0, 0.8) * 100) if done else None
+            svc_batch.append((
+                car_id,
+                rng.choice(mechanic_ids),
+                rng.choice(admin_ids),
+                rng.choice(DESCRIPTIONS),
+                (created_at + timedelta(days=rng.randint(1, 10))).strftime("%Y-%m-%d %H:00"),
+                status,
+                mileage if done else None,
+                cost,
+                None,
+                created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            ))
+            services += 1
+            if len(svc_batch) >= batch:
+                flush()
+    flush()
+
+    db._seed_events(cur)
+    conn.commit()
+    conn.close()
+    db.rebuild_kpi(path)
+    db.invalidate_users(path)
+    db.invalidate_cars(path)
+
+    return {
+        "users": len(users),
+        "cars": cars,
+        "services": services,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--scale", choices=SCALES)
+    parser.add_argument("--cars", type=int, default=1000)
+    parser.add_argument("--services-per-car", type=int, default=10)
+    parser.add_argument("--mechanics", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    params = SCALES[args.scale] if args.scale else {
+        "cars": args.cars, "services_per_car": args.services_per_car,
+    }
+    print(generate(args.path, mechanics=args.mechanics, seed=args.seed, **params))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Logowanie strukturalne (JSON, jedna linia na wpis) przez QueueHandler /
+QueueListener: na pętli zdarzeń rekord jest tylko wkładany do kolejki,
+formatowanie i zapis robi wątek listenera.
+
+Kontekst śledzenia (update_id, user, handler, svc_id) jest trzymany w
+contextvars i doklejany do każdego wpisu z danej aktualizacji.
+Wpisy masowe (extra={"sample": klucz}) są próbkowane: ułamek `sample_rate`
+i najwyżej `max_per_second` na klucz; błędy zawsze przechodzą.
+"""
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+def start_trace(**fields):
+    """Nowy kontekst dla aktualizacji; zwraca token do reset_trace."""
+    return _trace.set(dict(fields))
+
+
+def reset_trace(token):
+    _trace.reset(token)
+
+
+def bind(**fields):
+    """Dopisuje pola do kontekstu bieżącej aktualizacji (np. svc_id)."""
+    ctx = _trace.get()
+    if ctx is None:
+        _trace.set(dict(fields))
+    else:
+        ctx.update(fields)
+
+
+class TraceFilter(logging.Filter):
+    """Kopiuje kontekst do rekordu w wątku wywołującym (przed kolejką)."""
+
+    def filter(self, record):
+        ctx = _trace.get()
+        if ctx:
+            record.trace = dict(ctx)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    MAX_KEYS = 1024
+
+    def __init__(self, sample_rate=1.0, max_per_second=50):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self._windows = {}     # klucz -> (sekunda, licznik)
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {"logs.sample_keys": {"size": len(self._windows), "bound": self.MAX_KEYS, "evictions": self.evictions}}
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None or record.levelno >= logging.ERROR:
+            return True
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.dropped += 1
+            return False
+        second = int(time.monotonic())
+        with self._lock:
+            window, count = self._windows.get(key, (second, 0))
+            if window != second:
+                window, count = second, 0
+            if count >= self.max_per_second:
+                self.dropped += 1
+                return False
+            if key not in self._windows and len(self._windows) >= self.MAX_KEYS:
+                # okna z poprzednich sekund i tak są nieaktualne
+                self.evictions += len(self._windows)
+                self._windows.clear()
+            self._windows[key] = (window, count + 1)
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    W wątku wywołującym tylko wstawia argumenty do komunikatu — zmienne
+    argumenty (dict, dane FSM, listy wierszy) mogą się zmienić, zanim
+    listener je sformatuje. JSON i traceback robi handler listenera.
+    """
+
+    def prepare(self, record):
+        if not record.args:
+            return record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_RESERVED = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "trace", "sample"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "trace", {}))
+        entry.update({k: v for k, v in record.__dict__.items() if k not in _RESERVED})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup(level=logging.INFO, path=None, sample_rate=1.0, max_per_second=50):
+    """
+    Konfiguruje logger główny; zwraca (listener, sampler).
+    listener.stop() przy wyjściu opróżnia kolejkę.
+    """
+    if path:
+        target = logging.handlers.RotatingFileHandler(
+            path, maxBytes=50 * 1024 * 1024, backupCount=5, encoding="utf-8"
+        )
+    else:
+        target = logging.StreamHandler(sys.stderr)
+    target.setFormatter(JsonFormatter())
+
+    q = queue.SimpleQueue()
+    handler = DeferredQueueHandler(q)
+    sampler = SamplingFilter(sample_rate, max_per_second)
+    handler.addFilter(sampler)
+    handler.addFilter(TraceFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # "Update id=… is handled" zastępuje nasz wpis "update" z kontekstem
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    listener = logging.handlers.QueueListener(q, target, respect_handler_level=True)
+    listener.start()
+    return listener, sampler
@@ -0,0 +1,223 @@
+"""
+Pamięć procesu: rozmiary struktur trzymanych w pamięci (każda ma
+zadeklarowany limit i licznik usuniętych / odrzuconych wpisów), próbki
+tracemalloc z największymi miejscami alokacji i przyrostem od poprzedniej
+próbki, oraz magazyn FSM z limitem kluczy.
+
+Struktury zgłaszają się przez funkcje stats() / cache_stats() modułów:
+{nazwa: {"size": n, "bound": limit albo None, "evictions": n}}.
+"""
+import gc
+import linecache
+import os
+import tracemalloc
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+
+FSM_MAX_KEYS = 10_000
+TOP_ALLOCATIONS = 10
+
+# pomijane w zestawieniu — koszt samego tracemalloc i importów
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+# ------------------------------------------------------------
+#  FSM
+# ------------------------------------------------------------
+
+class BoundedMemoryStorage(MemoryStorage):
+    """
+    MemoryStorage z limitem kluczy. Domyślny defaultdict tworzy rekord przy
+    każdym odczycie stanu, czyli dla każdego użytkownika, który kiedykolwiek
+    napisał; tu pusty rekord (bez stanu i danych) nie jest trzymany, a ponad
+    limit wylatują najdawniej zmieniane porzucone formularze.
+    """
+
+    def __init__(self, max_keys=FSM_MAX_KEYS):
+        super().__init__()
+        self.storage = OrderedDict()
+        self.max_keys = max_keys
+        self.evictions = 0
+
+    def _record(self, key):
+        record = self.storage.get(key)
+        if record is None:
+            record = self.storage[key] = MemoryStorageRecord()
+            while len(self.storage) > self.max_keys:
+                self.storage.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.storage.move_to_end(key)
+        return record
+
+    def _release_empty(self, key, record):
+        if record.state is None and not record.data:
+            self.storage.pop(key, None)
+
+    async def set_state(self, key, state=None):
+        record = self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._release_empty(key, record)
+
+    async def get_state(self, key):
+        record = self.storage.get(key)
+        return record.state if record is not None else None
+
+    async def set_data(self, key, data):
+        record = self._record(key)
+        record.data = data.copy()
+        self._release_empty(key, record)
+
+    async def get_data(self, key):
+        record = self.storage.get(key)
+        return record.data.copy() if record is not None else {}
+
+    def stats(self):
+        return {"fsm": {"size": len(self.storage), "bound": self.max_keys, "evictions": self.evictions}}
+
+
+# ------------------------------------------------------------
+#  PROCES
+# ------------------------------------------------------------
+
+def rss_bytes():
+    """Bieżący RSS z /proc (Linux); gdzie indziej szczyt z getrusage albo None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if os.uname().sysname == "Darwin" else rss * 1024
+
+
+def process_stats():
+    return {
+        "rss": rss_bytes(),
+        "gc_objects": len(gc.get_objects()),
+        "gc_counts": gc.get_count(),
+    }
+
+
+# ------------------------------------------------------------
+#  TRACEMALLOC
+# ------------------------------------------------------------
+
+def _where(stat):
+    """Plik względem site-packages / katalogu bota, żeby linia była krótka."""
+    frame = stat.traceback[0]
+    name = frame.filename
+    for prefix in ("site-packages" + os.sep, os.getcwd() + os.sep, os.path.dirname(os.__file__) + os.sep):
+        if prefix in name:
+            name = name.split(prefix, 1)[1]
+            break
+    return f"{name}:{frame.lineno}"
+
+
+class MemorySampler:
+    """
+    Próbki tracemalloc. Trzymana jest tylko ostatnia migawka (do porównania
+    z następną), więc sam sampler nie rośnie z czasem pracy.
+    """
+
+    def __init__(self, frames=1, top=TOP_ALLOCATIONS):
+        self.frames = frames
+        self.top = top
+        self._snapshot = None
+        self.latest = None
+        self.samples = 0
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def sample(self):
+        """Migawka: bieżąca / szczytowa pamięć śledzona, top alokacji i przyrost."""
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        current, peak = tracemalloc.get_traced_memory()
+        top = snapshot.statistics("lineno")[:self.top]
+        growth = []
+        if self._snapshot is not None:
+            growth = [
+                s for s in snapshot.compare_to(self._snapshot, "lineno")[:self.top]
+                if s.size_diff > 0
+            ]
+        self._snapshot = snapshot
+        self.samples += 1
+        self.latest = {
+            "traced": current,
+            "peak": peak,
+            "top": [{"where": _where(s), "size": s.size, "count": s.count} for s in top],
+            "growth": [
+                {"where": _where(s), "size_diff": s.size_diff, "count_diff": s.count_diff}
+                for s in growth
+            ],
+        }
+        return self.latest
+
+
+# ------------------------------------------------------------
+#  RAPORT
+# ------------------------------------------------------------
+
+def fmt_bytes(n):
+    if n is None:
+        return "-"
+    for unit in ("B", "KB", "MB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def near_bound(structures, ratio=0.9):
+    """Struktury zapełnione w co najmniej `ratio` limitu."""
+    return [
+        name for name, s in structures.items()
+        if s["bound"] and s["size"] >= s["bound"] * ratio
+    ]
+
+
+def format_report(process, structures, sample=None):
+    lines = [
+        f"RSS: {fmt_bytes(process['rss'])}",
+        f"Obiekty GC: {process['gc_objects']} (generacje {process['gc_counts']})",
+        "",
+        "Struktura: rozmiar / limit, usunięte",
+    ]
+    for name, s in sorted(structures.items()):
+        bound = s["bound"] if s["bound"] is not None else "—"
+        lines.append(f"  {name}: {s['size']} / {bound}, {s['evictions']}")
+
+    if sample is None:
+        lines += ["", "tracemalloc wyłączony (MEMSTATS_INTERVAL_MINUTES=0)."]
+        return "\n".join(lines)
+
+    lines += [
+        "",
+        f"tracemalloc: {fmt_bytes(sample['traced'])} (szczyt {fmt_bytes(sample['peak'])})",
+        "Największe alokacje:",
+    ]
+    lines += [f"  {t['where']}: {fmt_bytes(t['size'])} ({t['count']})" for t in sample["top"]]
+    if sample["growth"]:
+        lines.append("Przyrost od poprzedniej próbki:")
+        lines += [
+            f"  {g['where']}: +{fmt_bytes(g['size_diff'])} ({g['count_diff']:+d})"
+            for g in sample["growth"]
+        ]
+    return "\n".join(lines)
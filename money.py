@@ -0,0 +1,45 @@
+"""
+Kwoty jako liczby całkowite w groszach, stawki (VAT, prowizja) w punktach
+bazowych (2300 = 23%). Bez float — sumy i podatki są dokładne.
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+BP = 10_000   # 100% w punktach bazowych
+MAX_GROSZE = 10_000_000_000   # 100 mln zł — górna granica pojedynczej kwoty
+
+
+def parse(text, limit=MAX_GROSZE):
+    """'1 234,50' -> 123450. ValueError dla ujemnych, > 2 miejsc po przecinku i ponad `limit` groszy."""
+    cleaned = (text or "").replace(" ", "").replace(" ", "").replace(",", ".")
+    try:
+        value = Decimal(cleaned)
+    except InvalidOperation:
+        raise ValueError(text) from None
+    # limit przed quantize — '1e30' przekracza precyzję Decimal i INTEGER SQLite
+    if not value.is_finite() or value < 0 or value * 100 > limit:
+        raise ValueError(text)
+    if value != value.quantize(Decimal("0.01")):
+        raise ValueError(text)
+    return int(value * 100)
+
+
+def from_float(value):
+    """Stara kwota REAL (złote) -> grosze; repr() daje najkrótszy zapis dziesiętny."""
+    if value is None:
+        return None
+    return int((Decimal(repr(float(value))) * 100).quantize(Decimal("1"), ROUND_HALF_UP))
+
+
+def apply_rate(grosze, bp):
+    """Część kwoty wg stawki, zaokrąglona do grosza (połówki w górę)."""
+    return (grosze * bp + BP // 2) // BP
+
+
+def fmt(grosze):
+    sign = "-" if grosze < 0 else ""
+    zl, gr = divmod(abs(grosze), 100)
+    return f"{sign}{zl}.{gr:02d}"
+
+
+def fmt_rate(bp):
+    return f"{Decimal(bp) / 100:f}".rstrip("0").rstrip(".") + "%"
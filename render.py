@@ -0,0 +1,130 @@
+"""
+Wspólne formatowanie kart samochodów i podsumowań zgłoszeń.
+
+Wyrenderowany tekst jest trzymany w pamięci pod kluczem ID wiersza razem
+z wersją wiersza z db.row_version(). Każdy zapis w db.py podbija wersję,
+więc karta po zmianie renderuje się od nowa, a bez zmian wraca z cache
+bez odczytu z bazy.
+"""
+from collections import OrderedDict
+
+import db
+import money
+
+CACHE_SIZE = 1000
+
+_cache = OrderedDict()   # (rodzaj, plik, id) -> (wersja, tekst)
+_evictions = 0
+
+
+def _get(key, version):
+    entry = _cache.get(key)
+    if entry is not None and entry[0] == version:
+        _cache.move_to_end(key)
+        return entry[1]
+    return None
+
+
+def _put(key, version, text):
+    global _evictions
+    _cache[key] = (version, text)
+    _cache.move_to_end(key)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+        _evictions += 1
+    return text
+
+
+def clear():
+    _cache.clear()
+
+
+def cache_stats():
+    return {"render": {"size": len(_cache), "bound": CACHE_SIZE, "evictions": _evictions}}
+
+
+# ---------- FORMATY ----------
+
+def format_car(car):
+    return (
+        f"ID: {car['id']}\n"
+        f"Numer: {car['plate'] or '-'}\n"
+        f"VIN: {car['vin']}\n"
+        f"Model: {car['model'] or '-'}\n"
+        f"Firma: {car['owner_company'] or '-'}\n"
+        f"Paliwo: {car['fuel_type'] or '-'}\n"
+        f"Rok: {car['year']} | Przebieg: {car['mileage']} km"
+    )
+
+
+def money_lines(cost_net_gr, vat_bp):
+    """Netto / VAT / brutto z kwoty w groszach i stawki VAT z ustawień."""
+    vat = money.apply_rate(cost_net_gr, vat_bp)
+    return (
+        f"NETTO: {money.fmt(cost_net_gr)}\n"
+        f"VAT {money.fmt_rate(vat_bp)}: {money.fmt(vat)}\n"
+        f"BRUTTO: {money.fmt(cost_net_gr + vat)}"
+    )
+
+
+def format_service(svc, vat_bp):
+    text = (
+        f"Samochód: {svc['plate'] or '-'}\n"
+        f"VIN: {svc['vin'] or '-'}\n"
+        f"Firma: {svc['owner_company'] or '-'}\n"
+        f"Opis: {svc['description'] or '-'}\n"
+        f"Data/godzina: {svc['desired_at'] or '-'}"
+    )
+    if svc["status"] == "done":
+        text += (
+            f"\nKońcowy przebieg: {svc['final_mileage']} km\n"
+            f"{money_lines(svc['cost_net_gr'] or 0, vat_bp)}\n"
+            f"Komentarz mechanika: {svc['comments'] or '—'}"
+        )
+    return text
+
+
+# ---------- CACHE ----------
+
+def car_card(path, car_id, row=None):
+    """
+    Karta samochodu. `row` — świeżo odczytany wiersz (lub dict z tymi samymi
+    polami), jeśli handler już go ma; wtedy nie czytamy bazy.
+    """
+    key = ("car", db._cache_key(path), car_id)
+    version = db.row_version(path, "car", car_id)
+    text = _get(key, version)
+    if text is not None:
+        return text
+
+    car = row if row is not None else db.get_car_by_id(path, car_id)
+    if car is None:
+        return None
+    return _put(key, version, format_car(car))
+
+
+def service_summary(path, svc_id, row=None):
+    """
+    Podsumowanie zgłoszenia; zależy też od wersji auta (numer, VIN, firma)
+    i ustawień (stawka VAT).
+    """
+    key = ("service", db._cache_key(path), svc_id)
+    entry = _cache.get(key)
+    if entry is not None:
+        (svc_version, car_id, car_version, settings_version), text = entry
+        if (svc_version == db.row_version(path, "service", svc_id)
+                and car_version == db.row_version(path, "car", car_id)
+                and settings_version == db.row_version(path, "settings", 0)):
+            _cache.move_to_end(key)
+            return text
+
+    svc = row if row is not None else db.get_service(path, svc_id)
+    if svc is None:
+        return None
+    version = (
+        db.row_version(path, "service", svc_id),
+        svc["car_id"],
+        db.row_version(path, "car", svc["car_id"]),
+        db.row_version(path, "settings", 0),
+    )
+    return _put(key, version, format_service(svc, db.get_rates(path)["vat_bp"]))
@@ -0,0 +1,243 @@
+"""
+Odtwarzanie nagranego ruchu (capture.py) przez Dispatcher na kopii bazy,
+z FakeSession zamiast Bot API — bez sieci. Tempo nagrania albo
+przyspieszone, opcjonalnie pod profilerem.
+
+    python replay.py captures/ --db fleet.db --salt SEKRET --speed 10
+    python replay.py captures/ --db fleet.db --salt SEKRET --speed 0 --profile cprofile --out replay.prof
+    python replay.py captures/updates.jsonl.3.gz --speed 0 --profile sample --out stacks.txt
+
+--speed 1 = tempo nagrania, 10 = dziesięć razy szybciej, 0 = bez przerw.
+--salt (CAPTURE_SALT z nagrania) anonimizuje kopię bazy tak samo jak ruch;
+bez niej odtworzone aktualizacje trafiają na nieznanych użytkowników.
+
+cProfile widzi tylko wątek pętli zdarzeń; zapytania SQLite wykonywane przez
+asyncio.to_thread pokazuje --profile sample (wszystkie wątki, zwinięte stosy
+dla flamegraph.pl / speedscope). Zewnętrzny profiler też działa:
+py-spy record -o replay.svg -- python replay.py ...
+"""
+import argparse
+import asyncio
+import cProfile
+import glob
+import json
+import os
+import pstats
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import capture
+import db
+
+FAKE_TOKEN = "123456:FAKE-TOKEN-FOR-REPLAY"
+
+# najgłębsze ramki wątków czekających na pracę — nie są gorącą ścieżką
+_IDLE = {"select", "wait", "_worker", "get", "_wait_for_tstate_lock"}
+
+
+class StackSampler:
+    """Profiler próbkujący: co `interval` s zapisuje stosy wszystkich wątków."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own or frame.f_code.co_name in _IDLE:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def prepare_db(source, dest, salt=None):
+    """Spójna kopia bazy (API backup) i archiwów; z solą — zanonimizowana jak nagranie."""
+    db.backup_db(source, dest, pages=-1)
+    base, ext = os.path.splitext(source)
+    ext = ext or ".db"
+    for archive in glob.glob(f"{base}_archive_*{ext}"):
+        year = archive[len(base) + len("_archive_"):-len(ext)]
+        db.backup_db(archive, db.archive_path(dest, year), pages=-1)
+    db.init_db(dest)
+    conn = db.get_connection(dest)
+    conn.execute("PRAGMA journal_mode = WAL")  # backup_db zapisuje kopię w trybie DELETE
+    conn.close()
+    if salt:
+        capture.anonymize_db(dest, salt)
+        for archive in glob.glob(f"{os.path.splitext(dest)[0]}_archive_*"):
+            capture.anonymize_db(archive, salt)
+        db.rebuild_kpi(dest)
+
+
+def kind_of(update):
+    """Do zestawienia czasów: komenda, prefiks callbacku albo rodzaj wiadomości."""
+    if update.message is not None:
+        text = update.message.text or ""
+        if text.startswith("/"):
+            return text.split()[0].split("@")[0]
+        return "photo" if update.message.photo else "document" if update.message.document else "text"
+    if update.callback_query is not None:
+        return "cb:" + (update.callback_query.data or "").split(":")[0]
+    return update.event_type
+
+
+def _stats(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "median_ms": round(statistics.median(samples) * 1000, 2),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+        "max_ms": round(samples[-1] * 1000, 2),
+    }
+
+
+async def replay(entries, speed=1.0, latency=0.0, throttle=True, profiler=None, limit=None):
+    import bot
+    from aiogram.types import Update
+
+    from fakebot import FakeSession
+
+    bot.bot.session = FakeSession(latency=latency)
+    await bot.startup()
+    if not throttle:
+        bot.dp.message.outer_middleware.unregister(bot.throttle)
+        bot.dp.callback_query.outer_middleware.unregister(bot.throttle)
+
+    timings = defaultdict(list)
+    errors = Counter()
+    tasks = set()
+
+    async def one(update):
+        kind = kind_of(update)
+        started = time.perf_counter()
+        try:
+            await bot.dp.feed_update(bot.bot, update)
+        except Exception as e:
+            errors[f"{kind}: {type(e).__name__}"] += 1
+        timings[kind].append(time.perf_counter() - started)
+
+    if profiler is not None:
+        profiler.enable()
+    started = time.monotonic()
+    first_ts = None
+    count = 0
+    for ts, raw in entries:
+        if limit is not None and count >= limit:
+            break
+        if speed > 0:
+            first_ts = ts if first_ts is None else first_ts
+            delay = (ts - first_ts) / speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # jak polling aiogram: przy pełnej kolejce odbiór czeka (IntakeBackpressure),
+        # potem każda aktualizacja jako osobne zadanie
+        await bot.update_isolation.wait_for_capacity()
+        task = asyncio.create_task(one(Update.model_validate(raw, context={"bot": bot.bot})))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        count += 1
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    # raporty, rozsyłki i kopie działają w tle, poza handlerem
+    while bot.background:
+        await asyncio.gather(*bot.background, return_exceptions=True)
+    await bot.mechanic_digest.flush_all()
+    elapsed = time.monotonic() - started
+    if profiler is not None:
+        profiler.disable()
+
+    return {
+        "updates": count,
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(count / elapsed, 1) if elapsed else None,
+        "api_calls": dict(bot.bot.session.calls),
+        "errors": dict(errors),
+        "queue": bot.update_isolation.metrics(),
+        "by_kind": {
+            kind: _stats(samples)
+            for kind, samples in sorted(timings.items(), key=lambda kv: -sum(kv[1]))
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", nargs="+", help="katalog nagrania albo pliki updates.jsonl[.N.gz]")
+    parser.add_argument("--db", default="fleet.db")
+    parser.add_argument("--salt", default=os.getenv("CAPTURE_SALT"))
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="sekundy na wywołanie Bot API")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--no-throttle", action="store_true", help="bez limitów zapytań (przy --speed > 1)")
+    parser.add_argument("--profile", choices=("cprofile", "sample"))
+    parser.add_argument("--interval", type=float, default=0.005, help="okres próbkowania (--profile sample)")
+    parser.add_argument("--out", help="plik profilu (.prof albo zwinięte stosy)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "fleet.db")
+        prepare_db(args.db, path, args.salt)
+        # przed importem bot.py (load_dotenv nie nadpisuje ustawionych zmiennych)
+        os.environ.update(
+            BOT_TOKEN=FAKE_TOKEN, DB_PATH=path, TENANTS="", CAPTURE_DIR="",
+            ATTACHMENTS_DIR=os.path.join(tmp, "attachments"), BACKUP_DIR=os.path.join(tmp, "backups"),
+        )
+
+        profiler = cProfile.Profile() if args.profile == "cprofile" else None
+        sampler = StackSampler(args.interval) if args.profile == "sample" else None
+        if sampler is not None:
+            sampler.start()
+        entries = capture.read_capture(args.capture)
+        result = asyncio.run(replay(
+            entries, args.speed, args.latency, not args.no_throttle, profiler, args.limit,
+        ))
+        if sampler is not None:
+            sampler.stop()
+        db.close_pools()
+
+    if profiler is not None:
+        if args.out:
+            profiler.dump_stats(args.out)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+    if sampler is not None:
+        result["samples"] = sampler.samples
+        if args.out:
+            sampler.write(args.out)
+        else:
+            for stack, n in sampler.stacks.most_common(10):
+                print(f"{n:6} {stack}", file=sys.stderr)
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
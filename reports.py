@@ -0,0 +1,186 @@
+"""
+Silnik raportów: ciężkie zapytania na osobnych połączeniach tylko do
+odczytu (migawka WAL), w puli wątków, z limitem czasu i anulowaniem.
+
+Limit i anulowanie są sprawdzane przez progress handler SQLite, więc
+przerwane zapytanie kończy się od razu, a nie po przeczytaniu całej
+tabeli. Raport to funkcja fn(path, *args, conn=...) — te same funkcje
+z db.py / analytics.py, które przyjmują opcjonalne połączenie.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import db
+
+logger = logging.getLogger("fleet_bot.reports")
+
+DEFAULT_DEADLINE = 15.0
+PROGRESS_STEPS = 10_000   # instrukcji VM SQLite między sprawdzeniami
+MAX_JOBS = 32             # raportów w toku i w kolejce puli wątków
+
+OK = "ok"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+ERROR = "error"
+BUSY = "busy"
+
+
+class ReportResult:
+    def __init__(self, status, value=None, elapsed=0.0, error=None):
+        self.status = status
+        self.value = value
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status == OK
+
+
+class ReportJob:
+    def __init__(self, deadline, owner=None, key=None):
+        self.deadline = time.monotonic() + deadline
+        self.owner = owner
+        self.key = key
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def interrupted(self):
+        return self.cancelled.is_set() or time.monotonic() > self.deadline
+
+
+def open_snapshot(path, job):
+    """
+    Połączenie tylko do odczytu z dołączonymi archiwami i otwartą
+    transakcją odczytu — raport widzi jeden spójny stan bazy.
+    """
+    uri = f"file:{os.path.abspath(path)}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.set_progress_handler(lambda: 1 if job.interrupted() else 0, PROGRESS_STEPS)
+
+    for year in db._present_archive_years(conn.cursor(), path):
+        archive = os.path.abspath(db.archive_path(path, year))
+        conn.execute(f"ATTACH DATABASE ? AS archive_{int(year)}", (f"file:{archive}?mode=ro",))
+
+    conn.execute("BEGIN")
+    return conn
+
+
+class ReportEngine:
+    def __init__(self, workers=2, deadline=DEFAULT_DEADLINE, max_jobs=MAX_JOBS):
+        self.deadline = deadline
+        self.max_jobs = max_jobs
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report")
+        self._jobs = set()      # zadania, których wątek jeszcze pracuje
+        self._waiting = {}      # klucz współdzielonego raportu -> {właściciel: liczba oczekujących}
+        self._active = 0
+        self.rejected = 0
+
+    def _execute(self, job, path, fn, args):
+        started = time.monotonic()
+        conn = None
+        try:
+            conn = open_snapshot(path, job)
+            value = fn(path, *args, conn=conn)
+            return ReportResult(OK, value, time.monotonic() - started)
+        except sqlite3.OperationalError as e:
+            elapsed = time.monotonic() - started
+            if job.cancelled.is_set():
+                return ReportResult(CANCELLED, elapsed=elapsed)
+            if job.interrupted():
+                return ReportResult(TIMEOUT, elapsed=elapsed)
+            return ReportResult(ERROR, elapsed=elapsed, error=e)
+        except Exception as e:
+            logger.exception("raport %s nie powiódł się", getattr(fn, "__name__", fn))
+            return ReportResult(ERROR, elapsed=time.monotonic() - started, error=e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def waiting(self, key, owner):
+        """
+        Oznacza `owner` jako oczekującego na współdzielony raport `key`
+        (throttling.Coalescer) — cancel() nie przerwie raportu, na który
+        czeka ktoś jeszcze.
+        """
+        waiters = self._waiting.setdefault(key, {})
+        waiters[owner] = waiters.get(owner, 0) + 1
+        try:
+            yield
+        finally:
+            waiters[owner] -= 1
+            if not waiters[owner]:
+                del waiters[owner]
+            if not waiters:
+                del self._waiting[key]
+
+    def _waiters(self, job):
+        if job.key is not None and job.key in self._waiting:
+            return self._waiting[job.key]
+        return {job.owner: 1} if job.owner is not None else {}
+
+    def _finished(self, job):
+        # miejsce zwalnia dopiero koniec wątku, nie porzucenie wyniku
+        self._jobs.discard(job)
+        self._active -= 1
+
+    async def run(self, path, fn, *args, deadline=None, owner=None, key=None):
+        """
+        Uruchamia raport w puli wątków. Anulowanie zadania asyncio albo
+        cancel(owner) przerywa zapytanie SQLite. Ponad max_jobs raportów
+        w toku (do końca ich wątków) zwraca od razu wynik BUSY.
+        key — klucz współdzielenia, gdy raport jest wołany przez waiting().
+        """
+        if self._active >= self.max_jobs:
+            self.rejected += 1
+            return ReportResult(BUSY)
+        self._active += 1
+        job = ReportJob(deadline or self.deadline, owner, key)
+        self._jobs.add(job)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool, self._execute, job, path, fn, args)
+        future.add_done_callback(lambda _: self._finished(job))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+
+    def cancel(self, owner):
+        """
+        Anuluje raporty, na które czeka wyłącznie `owner`. Zwraca
+        (anulowane, pominięte — współdzielone z innymi użytkownikami).
+        """
+        cancelled = shared = 0
+        for job in list(self._jobs):
+            waiters = self._waiters(job)
+            if owner not in waiters or job.cancelled.is_set():
+                continue
+            if len(waiters) == 1:
+                job.cancel()
+                cancelled += 1
+            else:
+                shared += 1
+        return cancelled, shared
+
+    def running(self):
+        return len(self._jobs)
+
+    def stats(self):
+        return {"reports.jobs": {"size": self._active, "bound": self.max_jobs, "evictions": self.rejected}}
+
+    def shutdown(self):
+        for job in self._jobs:
+            job.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,140 @@
+"""
+Kolejność i współbieżność aktualizacji. Polling aiogram tworzy zadanie na
+każdą aktualizację; kolejne wiadomości jednego czatu (kroki AddCarStates /
+CompleteServiceStates) mogłyby wtedy czytać i zapisywać stan FSM naraz.
+
+ChatIsolation to events_isolation Dispatchera: FSMContextMiddleware odczytuje
+stan i wywołuje handler wewnątrz lock(klucz), więc aktualizacje jednego
+czatu idą ściśle po kolei (zadania dochodzą do blokady w kolejności
+odbioru, asyncio.Lock jest FIFO), różne czaty równolegle — najwyżej
+`max_concurrent` handlerów naraz.
+
+Przeciwciśnienie: przy `high_water` aktualizacjach czekających lub w obsłudze
+IntakeBackpressure (middleware sesji Bot API) wstrzymuje getUpdates do
+spadku poniżej `low_water` — liczba zadań jest ograniczona do progu plus
+jednej paczki getUpdates. Odbiór przez webhook powinien przed feed_update
+czekać na wait_for_capacity().
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.storage.base import BaseEventIsolation
+from aiogram.methods import GetUpdates
+
+logger = logging.getLogger("fleet_bot.scheduler")
+
+MAX_CONCURRENT = 16
+HIGH_WATER = 200
+LOW_WATER = 100
+WAIT_SAMPLES = 1000
+UPDATES_BATCH = 100     # domyślny limit getUpdates
+
+
+class ChatIsolation(BaseEventIsolation):
+    def __init__(self, max_concurrent=MAX_CONCURRENT, high_water=HIGH_WATER, low_water=LOW_WATER):
+        self.max_concurrent = max_concurrent
+        self.high_water = high_water
+        self.low_water = low_water
+        self._sem = asyncio.Semaphore(max_concurrent)
+        self._locks = {}    # (bot_id, chat_id) -> [Lock, liczba oczekujących + obsługiwanych]
+        self._capacity = asyncio.Event()
+        self._capacity.set()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.depth = 0      # czekające + w obsłudze
+        self.running = 0
+        self.max_depth = 0
+        self.handled = 0
+        self.failed = 0
+        self.paused = 0
+        self.paused_seconds = 0.0
+
+    @asynccontextmanager
+    async def lock(self, key):
+        chat = (key.bot_id, key.chat_id)
+        entry = self._locks.get(chat)
+        if entry is None:
+            entry = self._locks[chat] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        if self.depth >= self.high_water:
+            self._capacity.clear()
+
+        enqueued = time.monotonic()
+        try:
+            async with entry[0], self._sem:
+                self._waits.append(time.monotonic() - enqueued)
+                self.running += 1
+                try:
+                    yield
+                except Exception:
+                    self.failed += 1
+                    raise
+                finally:
+                    self.running -= 1
+        finally:
+            self.handled += 1
+            self.depth -= 1
+            if self.depth <= self.low_water:
+                self._capacity.set()
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[chat]
+
+    async def close(self):
+        self._capacity.set()
+
+    async def wait_for_capacity(self):
+        """Wraca od razu albo po spadku kolejki do low_water."""
+        if self._capacity.is_set():
+            return
+        self.paused += 1
+        logger.warning("kolejka aktualizacji pełna (%s) — wstrzymuję odbiór", self.depth)
+        started = time.monotonic()
+        await self._capacity.wait()
+        self.paused_seconds += time.monotonic() - started
+
+    def metrics(self):
+        waits = sorted(self._waits)
+
+        def pct(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 1) if waits else 0.0
+
+        return {
+            "depth": self.depth,
+            "running": self.running,
+            "queued": self.depth - self.running,
+            "chats": len(self._locks),
+            "max_depth": self.max_depth,
+            "handled": self.handled,
+            "failed": self.failed,
+            "paused": self.paused,
+            "paused_seconds": round(self.paused_seconds, 3),
+            "intake_paused": not self._capacity.is_set(),
+            "wait_p50_ms": pct(0.5),
+            "wait_p95_ms": pct(0.95),
+        }
+
+    def stats(self):
+        bound = self.high_water + UPDATES_BATCH
+        return {
+            "scheduler.updates": {"size": self.depth, "bound": bound, "evictions": 0},
+            "scheduler.chats": {"size": len(self._locks), "bound": bound, "evictions": 0},
+            "scheduler.wait_samples": {"size": len(self._waits), "bound": WAIT_SAMPLES, "evictions": 0},
+        }
+
+
+class IntakeBackpressure(BaseRequestMiddleware):
+    """Middleware sesji: getUpdates czeka, aż w kolejce zwolni się miejsce."""
+
+    def __init__(self, isolation):
+        self.isolation = isolation
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, GetUpdates):
+            await self.isolation.wait_for_capacity()
+        return await make_request(bot, method)
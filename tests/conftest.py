@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def path(tmp_path):
+    """Pusta baza z aktualnym schematem."""
+    db_path = str(tmp_path / "fleet.db")
+    db.init_db(db_path)
+    yield db_path
+    db.close_pools()
+
+
+@pytest.fixture
+def cars(path):
+    """Trzy auta dwóch firm: [car_id, ...]."""
+    return [
+        db.add_car(path, f"VIN{i:05d}", 1000 * i, 2020, company, "Model", f"WX{i:04d}", "diesel")
+        for i, company in enumerate(("Alfa", "Alfa", "Beta"), start=1)
+    ]
+
+
+@pytest.fixture
+def done_service(path):
+    """done_service(car_id, koszt_gr, created_at) -> id zakończonego zgłoszenia."""
+    def make(car_id, cost_net_gr, created_at):
+        svc_id = db.create_service(path, car_id, 11, 1, "przegląd", None)
+        db.set_service_result(path, svc_id, 50_000, cost_net_gr, "ok", actor_tg_id=11)
+        conn = db.get_connection(path)
+        conn.execute("UPDATE services SET created_at = ? WHERE id = ?", (created_at, svc_id))
+        conn.commit()
+        conn.close()
+        db.invalidate_services(path, svc_id)
+        return svc_id
+    return make
@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import analytics
+import db
+
+
+def test_result_is_cached_until_dataset_changes(path, cars, done_service):
+    done_service(cars[0], 1_000, "2025-01-10 10:00:00")
+    first = analytics.fleet_analytics(path)
+    assert analytics.fleet_analytics(path) is first
+
+    done_service(cars[1], 2_000, "2025-01-11 10:00:00")
+    second = analytics.fleet_analytics(path)
+    assert second is not first
+    assert second["services"] == 2
+
+
+def test_cache_stays_bounded_across_report_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics, "CACHE_FILES", 2)
+    monkeypatch.setattr(analytics, "_cache", {})
+    paths = [str(tmp_path / f"t{i}.db") for i in range(8)]
+    for p in paths:
+        db.init_db(p)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(analytics.fleet_analytics, paths * 5))
+
+    assert all(r["services"] == 0 for r in results)
+    assert analytics.cache_stats()["analytics"]["size"] == 2
+    db.close_pools()
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import db
+import reports
+
+
+@pytest.fixture
+def archived(path, cars, done_service):
+    """Maj 2023: dwa zgłoszenia w archiwum i jedno w głównej bazie."""
+    old = [done_service(cars[0], 10_000, "2023-05-03 10:00:00"),
+           done_service(cars[1], 2_550, "2023-05-20 10:00:00")]
+    assert db.archive_services(path, older_than_days=365) == {2023: 2}
+    done_service(cars[2], 100, "2023-05-25 10:00:00")
+    return old
+
+
+def snapshot_report(path, fn, *args):
+    job = reports.ReportJob(deadline=reports.time.monotonic() + 10)
+    conn = reports.open_snapshot(path, job)
+    try:
+        return fn(path, *args, conn=conn)
+    finally:
+        conn.close()
+
+
+def test_monthly_report_unions_archive(path, archived):
+    total, commission, rate = db.monthly_report(path, 2023, 5)
+    assert total == 12_650
+    assert commission == (12_650 * rate + 5000) // 10000
+    assert snapshot_report(path, db.monthly_report, 2023, 5) == (total, commission, rate)
+    assert db.monthly_report(path, 2023, 6)[0] == 0
+
+
+def test_archived_service_is_still_readable(path, archived):
+    svc = db.get_service(path, archived[1])
+    assert svc["cost_net_gr"] == 2_550
+    assert svc["status"] == "done"
+
+
+def test_missing_archive_file_is_skipped(path, archived):
+    archive = db.archive_path(path, 2023)
+    db.close_pools()
+    os.rename(archive, archive + ".moved")
+
+    assert db.monthly_report(path, 2023, 5)[0] == 100
+    assert snapshot_report(path, db.monthly_report, 2023, 5)[0] == 100
+    assert len(db.done_services_table(path)) == 1
+    assert len(db.done_services_rows(path)) == 1
+    assert db.get_service(path, archived[0]) is None
+    # ATTACH nie może po cichu utworzyć pustego pliku w miejscu archiwum
+    assert not os.path.exists(archive)
@@ -0,0 +1,50 @@
+import os
+from datetime import datetime, timedelta
+
+import db
+
+
+def test_snapshots_in_the_same_instant_do_not_collide(path, cars, done_service, tmp_path, monkeypatch):
+    done_service(cars[0], 1_000, "2023-02-01 10:00:00")
+    db.archive_services(path, older_than_days=365)
+    backups = str(tmp_path / "backups")
+
+    start = datetime(2025, 6, 1, 3, 0, 0)
+    ticks = iter([start, start, start, start + timedelta(microseconds=1)])
+
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return next(ticks)
+
+    monkeypatch.setattr(db, "datetime", Clock)
+    first = db.snapshot_db(path, backups, keep=2)
+    second = db.snapshot_db(path, backups, keep=2)
+    monkeypatch.undo()
+
+    assert first[0] != second[0]
+    assert first[2] and second[2]
+    for dest, *_, archives in (first, second):
+        assert archives == {2023: True}
+        assert os.path.exists(db.archive_path(dest, 2023))
+
+    third = db.snapshot_db(path, backups, keep=2)
+    assert third[3] == [os.path.basename(first[0])]
+    assert sorted(os.listdir(backups)) == sorted(
+        os.path.basename(p) for dest in (second[0], third[0]) for p in (dest, db.archive_path(dest, 2023))
+    )
+
+
+def test_snapshot_round_trip(path, cars, done_service, tmp_path):
+    archived = done_service(cars[0], 12_000, "2023-02-01 10:00:00")
+    db.archive_services(path, older_than_days=365)
+    recent = done_service(cars[2], 3_000, "2025-04-02 10:00:00")
+
+    dest, _, ok, removed, archives = db.snapshot_db(path, str(tmp_path / "backups"), keep=3)
+
+    assert ok and removed == [] and archives == {2023: True}
+    assert not os.path.exists(dest + "-wal")
+    for svc_id in (archived, recent):
+        assert dict(db.get_service(dest, svc_id)) == dict(db.get_service(path, svc_id))
+    assert db.monthly_report(dest, 2023, 2) == db.monthly_report(path, 2023, 2)
+    assert [dict(c) for c in db.list_cars(dest)] == [dict(c) for c in db.list_cars(path)]
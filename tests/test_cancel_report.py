@@ -0,0 +1,96 @@
+"""
+/cancel_report musi przerwać raport, który liczy się w tym samym czacie —
+handler raportu nie może trzymać blokady czatu (scheduler.ChatIsolation)
+przez cały czas obliczeń.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TMP = tempfile.mkdtemp()
+# przed importem bot.py (load_dotenv nie nadpisuje ustawionych zmiennych)
+os.environ.update(
+    BOT_TOKEN="123456:FAKE-TOKEN-FOR-TESTS", DB_PATH=os.path.join(TMP, "fleet.db"),
+    TENANTS="", CAPTURE_DIR="", REPORT_DEADLINE_SECONDS="30",
+    ATTACHMENTS_DIR=os.path.join(TMP, "attachments"), BACKUP_DIR=os.path.join(TMP, "backups"),
+)
+
+import bot  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+from fakebot import FakeSession  # noqa: E402
+
+USER_ID = 1001
+
+
+class RecordingSession(FakeSession):
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            self.texts.append((time.monotonic(), method.text))
+        return await super().make_request(bot, method, timeout)
+
+
+def slow_report(path, year, month, conn=None):
+    """Zapytanie liczące się wiele sekund — przerywa je tylko progress handler."""
+    conn.execute("""
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)
+        SELECT COUNT(*) FROM (SELECT i FROM n LIMIT 2000000000)
+    """).fetchone()
+    return 0, 0, 0
+
+
+def command(update_id, text):
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(datetime.now().timestamp()),
+            "chat": {"id": USER_ID, "type": "private"},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Admin"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        },
+    }, context={"bot": bot.bot})
+
+
+def reply_after(session, since, prefix):
+    return next((ts for ts, text in session.texts if ts >= since and text.startswith(prefix)), None)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(bot.db, "monthly_report", slow_report)
+    session = RecordingSession()
+    bot.bot.session = session
+    return session
+
+
+def test_cancel_report_interrupts_running_report(session):
+    async def scenario():
+        await bot.startup()
+        report = asyncio.create_task(bot.dp.feed_update(bot.bot, command(1, "/report_month 2025-01")))
+        await asyncio.sleep(0.3)
+
+        sent = time.monotonic()
+        await asyncio.wait_for(bot.dp.feed_update(bot.bot, command(2, "/cancel_report")), 2)
+        await report
+        await asyncio.wait_for(asyncio.gather(*bot.background), 5)
+        return sent
+
+    sent = asyncio.run(scenario())
+    bot.report_engine.shutdown()
+
+    assert reply_after(session, sent, "Przerywam raporty: 1.") is not None
+    assert reply_after(session, sent, "Raport został anulowany.") is not None
@@ -0,0 +1,11 @@
+import db
+
+
+def test_create_services_returns_rows_in_assignment_order(path, cars):
+    assignments = [(cars[2], 11), (cars[0], 12), (cars[1], 11)]
+    rows = db.create_services(path, assignments, 1, "opony", "2025-03-01")
+
+    assert [(r["car_id"], r["mechanic_tg_id"]) for r in rows] == assignments
+    assert [r["owner_company"] for r in rows] == ["Beta", "Alfa", "Alfa"]
+    assert all(r["status"] == "pending" and r["description"] == "opony" for r in rows)
+    assert [r["id"] for r in rows] == [db.get_service(path, r["id"])["id"] for r in rows]
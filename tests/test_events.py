@@ -0,0 +1,45 @@
+import json
+
+import db
+
+
+def execute(path, sql, params=()):
+    conn = db.get_connection(path)
+    rows = conn.execute(sql, params).fetchall()
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def kpi_weeks(path):
+    return {(r["week"], r["mechanic_tg_id"]): r["cnt"] for r in execute(path, "SELECT * FROM kpi_mechanic_week")}
+
+
+def test_replay_falls_back_to_event_time_for_null_created_at(path, cars):
+    svc_id = db.create_service(path, cars[0], 11, 1, "olej", None)
+    execute(path, """
+        UPDATE events SET ts = '2024-03-05 08:00:00', payload = json_set(payload, '$.created_at', NULL)
+        WHERE entity = 'service' AND entity_id = ?
+    """, (svc_id,))
+
+    db.rebuild_from_events(path)
+
+    assert kpi_weeks(path) == {("2024-W10", 11): 1}
+
+
+def test_compaction_folds_archived_car_into_snapshot(path, cars):
+    db.update_car_field(path, cars[0], "plate", "WX9999")
+    db.delete_car(path, cars[0])
+    execute(path, "UPDATE events SET ts = '2020-01-01 00:00:00' WHERE entity = 'car' AND entity_id = ?", (cars[0],))
+    db.rebuild_from_events(path)
+    expected = execute(path, "SELECT * FROM kpi_car_service ORDER BY car_id")
+
+    before, after = db.compact_events(path, older_than_days=90)
+
+    rows = execute(path, "SELECT action, payload FROM events WHERE entity = 'car' AND entity_id = ?", (cars[0],))
+    assert [r["action"] for r in rows] == ["snapshot"]
+    state = json.loads(rows[0]["payload"])
+    assert state["plate"] == "WX9999" and state["archived_at"] == "2020-01-01 00:00:00"
+    assert after == before - 2
+    db.rebuild_from_events(path)
+    assert execute(path, "SELECT * FROM kpi_car_service ORDER BY car_id") == expected
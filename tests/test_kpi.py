@@ -0,0 +1,79 @@
+import threading
+import time
+
+import db
+
+
+def company_spend(path):
+    conn = db.get_connection(path)
+    rows = conn.execute("SELECT owner_company, services, total_gr FROM kpi_company_spend").fetchall()
+    conn.close()
+    return {r["owner_company"]: (r["services"], r["total_gr"]) for r in rows}
+
+
+def test_owner_change_moves_archived_spend(path, cars, done_service):
+    done_service(cars[0], 10_000, "2023-05-03 10:00:00")
+    db.archive_services(path, older_than_days=365)
+    done_service(cars[0], 500, "2025-01-10 10:00:00")
+
+    assert db.update_car_field(path, cars[0], "owner_company", "Gamma")
+
+    incremental = company_spend(path)
+    assert incremental == {"Gamma": (2, 10_500)}
+    db.rebuild_kpi(path)
+    assert company_spend(path) == incremental
+
+
+def test_owner_change_counts_service_done_while_waiting_for_lock(path, cars):
+    svc_id = db.create_service(path, cars[0], 11, 1, "olej", None)
+    db.set_service_result(path, db.create_service(path, cars[0], 11, 1, "opony", None), 1, 300, "")
+
+    # inny zapis trzyma blokadę: zgłoszenie kończy się, zanim zmiana firmy dostanie blokadę
+    writer = db.get_connection(path)
+    writer.execute("BEGIN IMMEDIATE")
+    writer.execute("UPDATE services SET status = 'done', cost_net_gr = 700 WHERE id = ?", (svc_id,))
+    writer.execute("UPDATE kpi_company_spend SET services = services + 1, total_gr = total_gr + 700"
+                   " WHERE owner_company = 'Alfa'")
+
+    update = threading.Thread(target=db.update_car_field, args=(path, cars[0], "owner_company", "Gamma"))
+    update.start()
+    time.sleep(0.3)
+    writer.commit()
+    writer.close()
+    update.join()
+
+    assert company_spend(path) == {"Gamma": (2, 1_000)}
+
+
+def kpi_tables(path):
+    conn = db.get_connection(path)
+    tables = {
+        table: sorted(tuple(r) for r in conn.execute(f"SELECT * FROM {table}"))
+        for table in ("kpi_mechanic_week", "kpi_company_spend", "kpi_car_service")
+    }
+    # ścieżka przyrostowa zostawia statusy z licznikiem 0
+    tables["kpi_status"] = sorted(tuple(r) for r in conn.execute("SELECT * FROM kpi_status WHERE cnt != 0"))
+    conn.close()
+    return tables
+
+
+def test_incremental_kpi_matches_both_rebuilds(path, cars):
+    ids = [db.create_service(path, car_id, mech, 1, "przegląd", None)
+           for car_id, mech in zip(cars + cars, (11, 12, 11, 12, 11, 12))]
+    db.update_service_status(path, ids[0], "confirmed", actor_tg_id=11)
+    db.set_service_result(path, ids[0], 10_000, 25_000, "", actor_tg_id=11)
+    db.set_service_result(path, ids[1], 20_000, 13_050, "", actor_tg_id=12)
+    db.set_service_result(path, ids[3], 10_500, 999, "", actor_tg_id=11)
+    db.update_service_status(path, ids[2], "rejected", actor_tg_id=1)
+    db.create_services(path, [(cars[2], 12), (cars[1], 11)], 1, "opony", None)
+    db.update_car_field(path, cars[0], "owner_company", "Beta")
+    db.delete_car(path, cars[1])
+    db.add_car(path, "VIN00009", 0, 2024, "Gamma", "Model", "WX0009", "ev")
+
+    incremental = kpi_tables(path)
+    assert company_spend(path) == {"Alfa": (1, 13_050), "Beta": (2, 25_999)}
+
+    db.rebuild_kpi(path)
+    assert kpi_tables(path) == incremental
+    db.rebuild_from_events(path)
+    assert kpi_tables(path) == incremental
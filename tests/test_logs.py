@@ -0,0 +1,21 @@
+import json
+import logging
+import queue
+
+import logs
+
+
+def test_queued_record_keeps_arguments_from_call_time():
+    q = queue.SimpleQueue()
+    logger = logging.getLogger("fleet_bot.test_logs")
+    logger.propagate = False
+    logger.addHandler(logs.DeferredQueueHandler(q))
+    try:
+        data = {"step": "vin"}
+        logger.warning("stan FSM: %s", data)
+        data["step"] = "mileage"
+    finally:
+        logger.handlers.clear()
+
+    entry = json.loads(logs.JsonFormatter().format(q.get_nowait()))
+    assert entry["msg"] == "stan FSM: {'step': 'vin'}"
@@ -0,0 +1,161 @@
+import sqlite3
+
+import pytest
+
+import db
+
+# schemat sprzed migracji (cars.vin UNIQUE, services.cost_net REAL w złotych)
+BASELINE_SCHEMA = """
+    CREATE TABLE users (tg_id INTEGER PRIMARY KEY, full_name TEXT, role TEXT DEFAULT 'user');
+    CREATE TABLE cars (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, vin TEXT UNIQUE, mileage INTEGER, year INTEGER,
+        owner_company TEXT, model TEXT, plate TEXT, fuel_type TEXT
+    );
+    CREATE TABLE services (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, car_id INTEGER, mechanic_tg_id INTEGER,
+        admin_tg_id INTEGER, description TEXT, desired_at TEXT, status TEXT DEFAULT 'pending',
+        final_mileage INTEGER, cost_net REAL, comments TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (car_id) REFERENCES cars(id)
+    );
+"""
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO cars (vin, mileage, year, owner_company, model, plate, fuel_type) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [("VIN1", 1000, 2019, "Alfa", "Octavia", "WX1", "diesel"),
+         ("VIN2", 2000, 2020, "Beta", "Golf", "WX2", "benzyna")],
+    )
+    conn.commit()
+    conn.close()
+    yield path
+    db.close_pools()
+
+
+def columns(path, table):
+    conn = sqlite3.connect(path)
+    names = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    conn.close()
+    return names
+
+
+def test_cars_soft_delete_migration_keeps_cars(baseline):
+    db.init_db(baseline)
+
+    assert "archived_at" in columns(baseline, "cars")
+    assert [c["vin"] for c in db.list_cars(baseline)] == ["VIN2", "VIN1"]
+    assert db.schema_version(baseline) == db.SCHEMA_VERSION
+
+
+def test_cars_migration_recovers_from_orphan_table(baseline):
+    # pozostałość po przerwanej migracji starszą wersją
+    conn = sqlite3.connect(baseline)
+    conn.execute("CREATE TABLE cars_new (id INTEGER PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+
+    db.init_db(baseline)
+
+    assert "cars_new" not in {r["name"] for r in db.get_connection(baseline).execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert len(db.list_cars(baseline)) == 2
+
+
+def test_cars_migration_failure_rolls_back(baseline, monkeypatch):
+    def failing_rename(conn):
+        # błąd po CREATE TABLE cars_new — wszystko musi się wycofać
+        real_cursor = conn.cursor
+
+        class Cursor:
+            def __init__(self):
+                self._cur = real_cursor()
+
+            def execute(self, sql, *args):
+                if sql.startswith("ALTER TABLE cars_new"):
+                    raise sqlite3.OperationalError("disk I/O error")
+                return self._cur.execute(sql, *args)
+
+            def __getattr__(self, name):
+                return getattr(self._cur, name)
+
+        monkeypatch.setattr(conn, "cursor", Cursor, raising=False)
+        return original(conn)
+
+    original = db._migrate_cars_soft_delete
+    monkeypatch.setattr(db, "_migrate_cars_soft_delete", failing_rename)
+    with pytest.raises(sqlite3.OperationalError):
+        db.init_db(baseline)
+
+    tables = columns(baseline, "cars")
+    assert "archived_at" not in tables
+    conn = sqlite3.connect(baseline)
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'cars_new'").fetchone() is None
+    conn.close()
+
+
+COSTS = [123.45, 0.1, 19.99, None, 1234567.89]
+
+
+def add_services(path, table="services"):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        f"INSERT INTO {table} (car_id, mechanic_tg_id, status, cost_net, created_at) VALUES (1, 7, ?, ?, ?)",
+        [("done" if cost is not None else "pending", cost, "2023-05-10 12:00:00") for cost in COSTS],
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_money_migration_converts_to_grosze(baseline):
+    add_services(baseline)
+
+    db.init_db(baseline)
+
+    assert "cost_net" not in columns(baseline, "services")
+    costs = [db.get_service(baseline, svc_id)["cost_net_gr"] for svc_id in range(1, len(COSTS) + 1)]
+    assert costs == [12345, 10, 1999, None, 123456789]
+    assert db.monthly_report(baseline, 2023, 5)[0] == 12345 + 10 + 1999 + 123456789
+
+
+def test_money_migration_converts_archives(baseline):
+    conn = sqlite3.connect(baseline)
+    conn.execute("CREATE TABLE archive_years (year INTEGER PRIMARY KEY, rows INTEGER, archived_at TEXT)")
+    conn.execute("INSERT INTO archive_years (year, rows) VALUES (2023, ?)", (len(COSTS),))
+    conn.commit()
+    conn.close()
+    archive = db.archive_path(baseline, 2023)
+    conn = sqlite3.connect(archive)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+    add_services(archive)
+
+    db.init_db(baseline)
+
+    assert "cost_net" not in columns(archive, "services")
+    assert db.monthly_report(baseline, 2023, 5)[0] == 12345 + 10 + 1999 + 123456789
+
+
+def test_money_migration_failure_keeps_zlote(baseline, monkeypatch):
+    add_services(baseline)
+
+    def failing_kpi(cur):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(db, "_migrate_kpi_spend_to_grosze", failing_kpi)
+    with pytest.raises(sqlite3.OperationalError):
+        db.init_db(baseline)
+
+    assert "cost_net" in columns(baseline, "services")
+    conn = sqlite3.connect(baseline)
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'services_new'").fetchone() is None
+    assert [r[0] for r in conn.execute("SELECT cost_net FROM services ORDER BY id")] == COSTS
+    conn.close()
+
+    monkeypatch.undo()
+    db.init_db(baseline)
+    assert db.get_service(baseline, 1)["cost_net_gr"] == 12345
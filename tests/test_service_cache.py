@@ -0,0 +1,60 @@
+import db
+
+
+def misses():
+    return db.service_cache_stats()["misses"]
+
+
+def test_cached_service_is_reused(path, cars):
+    svc_id = db.create_service(path, cars[0], 11, 1, "olej", None)
+    first = db.get_service(path, svc_id)
+    before = misses()
+    assert db.get_service(path, svc_id) is first
+    assert misses() == before
+
+
+def test_service_result_invalidates_entry(path, cars):
+    svc_id = db.create_service(path, cars[0], 11, 1, "olej", None)
+    assert db.get_service(path, svc_id)["status"] == "pending"
+
+    db.set_service_result(path, svc_id, 12_000, 45_000, "wymiana oleju")
+
+    svc = db.get_service(path, svc_id)
+    assert (svc["status"], svc["cost_net_gr"], svc["final_mileage"]) == ("done", 45_000, 12_000)
+
+
+def test_car_change_invalidates_joined_fields(path, cars):
+    svc_id = db.create_service(path, cars[0], 11, 1, "olej", None)
+    assert db.get_service(path, svc_id)["plate"] == "WX0001"
+
+    db.update_car_field(path, cars[0], "plate", "KR1234")
+
+    assert db.get_service(path, svc_id)["plate"] == "KR1234"
+
+
+def test_archived_service_is_reloaded_from_archive(path, cars, done_service):
+    svc_id = done_service(cars[0], 9_900, "2023-04-01 10:00:00")
+    assert db.get_service(path, svc_id)["cost_net_gr"] == 9_900
+
+    assert db.archive_services(path, older_than_days=365) == {2023: 1}
+    before = misses()
+    svc = db.get_service(path, svc_id)
+
+    assert misses() == before + 1
+    assert (svc["cost_net_gr"], svc["plate"]) == (9_900, "WX0001")
+
+
+def test_lru_evicts_least_recently_used(path, cars, monkeypatch):
+    monkeypatch.setattr(db, "SERVICE_CACHE_SIZE", 2)
+    ids = [db.create_service(path, car_id, 11, 1, "olej", None) for car_id in cars]
+
+    db.get_service(path, ids[0])
+    db.get_service(path, ids[1])
+    db.get_service(path, ids[0])     # ids[1] staje się najstarszy
+    db.get_service(path, ids[2])
+
+    before = misses()
+    db.get_service(path, ids[0])
+    assert misses() == before
+    db.get_service(path, ids[1])
+    assert misses() == before + 1
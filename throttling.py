@@ -0,0 +1,166 @@
+"""
+Ochrona przed zalewem zapytań: kubełki tokenów na użytkownika (budżet
+zależny od roli) i osobno na ciężkie komendy, oraz łączenie identycznych
+zapytań w toku (jedno obliczenie, wielu oczekujących).
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+from broadcast import RateLimiter
+
+# budżety: zdarzeń na minutę / wielkość zrywu
+DEFAULT_ROLE_BUDGETS = {
+    "admin": (120, 30),
+    "mechanic": (60, 15),
+    "user": (30, 10),
+}
+DEFAULT_COMMAND_BUDGETS = {
+    "report_month": (6, 2),
+    "analytics": (6, 2),
+    "dashboard": (12, 3),
+    "list_cars": (12, 3),
+    "my_jobs": (20, 5),
+    "archive": (2, 1),
+    "backup": (2, 1),
+    "broadcast": (2, 1),
+    "service_batch": (4, 2),
+}
+MAX_KEYS = 10_000
+MAX_INFLIGHT = 256
+WARN_INTERVAL = 10.0
+
+
+def parse_budgets(spec, defaults):
+    """'admin=120/30,user=30/10' -> {rola: (na minutę, zryw)} na bazie `defaults`."""
+    budgets = dict(defaults)
+    for item in filter(None, (s.strip() for s in (spec or "").split(","))):
+        name, _, value = item.partition("=")
+        per_minute, _, burst = value.partition("/")
+        per_minute = float(per_minute)
+        budgets[name.strip()] = (per_minute, float(burst) if burst else max(1.0, per_minute / 4))
+    return budgets
+
+
+def command_of(event):
+    """Nazwa komendy z wiadomości ('/report_month@bot 2025-01' -> 'report_month')."""
+    if isinstance(event, Message) and event.text and event.text.startswith("/"):
+        return event.text.split()[0][1:].split("@")[0].lower()
+    return None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, role_of, role_budgets=None, command_budgets=None, max_keys=MAX_KEYS):
+        """
+        role_of: funkcja tg_id -> rola (budżet z role_budgets, nieznana = 'user')
+        """
+        self.role_of = role_of
+        self.role_budgets = role_budgets or DEFAULT_ROLE_BUDGETS
+        self.command_budgets = command_budgets or DEFAULT_COMMAND_BUDGETS
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._warned = {}
+        self.allowed = 0
+        self.throttled = 0
+        self.evictions = 0
+
+    def _bucket(self, key, budget):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            per_minute, burst = budget
+            bucket = self._buckets[key] = RateLimiter(rate=per_minute / 60, burst=burst)
+            if len(self._buckets) > self.max_keys:
+                old, _ = self._buckets.popitem(last=False)
+                self._warned.pop(old[0], None)
+                self.evictions += 1
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def stats(self):
+        return {
+            "throttle.buckets": {"size": len(self._buckets), "bound": self.max_keys, "evictions": self.evictions},
+            "throttle.warned": {"size": len(self._warned), "bound": self.max_keys, "evictions": self.evictions},
+        }
+
+    def check(self, tg_id, command=None):
+        """Zwraca 0, jeśli wolno, albo liczbę sekund do odblokowania."""
+        role = self.role_of(tg_id)
+        budget = self.role_budgets.get(role, self.role_budgets["user"])
+        buckets = [self._bucket((tg_id, None), budget)]
+        if command in self.command_budgets:
+            buckets.append(self._bucket((tg_id, command), self.command_budgets[command]))
+
+        blocked = [b for b in buckets if b.retry_in() > 0]
+        if blocked:
+            return max(b.retry_in() for b in blocked)
+        for b in buckets:
+            b.try_acquire()
+        return 0
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, "from_user", None)
+        if user is None:
+            return await handler(event, data)
+
+        command = command_of(event)
+        wait = self.check(user.id, command)
+        if not wait:
+            self.allowed += 1
+            return await handler(event, data)
+
+        self.throttled += 1
+        text = f"⏳ Zbyt wiele zapytań. Spróbuj ponownie za {math.ceil(wait)} s."
+        if isinstance(event, CallbackQuery):
+            await event.answer(text)
+            return None
+        # ostrzeżenie najwyżej raz na WARN_INTERVAL, żeby nie odpowiadać na każdy spam
+        now = time.monotonic()
+        if now - self._warned.get(user.id, 0) >= WARN_INTERVAL:
+            self._warned[user.id] = now
+            await event.answer(text)
+        return None
+
+
+class Coalescer:
+    """
+    Identyczne zapytania w toku (ten sam klucz) dzielą jedno obliczenie.
+    Anulowanie jednego oczekującego nie przerywa obliczenia pozostałym.
+    Ponad `max_inflight` różnych kluczy zapytania liczą się bez łączenia.
+    """
+
+    def __init__(self, max_inflight=MAX_INFLIGHT):
+        self.max_inflight = max_inflight
+        self._inflight = {}
+        self.started = 0
+        self.shared = 0
+        self.bypassed = 0
+
+    def inflight(self):
+        return len(self._inflight)
+
+    def stats(self):
+        return {"coalescer": {"size": len(self._inflight), "bound": self.max_inflight, "evictions": self.bypassed}}
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def run(self, key, factory):
+        """factory: funkcja bez argumentów zwracająca korutynę."""
+        task = self._inflight.get(key)
+        if task is None and len(self._inflight) >= self.max_inflight:
+            self.bypassed += 1
+            return await factory()
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)